@@ -1,5 +1,5 @@
 import React, { useState, useRef, KeyboardEvent } from 'react';
-import { Send, Paperclip, X, Loader2 } from 'lucide-react';
+import { Send, Paperclip, X, Loader2, Square } from 'lucide-react';
 import { Button } from '@/components/ui/button';
 import { Textarea } from '@/components/ui/textarea';
 import { useChat } from '@/contexts/ChatContext';
@@ -12,7 +12,7 @@ const ChatInput: React.FC = () => {
   const [uploadProgress, setUploadProgress] = useState(0);
   const textareaRef = useRef<HTMLTextAreaElement>(null);
   const fileInputRef = useRef<HTMLInputElement>(null);
-  const { sendMessage: chatSendMessage, isThinking, isConnected, isAuthenticated } = useChat();
+  const { sendMessage: chatSendMessage, cancelQuery, isThinking, queuePosition, isConnected, isAuthenticated } = useChat();
 
   const handleSubmit = async (e: React.FormEvent) => {
     e.preventDefault();
@@ -118,6 +118,7 @@ const ChatInput: React.FC = () => {
   const getPlaceholder = () => {
     if (!isConnected) return "Connecting to server...";
     if (!isAuthenticated) return "Please authenticate first...";
+    if (isThinking && queuePosition !== null) return `Waiting for a free slot (position ${queuePosition})...`;
     if (isThinking) return "Copilot is processing...";
     if (selectedFiles.length > 0) return "Add a message about these files...";
     return "Ask Incorta Nexus...";
@@ -213,19 +214,31 @@ const ChatInput: React.FC = () => {
               >
                 <Paperclip className="h-4 w-4" />
               </Button>
-              <Button
-                type="submit"
-                disabled={(!message.trim() && selectedFiles.length === 0) || isThinking || isDisabled}
-                size="sm"
-                className="h-8 w-8 p-0 rounded-md"
-                title="Send message"
-              >
-                {isThinking || isUploading ? (
-                  <Loader2 className="h-4 w-4 animate-spin" />
-                ) : (
-                  <Send className="h-4 w-4" />
-                )}
-              </Button>
+              {isThinking ? (
+                <Button
+                  type="button"
+                  onClick={cancelQuery}
+                  size="sm"
+                  className="h-8 w-8 p-0 rounded-md"
+                  title="Stop generating"
+                >
+                  <Square className="h-4 w-4" />
+                </Button>
+              ) : (
+                <Button
+                  type="submit"
+                  disabled={(!message.trim() && selectedFiles.length === 0) || isDisabled}
+                  size="sm"
+                  className="h-8 w-8 p-0 rounded-md"
+                  title="Send message"
+                >
+                  {isUploading ? (
+                    <Loader2 className="h-4 w-4 animate-spin" />
+                  ) : (
+                    <Send className="h-4 w-4" />
+                  )}
+                </Button>
+              )}
             </div>
           </div>
         </form>
@@ -1,6 +1,6 @@
 import React, { useState, useMemo } from 'react';
 import { ChevronDown, ChevronRight, CheckCircle, Copy, Database, Table, Eye } from 'lucide-react';
-import { ChatMessage } from '@/contexts/ChatContext';
+import { ChatMessage, useChat } from '@/contexts/ChatContext';
 import { Button } from '@/components/ui/button';
 import { Badge } from '@/components/ui/badge';
 import { ScrollArea } from '@/components/ui/scroll-area';
@@ -14,6 +14,8 @@ interface ToolResultDisplayProps {
 const ToolResultDisplay: React.FC<ToolResultDisplayProps> = ({ message }) => {
   const [isExpanded, setIsExpanded] = useState(true); // Default to expanded so users can see the result
   const [copySuccess, setCopySuccess] = useState(false);
+  const { loadToolResultPage } = useChat();
+  const paging = message.paging;
 
   const parseAndFormat = useMemo(() => {
     if (!message.result) return null;
@@ -234,6 +236,26 @@ const ToolResultDisplay: React.FC<ToolResultDisplayProps> = ({ message }) => {
               </div>
               
               {renderFormattedData()}
+
+              {paging && paging.loadedPages < paging.total_pages && (
+                <div className="mt-2 flex items-center justify-between text-xs text-muted-foreground">
+                  <span>
+                    {paging.total_rows !== undefined
+                      ? `Showing ${Math.min(paging.total_rows, paging.loadedPages * Math.ceil(paging.total_rows / paging.total_pages))} of ${paging.total_rows} rows`
+                      : `Showing part ${paging.loadedPages} of ${paging.total_pages}`}
+                  </span>
+                  {paging.handle && (
+                    <Button
+                      variant="ghost"
+                      size="sm"
+                      onClick={() => loadToolResultPage(paging.handle as string, paging.loadedPages)}
+                      className="h-7 px-2 text-xs"
+                    >
+                      Load more
+                    </Button>
+                  )}
+                </div>
+              )}
               
               {parseAndFormat.error && (
                 <div className="mt-2 p-2 bg-red-50 dark:bg-red-950/20 border border-red-200 dark:border-red-800 rounded text-xs text-red-700 dark:text-red-300">
@@ -10,9 +10,30 @@ export interface ChatMessage {
   toolArgs?: any;
   toolId?: string;
   result?: any;
+  paging?: ToolResultPaging;
   files?: File[];
 }
 
+// Large tool results arrive as a first page; further pages are requested by handle
+export interface ToolResultPaging {
+  handle: string | null;
+  total_pages: number;
+  total_bytes: number;
+  total_rows?: number;
+  rows_field?: string | null;
+  loadedPages: number;
+}
+
+const mergeResultPage = (result: any, page: any, rowsField?: string | null) => {
+  if (rowsField && result && typeof result === 'object' && !Array.isArray(result)) {
+    return { ...result, [rowsField]: [...(result[rowsField] || []), ...page] };
+  }
+  if (Array.isArray(result) && Array.isArray(page)) {
+    return [...result, ...page];
+  }
+  return `${result ?? ''}${page}`;
+};
+
 export interface UploadedFile {
   name: string;
   content: string; // base64 encoded
@@ -32,10 +53,14 @@ interface ChatContextType {
   messages: ChatMessage[];
   isConnected: boolean;
   isThinking: boolean;
+  // Position of the current query in the server's admission queue, null once it runs
+  queuePosition: number | null;
   isAuthenticated: boolean;
   currentModel: string;
   sendMessage: (message: string, files?: File[]) => void;
   sendFiles: (files: File[]) => void;
+  loadToolResultPage: (handle: string, page: number) => void;
+  cancelQuery: () => void;
   authenticate: (credentials: AuthCredentials) => void;
   switchModel: (model: string) => Promise<void>;
   clearMessages: () => void;
@@ -44,14 +69,22 @@ interface ChatContextType {
 
 const ChatContext = createContext<ChatContextType | undefined>(undefined);
 
+const SESSION_TOKEN_KEY = 'incorta-chat-session-token';
+const SESSION_ROUTE_KEY = 'incorta-chat-session-route';
+
 export const ChatProvider: React.FC<{ children: React.ReactNode }> = ({ children }) => {
   const [messages, setMessages] = useState<ChatMessage[]>([]);
   const [isConnected, setIsConnected] = useState(false);
   const [isThinking, setIsThinking] = useState(false);
+  const [queuePosition, setQueuePosition] = useState<number | null>(null);
   const [isAuthenticated, setIsAuthenticated] = useState(false);
   const [currentModel, setCurrentModel] = useState<string>('claude');
   const [connectionStatus, setConnectionStatus] = useState<'connecting' | 'connected' | 'disconnected' | 'error'>('disconnected');
   const wsRef = useRef<WebSocket | null>(null);
+  // Lets a reconnect resume the server-side session (history, agent) instead of re-authenticating
+  const sessionTokenRef = useRef<string | null>(sessionStorage.getItem(SESSION_TOKEN_KEY));
+  // Worker that holds the session when the server runs several; sent back on reconnect
+  const sessionRouteRef = useRef<string | null>(sessionStorage.getItem(SESSION_ROUTE_KEY));
   const reconnectTimeoutRef = useRef<ReturnType<typeof setTimeout>>();
 
   const connect = () => {
@@ -59,21 +92,34 @@ export const ChatProvider: React.FC<{ children: React.ReactNode }> = ({ children
 
     setConnectionStatus('connecting');
     // Use config for WebSocket URL
-    const wsUrl = config.websocket.url;
-    const ws = new WebSocket(wsUrl);
+    const wsUrl = new URL(config.websocket.url, window.location.href);
+    if (sessionTokenRef.current && sessionRouteRef.current !== null) {
+      wsUrl.searchParams.set('route', sessionRouteRef.current);
+    }
+    const ws = new WebSocket(wsUrl.toString());
 
     ws.onopen = () => {
       console.log('WebSocket connected');
       setIsConnected(true);
       setConnectionStatus('connected');
       wsRef.current = ws;
+      if (sessionTokenRef.current) {
+        ws.send(JSON.stringify({
+          type: 'resume',
+          session_token: sessionTokenRef.current
+        }));
+      }
     };
 
     ws.onmessage = (event) => {
       try {
         const data = JSON.parse(event.data);
-        console.log('WebSocket message received:', data.type, data);
-        handleWebSocketMessage(data);
+        // The server may batch several frames into one array (SEND_BATCH_FRAMES)
+        const frames = Array.isArray(data) ? data : [data];
+        for (const frame of frames) {
+          console.log('WebSocket message received:', frame.type, frame);
+          handleWebSocketMessage(frame);
+        }
       } catch (error) {
         console.error('Failed to parse WebSocket message:', error);
       }
@@ -84,6 +130,7 @@ export const ChatProvider: React.FC<{ children: React.ReactNode }> = ({ children
       setIsConnected(false);
       setConnectionStatus('disconnected');
       setIsThinking(false);
+      setQueuePosition(null);
       wsRef.current = null;
       
       // Attempt to reconnect after configured delay
@@ -99,6 +146,15 @@ export const ChatProvider: React.FC<{ children: React.ReactNode }> = ({ children
     };
   };
 
+  const rememberRoute = (route?: string | null) => {
+    sessionRouteRef.current = route ?? null;
+    if (route != null) {
+      sessionStorage.setItem(SESSION_ROUTE_KEY, route);
+    } else {
+      sessionStorage.removeItem(SESSION_ROUTE_KEY);
+    }
+  };
+
   const handleWebSocketMessage = (data: any) => {
     const messageId = `${Date.now()}-${Math.random()}`;
 
@@ -109,6 +165,11 @@ export const ChatProvider: React.FC<{ children: React.ReactNode }> = ({ children
 
       case 'authenticated':
         setIsAuthenticated(true);
+        if (data.data?.session_token) {
+          sessionTokenRef.current = data.data.session_token;
+          sessionStorage.setItem(SESSION_TOKEN_KEY, data.data.session_token);
+        }
+        rememberRoute(data.data?.route);
         // Update current model if provided
         if (data.data?.model) {
           setCurrentModel(data.data.model);
@@ -121,6 +182,21 @@ export const ChatProvider: React.FC<{ children: React.ReactNode }> = ({ children
         }]);
         break;
 
+      case 'session_resumed':
+        setIsAuthenticated(true);
+        rememberRoute(data.data?.route);
+        if (data.data?.model) {
+          setCurrentModel(data.data.model);
+        }
+        break;
+
+      case 'resume_failed':
+        sessionTokenRef.current = null;
+        sessionStorage.removeItem(SESSION_TOKEN_KEY);
+        rememberRoute(null);
+        setIsAuthenticated(false);
+        break;
+
       case 'model_switched':
         console.log('ChatContext received model_switched:', data);
         console.log('Setting currentModel to:', data.data.model);
@@ -194,8 +270,41 @@ export const ChatProvider: React.FC<{ children: React.ReactNode }> = ({ children
         }
         break;
 
+      case 'assistant_delta':
+        setIsThinking(false);
+        // Token-level streaming: append the delta to the assistant message being generated.
+        // The final assistant_message for the same step replaces it with the full text.
+        if (data.data.content) {
+          const streamId = `assistant-temp-${data.data.message_id || 'stream'}`;
+          setMessages(prev => {
+            const lastMessage = prev[prev.length - 1];
+            if (lastMessage && lastMessage.id === streamId) {
+              const updatedMessages = [...prev];
+              updatedMessages[updatedMessages.length - 1] = {
+                ...lastMessage,
+                content: lastMessage.content + data.data.content,
+                timestamp: Date.now()
+              };
+              return updatedMessages;
+            }
+            return [...prev, {
+              id: streamId,
+              type: 'assistant' as const,
+              content: data.data.content,
+              timestamp: Date.now()
+            }];
+          });
+        }
+        break;
+
+      case 'queued':
+        setIsThinking(true);
+        setQueuePosition(data.data?.position ?? null);
+        break;
+
       case 'thinking':
         setIsThinking(true);
+        setQueuePosition(null);
         // Don't add thinking messages to the chat - just update the thinking state
         break;
 
@@ -229,7 +338,8 @@ export const ChatProvider: React.FC<{ children: React.ReactNode }> = ({ children
             timestamp: Date.now(),
             toolName: data.data.tool_name,
             toolId: data.data.tool_id,
-            result: data.data.result
+            result: data.data.result,
+            paging: data.data.paging ? { ...data.data.paging, loadedPages: 1 } : undefined
           }];
           console.log('ChatContext: Total messages after tool_result:', newMessages.length);
           console.log('ChatContext: Tool result data:', data.data.result);
@@ -239,11 +349,25 @@ export const ChatProvider: React.FC<{ children: React.ReactNode }> = ({ children
         setTimeout(() => setIsThinking(false), 1000);
         break;
 
+      case 'tool_result_page':
+        setMessages(prev => prev.map(msg => {
+          if (!msg.paging || msg.paging.handle !== data.data.handle || data.data.page !== msg.paging.loadedPages) {
+            return msg;
+          }
+          return {
+            ...msg,
+            result: mergeResultPage(msg.result, data.data.result, data.data.rows_field),
+            paging: { ...msg.paging, loadedPages: msg.paging.loadedPages + 1 }
+          };
+        }));
+        break;
+
       case 'file_processed':
         // Don't show individual file processing messages to keep chat clean
         break;
 
       case 'files_uploaded':
+        setQueuePosition(null);
         setMessages(prev => [...prev, {
           id: messageId,
           type: 'files_uploaded',
@@ -263,10 +387,23 @@ export const ChatProvider: React.FC<{ children: React.ReactNode }> = ({ children
 
       case 'completed':
         setIsThinking(false);
+        setQueuePosition(null);
+        break;
+
+      case 'cancelled':
+        setIsThinking(false);
+        setQueuePosition(null);
+        setMessages(prev => [...prev, {
+          id: messageId,
+          type: 'assistant',
+          content: 'Response stopped.',
+          timestamp: Date.now()
+        }]);
         break;
 
       case 'error':
         setIsThinking(false);
+        setQueuePosition(null);
         setMessages(prev => [...prev, {
           id: messageId,
           type: 'error',
@@ -438,6 +575,25 @@ export const ChatProvider: React.FC<{ children: React.ReactNode }> = ({ children
     return Promise.resolve();
   };
 
+  const loadToolResultPage = (handle: string, page: number) => {
+    if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
+      wsRef.current.send(JSON.stringify({
+        type: 'tool_result_page',
+        handle,
+        page
+      }));
+    }
+  };
+
+  const cancelQuery = () => {
+    // Stops the running query on the server: its model stream and pending tool calls
+    if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
+      wsRef.current.send(JSON.stringify({
+        type: 'cancel'
+      }));
+    }
+  };
+
   const clearMessages = () => {
     setMessages([]);
     setIsThinking(false);
@@ -468,10 +624,13 @@ export const ChatProvider: React.FC<{ children: React.ReactNode }> = ({ children
       messages,
       isConnected,
       isThinking,
+      queuePosition,
       isAuthenticated,
       currentModel,
       sendMessage,
       sendFiles,
+      loadToolResultPage,
+      cancelQuery,
       authenticate,
       switchModel,
       clearMessages,
@@ -0,0 +1,297 @@
+"""Offline end-to-end benchmark: the real server against a scripted LLM and a stub MCP server.
+
+Unlike ``load_test`` (which replaces the whole agent), this runs the real
+agent graph, MCP client, tool caching, result paging and file extraction.
+Only the model provider (``ScriptedChatModel``) and the Incorta MCP server
+(``StubMCPServer`` on localhost) are stand-ins, so it needs no network or API
+keys and can run in CI. Each client authenticates, sends queries, sends a
+query with a CSV attachment, sends the same file through the chunked
+upload protocol and queries it by ``upload_ids``, starts and cancels a query, switches to Gemini
+and queries again, then reconnects and resumes its session; the report
+gives p50/p99 per scenario, frames/sec and peak RSS. ``--degrade`` makes one
+provider fail or stall for a fraction of calls, to measure failover and
+hedging; the report then counts which model answered.
+
+    python -m benchmarks.harness --clients 50 --queries 3 --llm-latency 0.2
+    python -m benchmarks.harness --degrade anthropic --failure-rate 0.2 --slow-rate 0.1
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import resource
+import statistics
+import sys
+import time
+import uuid
+from collections import Counter
+
+import websockets
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from web_socket.client import IncortaMCPClient
+from web_socket.uploads import CHUNK_HEADER
+from benchmarks.stubs import ScriptedChatModel, StubMCPServer
+
+SCENARIOS = ("authenticate", "query", "file_query", "upload", "upload_query", "cancel", "set_model", "resume")
+# Frame types that end each scenario
+DONE = {
+    "authenticate": ("authenticated", "authentication_failed"),
+    "query": ("completed",),
+    "file_query": ("completed",),
+    "upload_query": ("completed",),
+    "set_model": ("model_switched", "model_switch_failed"),
+    "resume": ("session_resumed",),
+}
+FAILED = ("authentication_failed", "model_switch_failed", "resume_failed", "upload_error", "error")
+
+
+class BenchmarkClient(IncortaMCPClient):
+    """Server whose providers are scripted models and whose MCP server is the local stub"""
+
+    llm_latency = 0.05
+    token_delay = 0.0
+    parallel_calls = 1
+    provider_faults = {}  # provider -> failure_rate / slow_rate / slow_latency overrides
+
+    def __init__(self, mcp_url: str):
+        super().__init__()
+        self.mcp_url = mcp_url
+
+    def create_llm(self, provider: str, **kwargs):
+        provider = self.llm_pool.normalize_provider(provider)
+        return ScriptedChatModel(provider=provider, latency=self.llm_latency, token_delay=self.token_delay,
+                                 parallel_calls=self.parallel_calls, **self.provider_faults.get(provider, {}))
+
+
+def make_csv(size: int) -> dict:
+    lines = ["id,customer,region,amount"]
+    total = len(lines[0])
+    i = 0
+    while total < size:
+        line = f"{i},Customer {i},{('EMEA', 'APAC', 'AMER')[i % 3]},{i * 1.25:.2f}"
+        lines.append(line)
+        total += len(line) + 1
+        i += 1
+    content = ("\n".join(lines) + "\n").encode()
+    return {"name": "sales.csv", "type": "text/csv", "size": len(content),
+            "content": base64.b64encode(content).decode()}
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = {scenario: [] for scenario in SCENARIOS}
+        self.frames = 0
+        self.answered_by = Counter()  # model reported in completed frames
+
+
+async def receive(ws, stats: Stats):
+    while True:
+        events = json.loads(await ws.recv())
+        # SEND_BATCH_FRAMES may batch several frames into one array
+        for event in events if isinstance(events, list) else [events]:
+            stats.frames += 1
+            yield event
+
+
+async def run_scenario(ws, scenario: str, request: dict, stats: Stats):
+    started = time.perf_counter()
+    tool_calls = {}  # tool_id -> tool_name of calls announced in this scenario
+    await ws.send(json.dumps(request))
+    async for event in receive(ws, stats):
+        if event["type"] in FAILED:
+            raise AssertionError(f"{scenario}: {event['type']} {event['data']}")
+        if event["type"] == "tool_call":
+            tool_calls[event["data"]["tool_id"]] = event["data"]["tool_name"]
+        elif event["type"] == "tool_result":
+            # Every result must name a call of this turn, once, with that call's tool
+            tool_id = event["data"]["tool_id"]
+            if tool_calls.pop(tool_id, None) != event["data"]["tool_name"]:
+                raise AssertionError(f"{scenario}: tool_result {tool_id} does not match a pending tool_call")
+        if event["type"] == "completed":
+            stats.answered_by[event["data"].get("model")] += 1
+        if event["type"] in DONE[scenario]:
+            if tool_calls:
+                raise AssertionError(f"{scenario}: no result for tool calls {sorted(tool_calls)}")
+            stats.latencies[scenario].append(time.perf_counter() - started)
+            return event
+
+
+async def run_cancel(ws, query: str, stats: Stats):
+    """Start a query and cancel it once its first tool call is out; times cancel -> cancelled"""
+    started = None
+    await ws.send(json.dumps({"type": "query", "query": query}))
+    async for event in receive(ws, stats):
+        if event["type"] in FAILED or event["type"] == "completed":
+            raise AssertionError(f"cancel: unexpected {event['type']} {event['data']}")
+        if event["type"] == "tool_call" and started is None:
+            started = time.perf_counter()
+            await ws.send(json.dumps({"type": "cancel"}))
+        elif event["type"] == "cancelled":
+            if started is None:
+                raise AssertionError("cancel: cancelled before the cancel message was sent")
+            stats.latencies["cancel"].append(time.perf_counter() - started)
+            return event
+
+
+async def run_upload(ws, attachment: dict, stats: Stats) -> str:
+    """Send ``attachment`` with upload_start, binary chunks and upload_finish; returns the upload id"""
+    content = base64.b64decode(attachment["content"])
+    started = time.perf_counter()
+    await ws.send(json.dumps({"type": "upload_start", "name": attachment["name"], "size": len(content),
+                              "mime_type": attachment["type"]}))
+    async for event in receive(ws, stats):
+        if event["type"] in FAILED:
+            raise AssertionError(f"upload: {event['type']} {event['data']}")
+        if event["type"] == "upload_ready":
+            upload_id, offset, chunk_size = (event["data"][k] for k in ("upload_id", "offset", "chunk_size"))
+            # Send the chunks back to back; the acknowledgements are checked below
+            for start in range(offset, len(content), chunk_size):
+                await ws.send(CHUNK_HEADER.pack(upload_id.encode(), start) + content[start:start + chunk_size])
+            if offset == len(content):
+                await ws.send(json.dumps({"type": "upload_finish", "upload_id": upload_id}))
+        elif event["type"] == "upload_progress" and event["data"]["offset"] == len(content):
+            await ws.send(json.dumps({"type": "upload_finish", "upload_id": event["data"]["upload_id"]}))
+        elif event["type"] == "upload_complete":
+            if event["data"]["file_size"] != len(content):
+                raise AssertionError(f"upload: {event['data']['file_size']} of {len(content)} bytes arrived")
+            stats.latencies["upload"].append(time.perf_counter() - started)
+            return event["data"]["upload_id"]
+
+
+async def expect_upload_refused(ws, stats: Stats):
+    """Uploads before authentication are answered with upload_error"""
+    await ws.send(json.dumps({"type": "upload_start", "name": "early.csv", "size": 1}))
+    async for event in receive(ws, stats):
+        if event["type"] == "upload_error":
+            return
+        if event["type"] == "upload_ready":
+            raise AssertionError("upload: started before authentication")
+
+
+async def run_client(url: str, queries: int, attachment: dict, stats: Stats):
+    user = uuid.uuid4().hex[:8]
+    credentials = {"envUrl": "http://incorta.local", "tenant": "bench", "incortaUsername": f"user-{user}",
+                   "accessToken": "token", "sqlxHost": "sqlx.local"}
+    async with websockets.connect(url, max_size=None) as ws:
+        await expect_upload_refused(ws, stats)
+        authenticated = await run_scenario(ws, "authenticate", {"type": "authenticate", "credentials": credentials}, stats)
+        for turn in range(queries):
+            await run_scenario(ws, "query", {"type": "query", "query": f"Total sales by region ({user}:{turn})"}, stats)
+        if attachment:
+            await run_scenario(ws, "file_query", {"type": "query", "query": "Summarise this file",
+                                                  "files": [attachment]}, stats)
+            upload_id = await run_upload(ws, attachment, stats)
+            await run_scenario(ws, "upload_query", {"type": "query", "query": "Summarise the uploaded file",
+                                                    "upload_ids": [upload_id]}, stats)
+        await run_cancel(ws, f"Cancel this ({user})", stats)
+        await run_scenario(ws, "set_model", {"type": "set_model", "model": "gemini"}, stats)
+        await run_scenario(ws, "query", {"type": "query", "query": f"Same for gemini ({user})"}, stats)
+    # Reconnect: the session continues without authenticating again
+    async with websockets.connect(url, max_size=None) as ws:
+        token = authenticated["data"]["session_token"]
+        resumed = await run_scenario(ws, "resume", {"type": "resume", "session_token": token}, stats)
+        if resumed["data"]["model"] != "gemini":
+            raise AssertionError(f"resume: expected model gemini, got {resumed['data']['model']}")
+
+
+def rss_mb() -> tuple:
+    """(current, peak) resident set size in MB"""
+    current = 0.0
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    current = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is KB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    return current, peak
+
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def main(args) -> int:
+    BenchmarkClient.llm_latency = args.llm_latency
+    BenchmarkClient.token_delay = args.token_delay
+    BenchmarkClient.parallel_calls = args.parallel_tools
+    if args.degrade:
+        BenchmarkClient.provider_faults = {args.degrade: {"failure_rate": args.failure_rate, "slow_rate": args.slow_rate,
+                                                          "slow_latency": args.slow_latency}}
+    stub = StubMCPServer(latency=args.tool_latency, rows=args.rows).start()
+    try:
+        server_client = BenchmarkClient(stub.url)
+        attachment = make_csv(args.file_bytes) if args.file_bytes else None
+        stats = Stats()
+        async with websockets.serve(server_client.handle_websocket, "127.0.0.1", 0, max_size=None) as server:
+            port = server.sockets[0].getsockname()[1]
+            started = time.perf_counter()
+            results = await asyncio.gather(
+                *(run_client(f"ws://127.0.0.1:{port}", args.queries, attachment, stats) for _ in range(args.clients)),
+                return_exceptions=True,
+            )
+            elapsed = time.perf_counter() - started
+        reroutes = server_client.llm_pool.stats()["reroutes"]
+        await server_client.cleanup()
+    finally:
+        stub.stop()
+
+    failures = [r for r in results if isinstance(r, BaseException)]
+    current_rss, peak_rss = rss_mb()
+    report = {
+        "clients": args.clients,
+        "failures": len(failures),
+        "elapsed_s": round(elapsed, 3),
+        "frames_per_s": round(stats.frames / elapsed, 1) if elapsed else 0.0,
+        "mcp_calls": stub.calls,
+        "mcp_peak_concurrency": stub.peak_concurrency,
+        "answered_by": dict(stats.answered_by),
+        "llm_reroutes": reroutes,
+        "rss_mb": round(current_rss, 1),
+        "peak_rss_mb": round(peak_rss, 1),
+        "scenarios": {
+            scenario: {
+                "count": len(latencies),
+                "p50_ms": round(statistics.median(latencies) * 1000, 1),
+                "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+            }
+            for scenario, latencies in stats.latencies.items() if latencies
+        },
+    }
+    if args.json:
+        print(json.dumps(report))
+    else:
+        print(f"clients={args.clients} failures={len(failures)} elapsed={elapsed:.2f}s "
+              f"frames/s={report['frames_per_s']} mcp_calls={stub.calls} "
+              f"mcp_peak_concurrency={stub.peak_concurrency} "
+              f"rss={report['rss_mb']}MB peak={report['peak_rss_mb']}MB")
+        print(f"  answered_by={report['answered_by']} llm_reroutes={reroutes}")
+        for scenario, summary in report["scenarios"].items():
+            print(f"  {scenario:<13} n={summary['count']:<5} p50={summary['p50_ms']}ms p99={summary['p99_ms']}ms")
+    for failure in failures[:5]:
+        print(f"  {type(failure).__name__}: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=3, help="queries per client before the file and model switch")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds before each model response")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed tokens")
+    parser.add_argument("--tool-latency", type=float, default=0.02, help="seconds per MCP tool call")
+    parser.add_argument("--parallel-tools", type=int, default=1, help="tool calls the model makes per step")
+    parser.add_argument("--rows", type=int, default=100, help="rows returned by run_query")
+    parser.add_argument("--file-bytes", type=int, default=64 * 1024, help="size of the CSV attachment; 0 skips it")
+    parser.add_argument("--degrade", choices=("anthropic", "google"), help="provider to make fail or stall")
+    parser.add_argument("--failure-rate", type=float, default=0.2, help="fraction of the degraded provider's calls that fail")
+    parser.add_argument("--slow-rate", type=float, default=0.1, help="fraction of the degraded provider's calls that stall")
+    parser.add_argument("--slow-latency", type=float, default=5.0, help="seconds a stalled call takes")
+    parser.add_argument("--json", action="store_true", help="print the report as one JSON object")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,110 @@
+"""Load test: N concurrent websocket clients against one in-process server.
+
+Every session gets an echo agent instead of a real LLM, so the test runs
+offline. Each client sends its own nonce and checks that every frame it
+receives belongs to it and that its history is not shared with other sessions.
+
+    python -m benchmarks.load_test --clients 200 --turns 3
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+import uuid
+import os
+
+import websockets
+from langchain_core.messages import AIMessage
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from web_socket.client import IncortaMCPClient
+from web_socket.session import ChatSession
+
+
+class EchoAgent:
+    """Agent stand-in that echoes the last user message and the history length"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    async def astream(self, inputs, stream_mode="updates", config=None):
+        messages = inputs["messages"]
+        await asyncio.sleep(self.delay)
+        history = [m for m in messages if m["role"] != "system"]
+        update = {"agent": {"messages": [AIMessage(content=f"{len(history)}|{history[-1]['content']}")]}}
+        yield ("updates", update) if isinstance(stream_mode, list) else update
+
+
+class EchoSession(ChatSession):
+    delay = 0.05
+
+    async def initialize_agent(self, model_name: str = "claude"):
+        self.current_model = model_name
+        self.agent = EchoAgent(self.delay)
+
+
+class EchoClient(IncortaMCPClient):
+    session_class = EchoSession
+
+
+async def run_client(url: str, turns: int, latencies: list):
+    nonce = uuid.uuid4().hex
+    async with websockets.connect(url, max_size=None) as ws:
+        await ws.send(json.dumps({"type": "authenticate", "credentials": {"incortaUsername": nonce}}))
+        for turn in range(turns):
+            query = f"{nonce}:{turn}"
+            started = time.perf_counter()
+            await ws.send(json.dumps({"type": "query", "query": query}))
+            completed = None
+            while completed is None:
+                events = json.loads(await ws.recv())
+                # SEND_BATCH_FRAMES may batch several frames into one array
+                for event in events if isinstance(events, list) else [events]:
+                    if event["type"] in ("user_message", "assistant_message"):
+                        content = event["data"]["content"]
+                        if nonce not in content:
+                            raise AssertionError(f"session {nonce} received foreign frame: {content}")
+                    elif event["type"] == "error":
+                        raise AssertionError(f"session {nonce} got error: {event['data']}")
+                    elif event["type"] == "completed":
+                        completed = event
+            latencies.append(time.perf_counter() - started)
+            # user + assistant per earlier turn, plus the current user message
+            expected = f"{2 * turn + 1}|{query}"
+            if completed["data"]["final_response"] != expected:
+                raise AssertionError(f"expected {expected!r}, got {completed['data']['final_response']!r}")
+
+
+async def main(clients: int, turns: int, delay: float):
+    EchoSession.delay = delay
+    server_client = EchoClient()
+    async with websockets.serve(server_client.handle_websocket, "127.0.0.1", 0, max_size=None) as server:
+        port = server.sockets[0].getsockname()[1]
+        latencies = []
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *(run_client(f"ws://127.0.0.1:{port}", turns, latencies) for _ in range(clients)),
+            return_exceptions=True,
+        )
+        elapsed = time.perf_counter() - started
+
+    failures = [r for r in results if isinstance(r, Exception)]
+    latencies.sort()
+    print(f"clients={clients} turns={turns} failures={len(failures)} elapsed={elapsed:.2f}s")
+    if latencies:
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"turn latency p50={statistics.median(latencies) * 1000:.1f}ms p99={p99 * 1000:.1f}ms")
+    for failure in failures[:5]:
+        print(f"  {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--delay", type=float, default=0.05, help="simulated agent latency in seconds")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.clients, args.turns, args.delay)))
@@ -0,0 +1,185 @@
+"""Offline stand-ins for the LLM providers and the Incorta MCP server.
+
+``ScriptedChatModel`` answers like a tool-using agent model: a user turn gets
+a ``run_query`` tool call, a tool result gets a streamed text answer.
+``StubMCPServer`` serves ``get_schemas`` and ``run_query`` over streamable
+HTTP from a background thread. Latencies and payload sizes are configurable
+so the benchmarks can model slow providers or large query results;
+``failure_rate`` and ``slow_rate`` model a degraded provider.
+"""
+import asyncio
+import json
+import random
+import socket
+import threading
+import time
+import uuid
+from typing import Optional
+
+import uvicorn
+from pydantic import PrivateAttr
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from mcp.server.fastmcp import FastMCP
+
+from web_socket.llm_pool import ProviderLimiter, _LimitedChatModel
+
+# Queries containing this marker are answered without a tool call
+NO_TOOLS = "[no-tools]"
+
+
+class ProviderOverloaded(Exception):
+    """What a degraded provider raises; looks like Anthropic's 529 to the failover logic"""
+
+    status_code = 529
+
+
+class _ScriptedModel(BaseChatModel):
+    provider: str = "anthropic"
+    latency: float = 0.05  # seconds before the first token
+    token_delay: float = 0.0  # seconds between streamed tokens
+    answer_words: int = 40
+    tool_name: str = "run_query"
+    parallel_calls: int = 1  # tool calls per agent step
+    failure_rate: float = 0.0  # fraction of calls that fail with ProviderOverloaded
+    slow_rate: float = 0.0  # fraction of calls that take slow_latency instead of latency
+    slow_latency: float = 5.0
+
+    @property
+    def _llm_type(self) -> str:
+        return f"scripted-{self.provider}"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _reply(self, messages) -> AIMessage:
+        last = messages[-1]
+        if isinstance(last, HumanMessage) and self.tool_name and NO_TOOLS not in str(last.content):
+            calls = [{"name": self.tool_name, "args": {"sql": f"SELECT * FROM sales_{i} -- {str(last.content)[:40]}"},
+                      "id": f"call_{uuid.uuid4().hex[:12]}", "type": "tool_call"} for i in range(self.parallel_calls)]
+            return AIMessage(content="", tool_calls=calls)
+        if isinstance(last, ToolMessage):
+            results = [m for m in messages if isinstance(m, ToolMessage)]
+            opening = f"The queries returned {sum(len(str(m.content)) for m in results)} characters of data."
+        else:
+            opening = f"You said: {str(last.content)[:80]}."
+        filler = " ".join(f"word{i}" for i in range(self.answer_words))
+        return AIMessage(content=f"{opening} {filler}")
+
+    def _delay(self) -> float:
+        """Latency of this call; raises for the calls that fail"""
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise ProviderOverloaded(f"{self.provider} is overloaded")
+        return self.slow_latency if self.slow_rate and random.random() < self.slow_rate else self.latency
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self._delay())
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self._delay())
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self._delay())
+        reply = self._reply(messages)
+        message_id = f"run-{uuid.uuid4().hex[:12]}"
+        if reply.tool_calls:
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", id=message_id, tool_call_chunks=[{
+                "name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": i}
+                for i, call in enumerate(reply.tool_calls)]))
+            return
+        for word in reply.content.split(" "):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word + " ", id=message_id))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+
+
+class ScriptedChatModel(_LimitedChatModel, _ScriptedModel):
+    """Scripted model that also goes through the LLM pool's provider limiter"""
+
+    _limiter: Optional[ProviderLimiter] = PrivateAttr(default=None)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class StubMCPServer:
+    """Local streamable-HTTP MCP server with Incorta-like tools.
+
+    ``run_query`` returns ``rows`` JSON rows after ``latency`` seconds;
+    ``peak_concurrency`` records the most calls seen in flight at once.
+    Runs uvicorn in a daemon thread with its own event loop, so it does not
+    compete with the websocket server's loop.
+    """
+
+    def __init__(self, latency: float = 0.02, rows: int = 100, port: int = None):
+        self.latency = latency
+        self.rows = rows
+        self.port = port or _free_port()
+        self.calls = 0
+        self.in_flight = 0
+        self.peak_concurrency = 0
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/mcp"
+
+    def _build_app(self):
+        mcp = FastMCP("Incorta stub", stateless_http=True, json_response=True, log_level="WARNING")
+
+        @mcp.tool()
+        async def get_schemas() -> str:
+            """List the schemas available to the user"""
+            self.calls += 1
+            await asyncio.sleep(self.latency)
+            return json.dumps({"schemas": [{"schemaName": f"Schema{i}", "isEmpty": False} for i in range(5)]})
+
+        @mcp.tool()
+        async def run_query(sql: str) -> str:
+            """Run a SQL query against Incorta and return the rows as JSON"""
+            self.calls += 1
+            self.in_flight += 1
+            self.peak_concurrency = max(self.peak_concurrency, self.in_flight)
+            try:
+                await asyncio.sleep(self.latency)
+            finally:
+                self.in_flight -= 1
+            rows = [{"id": i, "customer": f"Customer {i}", "region": ("EMEA", "APAC", "AMER")[i % 3],
+                     "amount": round(i * 1.25, 2)} for i in range(self.rows)]
+            return json.dumps({"columns": ["id", "customer", "region", "amount"], "rows": rows})
+
+        return mcp.streamable_http_app()
+
+    def start(self):
+        config = uvicorn.Config(self._build_app(), host="127.0.0.1", port=self.port,
+                                log_level="warning", lifespan="on")
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        while not self._server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Stub MCP server did not start")
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.should_exit = True
+            self._thread.join(timeout=5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -1,7 +1,13 @@
 from web_socket.client import IncortaMCPClient
+from web_socket.supervisor import Supervisor, worker_count
 import asyncio
 
 async def main():
+    workers = worker_count()
+    if workers > 1:
+        # WEB_WORKERS > 1: one process per worker behind a supervisor that owns the port
+        await Supervisor(IncortaMCPClient, host="0.0.0.0", port=5999, workers=workers).run()
+        return
     client = IncortaMCPClient()
     try:
         # Start WebSocket server on port 5999 for Docker deployment
@@ -11,4 +17,4 @@ async def main():
         await client.cleanup()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
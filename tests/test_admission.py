@@ -0,0 +1,147 @@
+import asyncio
+
+import pytest
+
+from web_socket.admission import AdmissionController, TokenBucket
+
+
+def make_controller(monkeypatch, **env) -> AdmissionController:
+    settings = {"AGENT_MAX_CONCURRENCY": "1", "TENANT_MAX_CONCURRENCY": "8", "USER_MAX_CONCURRENCY": "8"}
+    settings.update(env)
+    for name, value in settings.items():
+        monkeypatch.setenv(name, value)
+    return AdmissionController()
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def hold(controller: AdmissionController, tenant: str, user: str, release: asyncio.Event, log: list):
+    async with controller.admit(tenant, user):
+        log.append((tenant, user))
+        await release.wait()
+
+
+async def run_queued(controller: AdmissionController, runs: list) -> list:
+    """Queue ``runs`` behind a run holding the only slot, then release it; returns the admission order"""
+    order = []
+    release = asyncio.Event()
+    holder = asyncio.ensure_future(hold(controller, "other", "holder", release, []))
+    await settle()
+
+    async def run(tenant, user):
+        async with controller.admit(tenant, user):
+            order.append(tenant)
+            await asyncio.sleep(0)
+
+    tasks = []
+    for tenant, user in runs:
+        tasks.append(asyncio.ensure_future(run(tenant, user)))
+        await settle()
+    release.set()
+    await asyncio.gather(holder, *tasks)
+    return order
+
+
+@pytest.mark.parametrize("weights, expected", [
+    ("", ["acme", "beta", "acme", "beta", "acme", "acme"]),
+    ("beta=2", ["beta", "acme", "beta", "acme", "acme", "acme"]),
+])
+def test_tenants_are_interleaved_by_weight(monkeypatch, weights, expected):
+    controller = make_controller(monkeypatch, TENANT_WEIGHTS=weights)
+    runs = [("acme", f"a{i}") for i in range(4)] + [("beta", f"b{i}") for i in range(2)]
+    assert asyncio.run(run_queued(controller, runs)) == expected
+    assert controller.active == 0 and controller.stats()["queued"] == 0
+
+
+def test_user_cap_blocks_only_that_user(monkeypatch):
+    controller = make_controller(monkeypatch, AGENT_MAX_CONCURRENCY="8", USER_MAX_CONCURRENCY="1")
+
+    async def main():
+        admitted = []
+        first_release, second_release, bob_release = asyncio.Event(), asyncio.Event(), asyncio.Event()
+        first = asyncio.ensure_future(hold(controller, "acme", "alice", first_release, admitted))
+        await settle()
+        second = asyncio.ensure_future(hold(controller, "acme", "alice", second_release, admitted))
+        bob = asyncio.ensure_future(hold(controller, "acme", "bob", bob_release, admitted))
+        await settle()
+        while_capped = list(admitted)
+        first_release.set()
+        await settle()
+        after_release = list(admitted)
+        second_release.set()
+        bob_release.set()
+        await asyncio.gather(first, second, bob)
+        return while_capped, after_release
+
+    while_capped, after_release = asyncio.run(main())
+    assert while_capped == [("acme", "alice"), ("acme", "bob")]
+    assert after_release == while_capped + [("acme", "alice")]
+    assert controller.active == 0 and not controller.tenants["acme"].users
+
+
+def test_cancelled_waiter_leaves_the_queue_and_the_rest_move_up(monkeypatch):
+    controller = make_controller(monkeypatch)
+
+    async def main():
+        release = asyncio.Event()
+        holder = asyncio.ensure_future(hold(controller, "acme", "holder", release, []))
+        await settle()
+        positions = {name: [] for name in ("first", "second", "third")}
+        ran = []
+
+        async def queued(name):
+            async def on_queued(position, queue_length):
+                positions[name].append((position, queue_length))
+            async with controller.admit("acme", name, on_queued=on_queued):
+                ran.append(name)
+
+        tasks = {}
+        for name in positions:
+            tasks[name] = asyncio.ensure_future(queued(name))
+            await settle()
+        tasks["first"].cancel()
+        await settle()
+        queued_after_cancel = controller.stats()["queued"]
+        release.set()
+        await asyncio.gather(holder, tasks["second"], tasks["third"])
+        return positions, ran, queued_after_cancel
+
+    positions, ran, queued_after_cancel = asyncio.run(main())
+    assert positions["first"] == [(1, 1)]
+    assert positions["second"] == [(2, 2), (1, 2)]
+    assert positions["third"] == [(3, 3), (2, 2)]
+    assert queued_after_cancel == 2
+    assert ran == ["second", "third"]
+    assert controller.active == 0 and controller.stats()["queued"] == 0
+
+
+def test_token_bucket_debt_and_refill(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr("web_socket.admission.time.monotonic", lambda: clock[0])
+    bucket = TokenBucket(rate=10, burst=5)
+    assert bucket.charge(5) == 0.0
+    assert bucket.charge(3) == pytest.approx(0.3)  # 3 tokens of debt at 10 per second
+    clock[0] += 0.1
+    assert bucket.charge(0) == pytest.approx(0.2)
+    clock[0] += 0.2
+    assert bucket.charge(0) == pytest.approx(0.0, abs=1e-9)
+    clock[0] += 60
+    bucket.charge(0)
+    assert bucket.tokens == 5  # refills no further than the burst
+
+
+def test_token_bucket_take_sleeps_off_the_debt():
+    bucket = TokenBucket(rate=100, burst=1)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        delays = [await bucket.take(1), await bucket.take(2)]
+        return delays, loop.time() - started
+
+    delays, elapsed = asyncio.run(main())
+    assert delays[0] == 0.0 and delays[1] == pytest.approx(0.02, abs=0.005)
+    assert elapsed >= 0.015
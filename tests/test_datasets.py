@@ -0,0 +1,58 @@
+import asyncio
+import base64
+
+from web_socket.datasets import DatasetStore
+from web_socket.extraction import ExtractionPool
+
+
+def test_queries_cannot_attach_files_or_change_settings(tmp_path):
+    store = DatasetStore(str(tmp_path))
+    csv = base64.b64encode(b"id,region\n1,EMEA\n2,APAC\n").decode()
+
+    async def main():
+        await store.load(ExtractionPool(mode="thread"), {"name": "sales.csv", "content": csv})
+        return [await store.query(sql) for sql in (
+            f"ATTACH DATABASE '{tmp_path / 'other.db'}' AS other",
+            "PRAGMA journal_mode=WAL",
+            "PRAGMA table_info(sales)",
+            "SELECT count(*) FROM sales",
+        )]
+
+    attach, pragma_write, table_info, count = asyncio.run(main())
+    assert attach.startswith("SQL error") and pragma_write.startswith("SQL error")
+    assert table_info.startswith("cid,name") and count == "count(*)\n2\n"
+    assert not (tmp_path / "other.db").exists()
+    store.close()
+    assert store._connection is None
+
+
+def test_latin1_csv_loads(tmp_path):
+    store = DatasetStore(str(tmp_path))
+    csv = base64.b64encode("city,country\nZürich,Schweiz\nMálaga,España\n".encode("latin-1")).decode()
+
+    async def main():
+        await store.load(ExtractionPool(mode="thread"), {"name": "cities.csv", "content": csv})
+        return await store.query("SELECT city FROM cities ORDER BY city")
+
+    assert asyncio.run(main()) == "city\nMálaga\nZürich\n"
+    store.close()
+
+
+def test_parallel_loads_with_the_same_stem_keep_every_table(tmp_path):
+    store = DatasetStore(str(tmp_path))
+    first = base64.b64encode(b"id\n1\n").decode()
+    second = base64.b64encode(b"id\n1\n2\n").decode()
+    pool = ExtractionPool(mode="thread")
+
+    async def main():
+        await asyncio.gather(*(store.load(pool, {"name": "data.csv", "content": content})
+                               for content in (first, second, first)))
+        return await store.query("SELECT (SELECT count(*) FROM data) + (SELECT count(*) FROM data_2)"
+                                 " + (SELECT count(*) FROM data_3) AS total")
+
+    try:
+        assert asyncio.run(main()) == "total\n4\n"
+    finally:
+        pool.shutdown()
+    assert sorted(store.tables) == ["data", "data_2", "data_3"]
+    store.close()
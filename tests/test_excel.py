@@ -0,0 +1,45 @@
+import datetime
+
+import openpyxl
+import pandas as pd
+import pytest
+
+from upload_files import ExcelHandler
+
+SHEETS = {
+    "duplicate_headers": [["Amount", "Amount", "Amount.1", "Name", None], [1, 2, 3, "a", None], [4, 5, 6, "b"]],
+    "blank_rows": [["id", "value"], [1, "x"], [None, None], [3, "z"], [None, None], [None, None]],
+    "mixed": [[2020, None, "note"], [1.5, datetime.datetime(2024, 1, 2)], [2, None, "extra", "wide"]],
+    "header_only": [["a", "b"]],
+    "empty": [],
+}
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    path = tmp_path / "book.xlsx"
+    book = openpyxl.Workbook()
+    book.remove(book.active)
+    for name, rows in SHEETS.items():
+        sheet = book.create_sheet(name)
+        for row in rows:
+            sheet.append(row)
+    book.save(path)
+    return str(path)
+
+
+@pytest.mark.parametrize("max_rows", [1000, 2])
+def test_openpyxl_sheets_match_pandas(workbook, max_rows):
+    sheets = list(ExcelHandler(workbook).iter_sheets(max_rows))
+    assert [sheet[0] for sheet in sheets] == list(SHEETS)
+    for name, df, _, error in sheets:
+        assert error is None
+        pd.testing.assert_frame_equal(df, pd.read_excel(workbook, sheet_name=name, nrows=max_rows))
+
+
+def test_blank_rows_are_kept(workbook):
+    sheets = {name: (df, total) for name, df, total, _ in ExcelHandler(workbook).iter_sheets(1000)}
+    df, total = sheets["blank_rows"]
+    assert total == len(df) == 3
+    assert df.iloc[1].isna().all()
+    assert list(sheets["duplicate_headers"][0].columns) == ["Amount", "Amount.2", "Amount.1", "Name"]
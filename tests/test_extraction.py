@@ -0,0 +1,44 @@
+import asyncio
+import base64
+from web_socket.extraction import ExtractionPool
+
+
+def test_repeated_base64_upload_never_reaches_the_pool(tmp_path, monkeypatch):
+    monkeypatch.setenv("EXTRACTION_CACHE_DIR", str(tmp_path))
+    pool = ExtractionPool(mode="thread")
+    dispatched = []
+    run = pool.run
+
+    async def counting_run(func, *args):
+        dispatched.append(args[0]["name"])
+        return await run(func, *args)
+
+    pool.run = counting_run
+    upload = {"name": "notes.txt", "content": base64.b64encode(b"quarterly revenue grew 4%").decode()}
+
+    async def main():
+        return [await pool.extract(dict(upload)), await pool.extract(dict(upload))]
+
+    try:
+        first, second = asyncio.run(main())
+    finally:
+        pool.shutdown()
+    assert dispatched == ["notes.txt"]
+    assert second is first
+    assert "quarterly revenue grew 4%" in first["text"]
+
+
+def test_different_content_is_extracted_again(tmp_path, monkeypatch):
+    monkeypatch.setenv("EXTRACTION_CACHE_DIR", str(tmp_path))
+    pool = ExtractionPool(mode="thread")
+
+    async def main():
+        first = await pool.extract({"name": "a.txt", "content": base64.b64encode(b"first").decode()})
+        second = await pool.extract({"name": "a.txt", "content": base64.b64encode(b"second").decode()})
+        return first, second
+
+    try:
+        first, second = asyncio.run(main())
+    finally:
+        pool.shutdown()
+    assert "first" in first["text"] and "second" in second["text"]
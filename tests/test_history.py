@@ -0,0 +1,72 @@
+from web_socket.history import ConversationHistory, estimate_tokens
+
+
+def file_message(name: str, size: int) -> dict:
+    body = "x" * size
+    return {"role": "user", "content": f"Look at this\n--- FILE: {name} ({size} bytes) ---\n{body}--- END OF FILE: {name} ---\n"}
+
+
+def make_history(budget: int, monkeypatch, keep_recent: int = 2) -> ConversationHistory:
+    monkeypatch.setenv("HISTORY_TOKEN_BUDGET_CLAUDE", str(budget))
+    return ConversationHistory(keep_recent=keep_recent)
+
+
+def test_compaction_keeps_whole_turns(monkeypatch):
+    history = make_history(500, monkeypatch)
+    for turn in range(20):
+        history.append({"role": "user", "content": f"question {turn} " + "q" * 200})
+        history.append({"role": "assistant", "content": "Tool 'run_query' executed successfully. " + "t" * 200})
+        history.append({"role": "assistant", "content": f"answer {turn} " + "a" * 200})
+        history.compact()
+        assert history.entries[0]["role"] == "user"
+        assert history.used_tokens <= history.token_budget or len(history.entries) <= 3
+    assert history.entries[-3]["content"].startswith("question 19")
+    assert all(message["role"] == "user" for message in history.entries[::3])
+    assert history.summary_lines
+
+
+def test_oversized_pinned_file_is_truncated(monkeypatch):
+    history = make_history(1000, monkeypatch)
+    history.append(file_message("big.csv", 40000))
+    history.compact()
+    content, tokens = history.pinned_files["big.csv"]
+    assert tokens == history.pinned_tokens <= 500
+    assert "file truncated to fit the context" in content
+    assert "big.csv" in history.context_text()
+    # already within budget, so a second compaction leaves it alone
+    history.compact()
+    assert history.pinned_files["big.csv"][0] == content
+
+
+def test_oldest_pinned_files_are_dropped_first(monkeypatch):
+    history = make_history(1000, monkeypatch)
+    history.append(file_message("old.csv", 1200))
+    history.append(file_message("new.csv", 1200))
+    history.compact()
+    assert list(history.pinned_files) == ["new.csv"]
+    assert any("old.csv" in line for line in history.summary_lines)
+
+
+def test_summary_stays_within_a_tenth_of_the_budget(monkeypatch):
+    history = make_history(2000, monkeypatch)
+    for turn in range(50):
+        history.append({"role": "user", "content": f"question {turn} " + "q" * 300})
+        history.append({"role": "assistant", "content": f"answer {turn} " + "a" * 300})
+        history.compact()
+        assert history.summary_tokens <= history.token_budget // 10
+        assert history.summary_tokens == sum(estimate_tokens(line) for line in history.summary_lines)
+
+
+def test_to_dict_restore_round_trip(monkeypatch):
+    history = make_history(1000, monkeypatch)
+    history.append(file_message("data.csv", 800))
+    for turn in range(6):
+        history.append({"role": "user", "content": f"question {turn} " + "q" * 300})
+        history.append({"role": "assistant", "content": f"answer {turn}"})
+        history.compact()
+    restored = ConversationHistory()
+    restored.restore(history.to_dict())
+    assert restored.to_dict() == history.to_dict()
+    assert restored.context_text() == history.context_text()
+    assert (restored.total_tokens, restored.summary_tokens, restored.pinned_tokens) == \
+           (history.total_tokens, history.summary_tokens, history.pinned_tokens)
@@ -0,0 +1,66 @@
+import asyncio
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from benchmarks.stubs import ProviderOverloaded, ScriptedChatModel
+from web_socket.llm_pool import LLMPool, neutral_message
+
+
+def make_pool(**faults) -> LLMPool:
+    """A pool whose providers are scripted models; ``faults`` maps a provider to its failure settings"""
+    return LLMPool(lambda provider, **kwargs: ScriptedChatModel(provider=provider, latency=0.01,
+                                                                **faults.get(provider, {})))
+
+
+def test_claude_tool_use_blocks_become_tool_calls_for_gemini():
+    call = {"id": "toolu_1", "name": "run_query", "args": {"sql": "SELECT 1"}, "type": "tool_call"}
+    message = AIMessage(content=[{"type": "text", "text": "Let me check."},
+                                 {"type": "tool_use", "id": "toolu_1", "name": "run_query", "input": {"sql": "SELECT 1"}}],
+                        tool_calls=[call], response_metadata={"answered_by": "claude"})
+    for_gemini = neutral_message(message, "gemini")
+    assert for_gemini.content == "Let me check."
+    assert for_gemini.tool_calls == [call]
+    assert neutral_message(message, "claude") is message
+
+
+def test_failover_passes_the_history_in_neutral_form(monkeypatch):
+    pool = make_pool(anthropic={"failure_rate": 1.0})
+    model = pool.routed("claude")
+    seen = []
+    gemini = pool.get("google")
+    original = type(gemini)._reply
+    monkeypatch.setattr(type(gemini), "_reply", lambda self, messages: seen.append(messages) or original(self, messages))
+    history = [HumanMessage("Sales?"),
+               AIMessage(content=[{"type": "tool_use", "id": "toolu_1", "name": "run_query", "input": {}}],
+                         tool_calls=[{"id": "toolu_1", "name": "run_query", "args": {}}],
+                         response_metadata={"answered_by": "claude"}),
+               ToolMessage("rows", tool_call_id="toolu_1", name="run_query")]
+    answer = asyncio.run(model.ainvoke(history))
+    assert answer.response_metadata["answered_by"] == "gemini"
+    assert seen[-1][1].content == "" and seen[-1][1].tool_calls[0]["id"] == "toolu_1"
+
+
+def test_sync_invoke_fails_over():
+    pool = make_pool(anthropic={"failure_rate": 1.0})
+    answer = pool.routed("claude").invoke("Hello")
+    assert answer.response_metadata["answered_by"] == "gemini"
+    assert pool.stats()["reroutes"] == {"failover": 1}
+
+
+def test_sync_invoke_raises_when_every_route_fails():
+    pool = make_pool(anthropic={"failure_rate": 1.0}, google={"failure_rate": 1.0})
+    try:
+        pool.routed("claude").invoke("Hello")
+    except ProviderOverloaded:
+        pass
+    else:
+        raise AssertionError("expected ProviderOverloaded")
+
+
+def test_losing_hedge_usage_is_counted():
+    pool = make_pool(anthropic={"slow_rate": 1.0, "slow_latency": 5.0})
+    model = pool.routed("claude").model_copy(update={"hedge_min_seconds": 0.05, "hedge_default_seconds": 0.05})
+    answer = asyncio.run(model.ainvoke("Hello"))
+    assert answer.response_metadata["answered_by"] == "gemini"
+    assert pool.stats()["reroutes"] == {"hedge": 1}
+    assert pool.stats()["usage"][("claude", "input")] > 0
@@ -0,0 +1,132 @@
+import asyncio
+import json
+
+from web_socket.frames import encode_frame
+from web_socket.outbound import OutboundQueue
+
+
+class FakeWebSocket:
+    """Records what the writer sends; ``paused`` holds sends back like a slow client"""
+
+    def __init__(self):
+        self.messages = []
+        self.closed_with = None
+        self.paused = asyncio.Event()
+        self.paused.set()
+
+    async def send(self, message, text=False):
+        await self.paused.wait()
+        self.messages.append(message)
+
+    async def close(self, code=1000, reason=""):
+        self.closed_with = (code, reason)
+
+    def frames(self) -> list:
+        frames = []
+        for message in self.messages:
+            decoded = json.loads(message)
+            frames.extend(decoded if isinstance(decoded, list) else [decoded])
+        return frames
+
+
+def frame(message_type: str, **data) -> dict:
+    return {"type": message_type, "data": data, "timestamp": 0.0}
+
+
+def delta(message_id: str, content: str) -> dict:
+    return frame("assistant_delta", message_id=message_id, content=content)
+
+
+async def flush(queue: OutboundQueue):
+    queue.start()
+    await queue.drain()
+    await queue.close()
+
+
+def test_drop_policy_discards_progress_frames_newest_first():
+    async def main():
+        websocket = FakeWebSocket()
+        queue = OutboundQueue(websocket, max_frames=3, policy="drop")
+        for queued in (frame("thinking", step=1), frame("tool_call", id=1), frame("thinking", step=2)):
+            await queue.put(queued)
+        await queue.put(frame("thinking", step=3))  # full: a progress frame is itself dropped
+        await queue.put(frame("tool_result", id=1))  # full: makes room by dropping the newest progress frame
+        await flush(queue)
+        return websocket, queue
+
+    websocket, queue = asyncio.run(main())
+    assert [(f["type"], f["data"]) for f in websocket.frames()] == [
+        ("thinking", {"step": 1}), ("tool_call", {"id": 1}), ("tool_result", {"id": 1})]
+    assert queue.dropped == 2
+
+
+def test_block_policy_waits_for_room_and_keeps_order():
+    async def main():
+        websocket = FakeWebSocket()
+        queue = OutboundQueue(websocket, max_frames=2, policy="block")
+        await queue.put(frame("thinking", step=1))
+        await queue.put(frame("thinking", step=2))
+        blocked = asyncio.ensure_future(queue.put(frame("thinking", step=3)))
+        await asyncio.sleep(0.01)
+        waited = not blocked.done()
+        queue.start()
+        await blocked
+        await flush(queue)
+        return websocket, queue, waited
+
+    websocket, queue, waited = asyncio.run(main())
+    assert waited
+    assert [f["data"]["step"] for f in websocket.frames()] == [1, 2, 3]
+    assert queue.dropped == 0
+
+
+def test_disconnect_policy_closes_with_1008():
+    async def main():
+        websocket = FakeWebSocket()
+        queue = OutboundQueue(websocket, max_frames=1, policy="disconnect")
+        await queue.put(frame("tool_call", id=1))
+        await queue.put(frame("tool_call", id=2))
+        await queue.put(frame("tool_call", id=3))  # ignored once the connection is closed
+        return websocket, queue
+
+    websocket, queue = asyncio.run(main())
+    assert websocket.closed_with == (1008, "client too slow")
+    assert websocket.messages == [] and queue.stats()["queued"] == 0
+
+
+def test_consecutive_deltas_of_one_message_are_merged():
+    async def main():
+        websocket = FakeWebSocket()
+        queue = OutboundQueue(websocket, policy="drop")
+        for queued in (delta("m1", "Hel"), delta("m1", "lo"), delta("m2", "Hi"), delta("m1", "!"),
+                       frame("tool_call", id=1), delta("m1", " again")):
+            await queue.put(queued)
+        await flush(queue)
+        return websocket, queue
+
+    websocket, queue = asyncio.run(main())
+    assert [(f["type"], f["data"].get("message_id"), f["data"].get("content")) for f in websocket.frames()] == [
+        ("assistant_delta", "m1", "Hello"), ("assistant_delta", "m2", "Hi"), ("assistant_delta", "m1", "!"),
+        ("tool_call", None, None), ("assistant_delta", "m1", " again")]
+    assert queue.coalesced == 1
+
+
+def test_batches_stay_under_the_byte_limit_in_order(monkeypatch):
+    frame_bytes = len(encode_frame("tool_call", {"id": 10}, 0.0))
+    monkeypatch.setenv("SEND_BATCH_FRAMES", "10")
+    max_bytes = 3 * frame_bytes + 4  # three frames, two commas and the brackets
+    monkeypatch.setenv("SEND_BATCH_MAX_BYTES", str(max_bytes))
+
+    async def main():
+        websocket = FakeWebSocket()
+        queue = OutboundQueue(websocket, policy="drop")
+        for number in range(10, 17):
+            await queue.put(frame("tool_call", id=number))
+        await flush(queue)
+        return websocket
+
+    websocket = asyncio.run(main())
+    assert [f["data"]["id"] for f in websocket.frames()] == list(range(10, 17))
+    batches = [json.loads(message) for message in websocket.messages]
+    assert [len(batch) if isinstance(batch, list) else 1 for batch in batches] == [3, 3, 1]
+    assert all(len(message) <= max_bytes for message in websocket.messages)
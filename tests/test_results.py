@@ -0,0 +1,96 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from web_socket.extraction import ExtractionPool
+from web_socket.results import ResultPager
+
+ROWS = [{"id": i, "region": "EMEA" if i % 2 else "APAC"} for i in range(1200)]
+
+
+def make_pager(monkeypatch, **env) -> ResultPager:
+    settings = {"TOOL_RESULT_INLINE_BYTES": "1024", "TOOL_RESULT_PAGE_ROWS": "500", "TOOL_RESULT_PAGE_BYTES": "4096"}
+    settings.update(env)
+    for name, value in settings.items():
+        monkeypatch.setenv(name, value)
+    return ResultPager()
+
+
+def paginate(pager: ResultPager, content, pool=None):
+    return asyncio.run(pager.paginate("run_query", "call-1", content, pool=pool))
+
+
+def rebuild(result):
+    """The original result from the preview plus every later page"""
+    preview = result.preview()
+    if result.rows_field:
+        rows = preview[result.rows_field] + [row for n in range(1, result.total_pages) for row in result.page(n)]
+        return {**preview, result.rows_field: rows}
+    if result.pages is not None:
+        return preview + [row for n in range(1, result.total_pages) for row in result.page(n)]
+    return preview + "".join(result.page(n) for n in range(1, result.total_pages))
+
+
+def test_json_array_is_paged_by_rows(monkeypatch):
+    pager = make_pager(monkeypatch)
+    result = paginate(pager, json.dumps(ROWS))
+    assert result.total_pages == 3 and len(result.preview()) == 500
+    assert rebuild(result) == ROWS
+    assert pager.get(result.handle) is result
+
+
+def test_json_object_pages_its_largest_list(monkeypatch):
+    pager = make_pager(monkeypatch)
+    document = {"columns": ["id", "region"], "rows": ROWS, "query": "SELECT *"}
+    result = paginate(pager, [{"type": "text", "text": json.dumps(document)}])
+    assert result.rows_field == "rows" and result.paging()["total_rows"] == 1200
+    assert result.preview()["columns"] == ["id", "region"]
+    assert rebuild(result) == document
+
+
+def test_text_is_paged_at_line_ends(monkeypatch):
+    pager = make_pager(monkeypatch)
+    text = "".join(f"line {i}: {'x' * (i % 70)}\n" for i in range(2000))
+    result = paginate(pager, text)
+    pages = [result.page(n) for n in range(result.total_pages)]
+    assert result.total_pages > 1 and all(page.endswith("\n") for page in pages)
+    assert all(len(page.encode()) <= 4096 for page in pages)
+    assert rebuild(result) == text
+
+
+def test_inline_threshold_counts_utf8_bytes(monkeypatch):
+    pager = make_pager(monkeypatch, TOOL_RESULT_PAGE_BYTES="1024")
+    assert paginate(pager, "a\n" * 512) is None  # exactly TOOL_RESULT_INLINE_BYTES
+    text = "ü\n" * 600  # 1200 characters but 1800 bytes
+    result = paginate(pager, text)
+    assert result is not None and result.size == 1800
+    assert rebuild(result) == text
+
+
+def test_large_results_are_split_on_the_pool(monkeypatch):
+    pager = make_pager(monkeypatch, TOOL_RESULT_OFFLOAD_BYTES="2048")
+    pool = ExtractionPool(mode="thread")
+    try:
+        result = paginate(pager, json.dumps(ROWS), pool=pool)
+    finally:
+        pool.shutdown()
+    assert rebuild(result) == ROWS
+
+
+def test_handles_expire(monkeypatch):
+    pager = make_pager(monkeypatch, TOOL_RESULT_HANDLE_TTL="60")
+    result = paginate(pager, json.dumps(ROWS))
+    clock = time.monotonic() + 61
+    monkeypatch.setattr("web_socket.cache.time.monotonic", lambda: clock)
+    with pytest.raises(ValueError, match="no longer available"):
+        pager.get(result.handle)
+
+
+def test_results_over_the_store_limit_are_preview_only(monkeypatch):
+    pager = make_pager(monkeypatch, TOOL_RESULT_STORE_BYTES="4096")
+    result = paginate(pager, json.dumps(ROWS))
+    assert result.handle is None and len(pager.results) == 0
+    assert len(result.preview()) == 500
+    assert rebuild(result) == ROWS
@@ -0,0 +1,150 @@
+import asyncio
+from types import SimpleNamespace
+
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.tools import StructuredTool
+
+from web_socket.admission import AdmissionController
+from web_socket.session import ChatSession
+from web_socket.tool_cache import ToolResultCache
+
+
+class SlowQuery:
+    """An MCP run_query call that waits until released, recording whether it was cancelled"""
+
+    def __init__(self):
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+        self.calls = 0
+        self.cancelled = False
+
+    def tool(self) -> StructuredTool:
+        async def run_query(sql: str) -> str:
+            self.calls += 1
+            self.started.set()
+            try:
+                await self.release.wait()
+            except asyncio.CancelledError:
+                self.cancelled = True
+                raise
+            return "region,total\nEMEA,10\n"
+        return StructuredTool.from_function(coroutine=run_query, name="run_query", description="Run a query")
+
+
+class StubAgent:
+    """Streams ``updates`` like the LangGraph agent: one tool call (if a tool is given), then the answer"""
+
+    def __init__(self, tool: StructuredTool = None):
+        self.tool = tool
+
+    async def astream(self, inputs, stream_mode=None, config=None):
+        if self.tool is not None:
+            call = {"name": self.tool.name, "args": {"sql": "SELECT 1"}, "id": "call-1"}
+            yield {"agent": {"messages": [AIMessage(content="", tool_calls=[call])]}}
+            result = await self.tool.ainvoke(call["args"])
+            yield {"tools": {"messages": [ToolMessage(content=result, tool_call_id="call-1", name=self.tool.name)]}}
+        yield {"agent": {"messages": [AIMessage(content=f"answer to: {inputs['messages'][-1]['content']}")]}}
+
+
+class RecordingStore:
+    def __init__(self):
+        self.snapshots = []
+
+    async def save(self, session):
+        self.snapshots.append(session.snapshot())
+
+
+def make_session(agent: StubAgent, user: str = "alice") -> ChatSession:
+    client = SimpleNamespace(admission=AdmissionController(), session_store=RecordingStore(),
+                             extraction_pool=None, route="worker-0")
+    session = ChatSession(client, websocket=None)
+    session.agent = agent
+    session.stream_tokens = False
+    session.current_credentials = {"tenant": "acme", "incortaUsername": user}
+    session.token = "token"
+    session.frames = []
+
+    async def send_message(message_type, data):
+        session.frames.append((message_type, data))
+
+    session.send_message = send_message
+    return session
+
+
+def roles(session: ChatSession) -> list:
+    return [message["role"] for message in session.conversation_history.as_messages()]
+
+
+def test_cancel_sends_cancelled_keeps_turns_alternating_and_saves_state():
+    slow = SlowQuery()
+    session = make_session(StubAgent(slow.tool()))
+
+    async def main():
+        await session.start_query("q1", session.handle_query, {"query": "revenue by region"})
+        await slow.started.wait()
+        return await session.cancel_query()
+
+    assert asyncio.run(main())
+    assert ("cancelled", {"query_id": "q1"}) in session.frames
+    assert not any(message_type == "completed" for message_type, _ in session.frames)
+    assert roles(session) == ["user", "assistant"]
+    assert session.conversation_history.as_messages()[-1]["content"] == "[Response cancelled by the user]"
+    saved = session.client.session_store.snapshots[-1]["history"]
+    assert saved == session.conversation_history.to_dict()
+
+
+def test_new_query_preempts_the_running_one():
+    slow = SlowQuery()
+    session = make_session(StubAgent(slow.tool()))
+
+    async def main():
+        await session.start_query("q1", session.handle_query, {"query": "first"})
+        await slow.started.wait()
+        session.agent = StubAgent()
+        await session.start_query("q2", session.handle_query, {"query": "second"})
+        await session.query_task
+
+    asyncio.run(main())
+    types = [message_type for message_type, _ in session.frames]
+    assert types.index("cancelled") < types.index("query_started", types.index("cancelled"))
+    assert session.frames[types.index("cancelled")][1] == {"query_id": "q1"}
+    assert session.frames[-1][0] == "completed" and session.frames[-1][1]["final_response"] == "answer to: second"
+    assert slow.cancelled
+    assert roles(session) == ["user", "assistant", "user", "assistant"]
+    assert len(session.client.session_store.snapshots) == 2
+
+
+def test_cancel_only_matches_the_running_query_id():
+    slow = SlowQuery()
+    session = make_session(StubAgent(slow.tool()))
+
+    async def main():
+        await session.start_query("q1", session.handle_query, {"query": "revenue"})
+        await slow.started.wait()
+        ignored = await session.cancel_query("q0")
+        running = not session.query_task.done()
+        return ignored, running, await session.cancel_query("q1"), await session.cancel_query("q1")
+
+    assert asyncio.run(main()) == (False, True, True, False)
+    assert [data for message_type, data in session.frames if message_type == "cancelled"] == [{"query_id": "q1"}]
+
+
+def test_shared_mcp_call_is_dropped_when_its_last_waiter_cancels():
+    slow = SlowQuery()
+    cache = ToolResultCache()
+    tool = cache.wrap(slow.tool(), scope=("https://env", "acme", "alice"))
+    first, second = make_session(StubAgent(tool)), make_session(StubAgent(tool))
+
+    async def main():
+        await first.start_query("q1", first.handle_query, {"query": "revenue"})
+        await second.start_query("q2", second.handle_query, {"query": "revenue"})
+        await slow.started.wait()
+        await asyncio.sleep(0)
+        await first.cancel_query()
+        still_running = not slow.cancelled
+        await second.cancel_query()
+        await asyncio.sleep(0)
+        return still_running
+
+    assert asyncio.run(main())
+    assert slow.calls == 1 and slow.cancelled
@@ -0,0 +1,87 @@
+import asyncio
+import json
+from langchain_core.tools import StructuredTool
+from web_socket.tool_cache import SharedToolResults, ToolResultCache
+
+
+def run_query_as(user: str, calls: list) -> StructuredTool:
+    """A run_query tool that, like Incorta row-level security, answers per user"""
+    async def run_query(sql: str) -> str:
+        calls.append(user)
+        return f"rows visible to {user}"
+    return StructuredTool.from_function(coroutine=run_query, name="run_query", description="Run a query")
+
+
+def test_users_in_one_tenant_do_not_share_results():
+    cache = ToolResultCache()
+    calls = []
+    alice = cache.wrap(run_query_as("alice", calls), scope=("https://env", "acme", "alice"))
+    bob = cache.wrap(run_query_as("bob", calls), scope=("https://env", "acme", "bob"))
+
+    async def main():
+        return [await alice.ainvoke({"sql": "SELECT 1"}), await bob.ainvoke({"sql": "SELECT 1"}),
+                await alice.ainvoke({"sql": "SELECT 1"})]
+
+    assert asyncio.run(main()) == ["rows visible to alice", "rows visible to bob", "rows visible to alice"]
+    assert calls == ["alice", "bob"]
+
+
+def test_users_in_one_tenant_do_not_share_results_across_workers(tmp_path, monkeypatch):
+    monkeypatch.setenv("TOOL_RESULT_SHARED_PATH", str(tmp_path / "tool_results.db"))
+    first_worker, second_worker = ToolResultCache(), ToolResultCache()
+    calls = []
+    alice = first_worker.wrap(run_query_as("alice", calls), scope=("https://env", "acme", "alice"))
+    bob = second_worker.wrap(run_query_as("bob", calls), scope=("https://env", "acme", "bob"))
+    alice_again = second_worker.wrap(run_query_as("alice", calls), scope=("https://env", "acme", "alice"))
+
+    async def main():
+        return [await alice.ainvoke({"sql": "SELECT 1"}), await bob.ainvoke({"sql": "SELECT 1"}),
+                await alice_again.ainvoke({"sql": "SELECT 1"})]
+
+    assert asyncio.run(main()) == ["rows visible to alice", "rows visible to bob", "rows visible to alice"]
+    assert calls == ["alice", "bob"]
+    assert second_worker.tool_stats["run_query"]["shared_hits"] == 1
+
+
+def test_client_scopes_discovered_tools_per_user(monkeypatch):
+    monkeypatch.setenv("METRICS_PORT", "0")
+    from web_socket.client import IncortaMCPClient
+    client = IncortaMCPClient()
+    calls = []
+
+    class FakeMCPClient:
+        def __init__(self, user):
+            self.user = user
+
+        async def get_tools(self):
+            return [run_query_as(self.user, calls)]
+
+    mcp_clients = {}
+    monkeypatch.setattr(client, "get_mcp_client",
+                        lambda credentials: mcp_clients.setdefault(credentials["incortaUsername"],
+                                                                   FakeMCPClient(credentials["incortaUsername"])))
+
+    async def main():
+        results = []
+        for user in ("alice", "bob"):
+            credentials = {"envUrl": "https://env", "tenant": "acme", "incortaUsername": user}
+            (tool,) = await client.get_tools(credentials)
+            results.append(await tool.ainvoke({"sql": "SELECT 1"}))
+        return results
+
+    assert asyncio.run(main()) == ["rows visible to alice", "rows visible to bob"]
+    assert calls == ["alice", "bob"]
+
+
+def test_shared_results_are_json_and_keep_mcp_tuples(tmp_path):
+    shared = SharedToolResults(str(tmp_path / "tool_results.db"))
+    content_and_artifact = ([{"type": "text", "text": "EMEA,10"}], {"structured_content": {"rows": 1}})
+
+    async def main():
+        await shared.set(("key",), ("scope",), content_and_artifact, ttl=60)
+        await shared.set(("text",), ("scope",), "rows", ttl=60)
+        return await shared.get(("key",)), await shared.get(("text",))
+
+    assert asyncio.run(main()) == (content_and_artifact, "rows")
+    stored = shared.connection.execute("SELECT value FROM tool_results").fetchall()
+    assert all(isinstance(json.loads(value), dict) for value, in stored)
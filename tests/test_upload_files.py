@@ -0,0 +1,10 @@
+from upload_files import CsvHandler, TxtHandler
+
+
+def test_latin1_text_files_are_extracted(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_bytes("Überblick: café crème\n".encode("latin-1"))
+    assert TxtHandler(str(path)).get_text() == "Überblick: café crème\n"
+    csv_path = tmp_path / "cities.csv"
+    csv_path.write_bytes("city,country\nZürich,Schweiz\n".encode("latin-1"))
+    assert "Zürich" in CsvHandler(str(csv_path)).get_text()
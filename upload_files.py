@@ -5,14 +5,32 @@ import filetype
 from PyPDF2 import PdfReader
 from abc import ABC, abstractmethod
 from docx import Document
+import numpy as np
 import pandas as pd
 import openpyxl
-from typing import List
+from typing import Iterator, List, NamedTuple
+import codecs
 import os
 # import easyocr  # Commented out to avoid heavy dependencies
 import logging
 # ----------------- Main class -----------------
+class TextChunk(NamedTuple):
+    """A piece of extracted text and where it came from.
+
+    ``unit`` is "page", "sheet", "table", "lines" or "paragraphs"; ``start``/``end``
+    are the 1-based, inclusive range of that unit the chunk covers (for a
+    sheet, its index in the workbook).
+    """
+    text: str
+    unit: str
+    start: int
+    end: int
+
+
 class FileHandler(ABC):
+    # Bump when the extracted text of a handler changes, to invalidate cached extractions
+    version = 1
+
     def __init__(self, file_path):
         self.file_path = file_path
         self.file_type = self.detect_file_type()
@@ -24,9 +42,33 @@ class FileHandler(ABC):
         return kind.mime
 
     @abstractmethod
-    def get_text(self):
+    def iter_chunks(self, **options) -> Iterator[TextChunk]:
+        """Yield the extracted text in page-, sheet- or line-block chunks, in order.
+
+        ``options`` are handler-specific (e.g. ``max_rows_per_sheet`` for Excel);
+        handlers ignore the ones they do not use.
+        """
         pass
 
+    def get_text(self, max_chars: int = None, **options) -> str:
+        """Join the chunks; with ``max_chars`` stop reading once the budget is reached"""
+        if max_chars is None:
+            return ''.join(chunk.text for chunk in self.iter_chunks(**options))
+        parts = []
+        used = 0
+        for chunk in self.iter_chunks(**options):
+            if used + len(chunk.text) > max_chars:
+                parts.append(chunk.text[:max_chars - used])
+                parts.append(f"\n[... truncated at {chunk.unit} {chunk.start} after {max_chars} characters ...]\n")
+                break
+            parts.append(chunk.text)
+            used += len(chunk.text)
+        return ''.join(parts)
+
+    def cache_options(self) -> dict:
+        """Options that change the extracted text, part of the extraction cache key"""
+        return {}
+
     @abstractmethod
     def add_text(self, text: str):
         pass
@@ -34,12 +76,131 @@ class FileHandler(ABC):
 # ---------- each type class ----------
 
 
+# ---------- tabular helpers ----------
+
+# "profile" renders schema, column stats and a sample; "rows" dumps the rows as before
+TABULAR_RENDER_MODE = os.getenv("TABULAR_RENDER_MODE", "profile")
+
+
+def profile_dataframe(df: pd.DataFrame, top_k: int = 5) -> str:
+    """Compact per-column profile: dtype, nulls, distinct values and min/max or top values"""
+    nulls = df.isna().sum()
+    distinct = df.nunique(dropna=True)
+    numeric = df.select_dtypes(include="number")
+    numeric_stats = numeric.agg(["min", "max", "mean"]) if not numeric.empty else None
+    dates = df.select_dtypes(include="datetime")
+    date_stats = dates.agg(["min", "max"]) if not dates.empty else None
+
+    lines = []
+    for column in df.columns:
+        line = f"- {column} ({df[column].dtype}): {nulls[column]} nulls, {distinct[column]} distinct"
+        if numeric_stats is not None and column in numeric_stats.columns:
+            stats = numeric_stats[column]
+            line += f"; min {stats['min']:g}, max {stats['max']:g}, mean {stats['mean']:g}"
+        elif date_stats is not None and column in date_stats.columns:
+            line += f"; min {date_stats[column]['min']}, max {date_stats[column]['max']}"
+        elif distinct[column] > len(df) // 2:
+            # mostly unique values: top values say nothing, show a few examples instead
+            examples = df[column].dropna().head(3)
+            line += "; e.g. " + ", ".join(str(value)[:40] for value in examples)
+        elif distinct[column]:
+            top = df[column].value_counts(normalize=True, dropna=True).head(top_k)
+            line += "; top: " + ", ".join(f"{str(value)[:40]} ({share:.0%})" for value, share in top.items())
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def evenly_spaced(df: pd.DataFrame, rows: int) -> pd.DataFrame:
+    if len(df) <= rows:
+        return df
+    positions = [round(i * (len(df) - 1) / (rows - 1)) for i in range(rows)] if rows > 1 else [0]
+    return df.iloc[positions]
+
+
+def stratified_sample(df: pd.DataFrame, sample_rows: int = 20):
+    """Pick representative rows: spread over each group of a low-cardinality column, else over the table"""
+    if len(df) <= sample_rows:
+        return df, None
+    for column in df.columns:
+        if pd.api.types.is_numeric_dtype(df[column]) or pd.api.types.is_datetime64_any_dtype(df[column]):
+            continue
+        groups = df[column].nunique(dropna=True)
+        if 2 <= groups <= sample_rows // 2:
+            per_group = sample_rows // groups
+            sample = pd.concat(evenly_spaced(group, per_group) for _, group in df.groupby(column, sort=False))
+            return sample.sort_index(), column
+    return evenly_spaced(df, sample_rows), None
+
+
+def render_table_profile(title: str, df: pd.DataFrame, total_rows: int, sample_rows: int = 20) -> str:
+    """Schema, column statistics and a sample of a table, instead of all of its rows"""
+    header = f"{title}: {total_rows} rows x {len(df.columns)} columns"
+    if total_rows > len(df):
+        header += f" (statistics from the first {len(df)} rows)"
+    sample, stratified_by = stratified_sample(df, sample_rows)
+    sample_title = f"Sample ({len(sample)} rows" + (f", stratified by {stratified_by})" if stratified_by else ")")
+    return f"{header}\nColumns:\n{profile_dataframe(df)}\n\n{sample_title}:\n{sample.to_csv(index=False, float_format='%.6g')}"
+
+
 # Csv to txt 
 
+def detect_encoding(file_path: str, sample_bytes: int = 1024 * 1024) -> str:
+    """Guess a text file's encoding from its first ``sample_bytes``.
+
+    UTF-8 (with or without a BOM) when the sample decodes as such, otherwise
+    Latin-1, which accepts any byte. Readers still pass ``errors='replace'``
+    so that a stray byte past the sample does not fail the whole file.
+    """
+    with open(file_path, 'rb') as file:
+        sample = file.read(sample_bytes)
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        # a multi-byte character may be cut at the end of the sample
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+
+def iter_line_blocks(file_path: str, lines_per_chunk: int) -> Iterator[TextChunk]:
+    """Stream a text file in blocks of lines without reading it whole"""
+    with open(file_path, 'r', encoding=detect_encoding(file_path), errors='replace') as file:
+        block = []
+        first_line = 1
+        for line_number, line in enumerate(file, 1):
+            block.append(line)
+            if len(block) == lines_per_chunk:
+                yield TextChunk(''.join(block), "lines", first_line, line_number)
+                block = []
+                first_line = line_number + 1
+        if block:
+            yield TextChunk(''.join(block), "lines", first_line, first_line + len(block) - 1)
+
+
 class CsvHandler(FileHandler):
-    def get_text(self): # need to make it robust to more encodings
-        with open(self.file_path, 'r', encoding='utf-8') as file:
-            return file.read()
+    version = 3
+    lines_per_chunk = 1000
+    render_mode = TABULAR_RENDER_MODE
+    max_profile_rows = 100000
+
+    def iter_chunks(self, **options) -> Iterator[TextChunk]:
+        if self.render_mode == "rows":
+            return iter_line_blocks(self.file_path, self.lines_per_chunk)
+        return self._iter_profile()
+
+    def _iter_profile(self) -> Iterator[TextChunk]:
+        encoding = detect_encoding(self.file_path)
+        df = pd.read_csv(self.file_path, nrows=self.max_profile_rows, encoding=encoding, encoding_errors='replace')
+        total_rows = len(df)
+        if total_rows == self.max_profile_rows:
+            # count the remaining rows without parsing them
+            with open(self.file_path, 'r', encoding=encoding, errors='replace') as file:
+                total_rows = sum(1 for _ in file) - 1
+        yield TextChunk(render_table_profile("CSV table", df, total_rows), "table", 1, 1)
+
+    def cache_options(self) -> dict:
+        return {"render_mode": self.render_mode, "max_profile_rows": self.max_profile_rows}
     
     def add_text(self, text: str):
         return text
@@ -48,76 +209,171 @@ class CsvHandler(FileHandler):
 
 
 class PdfHandler(FileHandler):
-    def get_text(self):
+    def iter_chunks(self, **options) -> Iterator[TextChunk]:
         with open(self.file_path, 'rb') as file:
             reader = PdfReader(file)
-            text = ''
             for page_num, page in enumerate(reader.pages, 1):
-                text += page.extract_text()
                 # attach page number with a divider
-                text += f"\n--- Page {page_num} ---\n"
-            return text
+                yield TextChunk(f"{page.extract_text()}\n--- Page {page_num} ---\n", "page", page_num, page_num)
     
     def add_text(self, text: str):
         return text
 
 
 class DocxHandler(FileHandler):
-    def get_text(self):
+    paragraphs_per_chunk = 200
+
+    def iter_chunks(self, **options) -> Iterator[TextChunk]:
         doc = Document(self.file_path)
-        return '\n'.join([para.text for para in doc.paragraphs])
+        paragraphs = doc.paragraphs
+        for start in range(0, len(paragraphs), self.paragraphs_per_chunk):
+            block = paragraphs[start:start + self.paragraphs_per_chunk]
+            # paragraphs are newline-separated, so later blocks start with the separator
+            text = ('\n' if start else '') + '\n'.join(para.text for para in block)
+            yield TextChunk(text, "paragraphs", start + 1, start + len(block))
     
     def add_text(self, text: str):
         return text
 
 class TxtHandler(FileHandler):
-    def get_text(self) -> str:
-        with open(self.file_path, 'r', encoding='utf-8') as file:
-            return file.read()
+    version = 2
+    lines_per_chunk = 1000
+
+    def iter_chunks(self, **options) -> Iterator[TextChunk]:
+        return iter_line_blocks(self.file_path, self.lines_per_chunk)
     
     def add_text(self, text: str):
         return text
 
        
 
+def _trim_row(row: tuple) -> tuple:
+    """Drop a row's trailing empty cells"""
+    end = len(row)
+    while end and row[end - 1] in (None, ""):
+        end -= 1
+    return tuple(row[:end])
+
+
+def _dedup_column_names(names: list, unnamed: list) -> list:
+    """Rename repeated column names ``x``, ``x.1``, ``x.2``... the way pandas' Excel reader does.
+
+    Named columns keep their names before the positions in ``unnamed`` are
+    renamed, and a suffix is skipped when another column already has that name.
+    """
+    names = list(names)
+    counts = {}
+    for i in [i for i in range(len(names)) if i not in unnamed] + unnamed:
+        name = names[i]
+        count = counts.get(name, 0)
+        while count:
+            counts[names[i]] = count + 1
+            name = f"{names[i]}.{count}"
+            count = count + 1 if name in names else counts.get(name, 0)
+        counts[name] = count + 1
+        names[i] = name
+    return names
+
+
 class ExcelHandler(FileHandler):
-    def get_text(self, max_rows_per_sheet: int = 1000) -> str:
+    version = 2
+    max_rows_per_sheet = 1000
+    render_mode = TABULAR_RENDER_MODE
+    max_profile_rows = 20000
+
+    def iter_sheets(self, max_rows: int):
+        """Read every sheet in one pass over the workbook.
+
+        Yields ``(sheet_name, DataFrame of at most max_rows rows, total_rows,
+        error)``. ``.xlsx`` files are streamed with openpyxl in read-only mode;
+        other formats are opened once through ``pd.ExcelFile``.
+        """
+        if not self.file_path.lower().endswith(('.xlsx', '.xlsm')) and self.file_type != \
+                "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet":
+            with pd.ExcelFile(self.file_path) as workbook:
+                for sheet_name in workbook.sheet_names:
+                    try:
+                        df = workbook.parse(sheet_name, nrows=max_rows)
+                        yield sheet_name, df, len(df), None
+                    except Exception as e:
+                        yield sheet_name, None, 0, e
+            return
+
+        workbook = openpyxl.load_workbook(self.file_path, read_only=True, data_only=True)
         try:
-    
-            sheet_names = self.get_sheet_names()
-            
-            text_parts = []
-            
-            for sheet_name in sheet_names:
+            for worksheet in workbook.worksheets:
                 try:
-
-                    df = pd.read_excel(
-                        self.file_path, 
-                        sheet_name=sheet_name,
-                        nrows=max_rows_per_sheet
-                    )
-                    
-                    if df.empty:
-                        sheet_text = f"This is a sheet named '{sheet_name}' data: [Empty sheet]"
-                    else:
-                        metadata = f"Sheet '{sheet_name}' contains {len(df)} rows and {len(df.columns)} columns."
-                        if len(df) == max_rows_per_sheet:
-                            metadata += f" (Limited to first {max_rows_per_sheet} rows)"
-                        
-                        # Convert to text
-                        data_text = df.to_string(index=False)
-                        sheet_text = f"This is a sheet named '{sheet_name}' data:\n{metadata}\n\n{data_text}"
-                    
-                    text_parts.append(sheet_text)
-                    
+                    rows = worksheet.iter_rows(values_only=True)
+                    header = next(rows, None)
+                    if header is None:
+                        yield worksheet.title, pd.DataFrame(), 0, None
+                        continue
+                    data = []
+                    truncated = False
+                    for row in rows:
+                        data.append(_trim_row(row))
+                        if len(data) == max_rows:
+                            truncated = True
+                            break
+                    # empty rows are kept as NaN rows, except at the end of what was read
+                    while data and not data[-1]:
+                        data.pop()
+                    header = _trim_row(header)
+                    width = max([len(header)] + [len(row) for row in data])
+                    header += (None,) * (width - len(header))
+                    unnamed = [i for i, name in enumerate(header) if name in (None, "")]
+                    columns = _dedup_column_names([f"Unnamed: {i}" if i in unnamed else name
+                                                   for i, name in enumerate(header)], unnamed)
+                    data = [row + (None,) * (width - len(row)) for row in data]
+                    # a truncated sheet's dimension gives the row count without reading the remaining rows
+                    total_rows = max(len(data), (worksheet.max_row or 1) - 1) if truncated else len(data)
+                    df = pd.DataFrame(data, columns=columns).fillna(np.nan).infer_objects()
+                    yield worksheet.title, df, total_rows, None
                 except Exception as e:
-                    text_parts.append(f"This is a sheet named '{sheet_name}' data: [Error reading sheet: {str(e)}]")
-            
-            return "\n\n" + "="*50 + "\n\n".join(text_parts)
+                    yield worksheet.title, None, 0, e
+        finally:
+            workbook.close()
+
+    def iter_chunks(self, **options) -> Iterator[TextChunk]:
+        max_rows_per_sheet = options.get("max_rows_per_sheet") or self.max_rows_per_sheet
+        max_rows = self.max_profile_rows if self.render_mode == "profile" else max_rows_per_sheet
+        
+        # sheets are separated by blank lines, after a divider before the first one
+        separator = "\n\n" + "="*50
+        sheet_index = 0
+        
+        for sheet_index, (sheet_name, df, total_rows, error) in enumerate(self.iter_sheets(max_rows), 1):
+            if error is not None:
+                sheet_text = f"This is a sheet named '{sheet_name}' data: [Error reading sheet: {str(error)}]"
+            elif df.empty:
+                sheet_text = f"This is a sheet named '{sheet_name}' data: [Empty sheet]"
+            elif self.render_mode == "profile":
+                sheet_text = render_table_profile(f"Sheet '{sheet_name}'", df, total_rows)
+            else:
+                metadata = f"Sheet '{sheet_name}' contains {len(df)} rows and {len(df.columns)} columns."
+                if len(df) == max_rows_per_sheet:
+                    metadata += f" (Limited to first {max_rows_per_sheet} rows)"
+                
+                # Convert to text
+                data_text = df.to_string(index=False)
+                sheet_text = f"This is a sheet named '{sheet_name}' data:\n{metadata}\n\n{data_text}"
             
+            yield TextChunk(separator + sheet_text, "sheet", sheet_index, sheet_index)
+            separator = "\n\n"
+        
+        if not sheet_index:
+            yield TextChunk(separator, "sheet", 0, 0)
+
+    def get_text(self, max_chars: int = None, **options) -> str:
+        try:
+            return super().get_text(max_chars=max_chars, **options)
         except Exception as e:
             return f"Error reading Excel file: {str(e)}"
     
+    def cache_options(self) -> dict:
+        return {"max_rows_per_sheet": self.max_rows_per_sheet, "render_mode": self.render_mode,
+                "max_profile_rows": self.max_profile_rows}
+
     def get_sheet_names(self) -> List[str]:
         """Fast method to get sheet names using openpyxl"""
         try:
@@ -132,6 +388,10 @@ class ExcelHandler(FileHandler):
         context = """The following data comes from an Excel spreadsheet with multiple sheets.
 Each sheet is clearly labeled with its name. Use this data to answer questions about the spreadsheet content.
 
+"""
+        if self.render_mode == "profile":
+            context += """Each sheet is summarised by its column statistics and a representative sample of rows, not every row.
+
 """
         return context + text
 
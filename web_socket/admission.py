@@ -0,0 +1,244 @@
+import asyncio
+import functools
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.tools import BaseTool
+from .history import estimate_tokens
+from .logger import logger
+
+
+def _parse_weights(value: str) -> dict:
+    """``"acme=3,beta=0.5"`` -> {"acme": 3.0, "beta": 0.5}"""
+    weights = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() and weight.strip():
+            weights[name.strip()] = float(weight)
+    return weights
+
+
+class TokenBucket:
+    """Refills ``rate`` units per second up to ``burst``.
+
+    Takers reserve what they need and sleep off any shortfall, so the bucket
+    may go into debt: a large request waits longer instead of starving, and
+    requests are served in the order they asked.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def charge(self, amount: float) -> float:
+        """Take ``amount`` now and return the seconds until the bucket is out of debt"""
+        self._refill()
+        self.tokens -= amount
+        return max(0.0, -self.tokens / self.rate)
+
+    async def take(self, amount: float) -> float:
+        delay = self.charge(amount)
+        if delay:
+            await asyncio.sleep(delay)
+        return delay
+
+
+class TenantState:
+    def __init__(self, name: str, weight: float, llm_tokens: TokenBucket = None, mcp_calls: TokenBucket = None):
+        self.name = name
+        self.weight = weight
+        self.llm_tokens = llm_tokens
+        self.mcp_calls = mcp_calls
+        self.active = 0
+        self.users = {}  # user -> runs in progress
+        self.last_tag = 0.0
+        self.throttled_seconds = 0.0
+
+
+class _Waiter:
+    def __init__(self, tag: float, start: float, tenant: TenantState, user: str):
+        self.tag = tag
+        self.start = start
+        self.tenant = tenant
+        self.user = user
+        self.admitted = False
+        self.position = 0
+        self.wakeup = asyncio.Event()
+
+
+class AdmissionController:
+    """Fair-share admission for agent runs, with per-tenant rate limits.
+
+    At most ``AGENT_MAX_CONCURRENCY`` runs execute at once, and at most
+    ``TENANT_MAX_CONCURRENCY`` per tenant and ``USER_MAX_CONCURRENCY`` per
+    user. Runs beyond that wait in a weighted fair queue: each tenant's runs
+    are tagged with a virtual finish time that advances by ``1 / weight``
+    (``TENANT_WEIGHTS``, e.g. ``acme=3,beta=0.5``; default 1), so a tenant
+    with a burst of queries cannot push another tenant's next query to the
+    back. Within a run, LLM tokens and MCP calls are drawn from per-tenant
+    token buckets (``TENANT_LLM_TOKENS_PER_MINUTE``,
+    ``TENANT_MCP_CALLS_PER_MINUTE``; 0 disables) and wait when they are empty.
+    """
+
+    def __init__(self):
+        self.max_concurrency = int(os.getenv("AGENT_MAX_CONCURRENCY", "32"))
+        self.tenant_concurrency = int(os.getenv("TENANT_MAX_CONCURRENCY", "8"))
+        self.user_concurrency = int(os.getenv("USER_MAX_CONCURRENCY", "2"))
+        self.weights = _parse_weights(os.getenv("TENANT_WEIGHTS", ""))
+        self.llm_tokens_per_minute = float(os.getenv("TENANT_LLM_TOKENS_PER_MINUTE", "0"))
+        self.mcp_calls_per_minute = float(os.getenv("TENANT_MCP_CALLS_PER_MINUTE", "0"))
+        self.tenants = {}  # tenant -> TenantState
+        self.active = 0
+        self.virtual_time = 0.0
+        self._queue = []  # heap of (tag, sequence, waiter)
+        self._sequence = itertools.count()
+        self.admitted = 0
+        self.queued = 0
+        self.wait_seconds = 0.0
+
+    def tenant(self, name: str) -> TenantState:
+        state = self.tenants.get(name)
+        if state is None:
+            llm_tokens = mcp_calls = None
+            if self.llm_tokens_per_minute > 0:
+                # Up to a minute's budget can be spent at once
+                llm_tokens = TokenBucket(self.llm_tokens_per_minute / 60, self.llm_tokens_per_minute)
+            if self.mcp_calls_per_minute > 0:
+                mcp_calls = TokenBucket(self.mcp_calls_per_minute / 60, self.mcp_calls_per_minute)
+            state = TenantState(name, self.weights.get(name, 1.0), llm_tokens, mcp_calls)
+            self.tenants[name] = state
+        return state
+
+    def _can_run(self, tenant: TenantState, user: str) -> bool:
+        return (self.active < self.max_concurrency
+                and tenant.active < self.tenant_concurrency
+                and tenant.users.get(user, 0) < self.user_concurrency)
+
+    def _start(self, tenant: TenantState, user: str):
+        self.active += 1
+        tenant.active += 1
+        tenant.users[user] = tenant.users.get(user, 0) + 1
+
+    def _finish(self, tenant: TenantState, user: str):
+        self.active -= 1
+        tenant.active -= 1
+        tenant.users[user] -= 1
+        if not tenant.users[user]:
+            del tenant.users[user]
+
+    def _dispatch(self):
+        """Admit queued runs in tag order while their limits allow, then renumber the rest"""
+        remaining = []
+        for entry in sorted(self._queue):
+            waiter = entry[2]
+            if not self._can_run(waiter.tenant, waiter.user):
+                remaining.append(entry)
+                continue
+            self._start(waiter.tenant, waiter.user)
+            self.virtual_time = max(self.virtual_time, waiter.start)
+            waiter.admitted = True
+            waiter.wakeup.set()
+        self._queue = remaining  # sorted, so still a heap
+        for position, (_, _, waiter) in enumerate(remaining, 1):
+            if waiter.position != position:
+                waiter.position = position
+                waiter.wakeup.set()
+
+    @asynccontextmanager
+    async def admit(self, tenant: str, user: str, on_queued=None):
+        """Hold a run slot for the body; ``await on_queued(position, queue_length)`` while waiting"""
+        state = self.tenant(tenant)
+        start = max(self.virtual_time, state.last_tag)
+        state.last_tag = start + 1 / state.weight
+        waiter = _Waiter(state.last_tag, start, state, user)
+        heapq.heappush(self._queue, (waiter.tag, next(self._sequence), waiter))
+        self._dispatch()
+        if not waiter.admitted:
+            self.queued += 1
+            logger.info("Queued agent run for %s@%s at position %d (%d/%d running)",
+                        user, tenant, waiter.position, self.active, self.max_concurrency)
+        started = time.monotonic()
+        reported = 0
+        try:
+            while True:
+                waiter.wakeup.clear()
+                if waiter.admitted:
+                    break
+                if on_queued is not None and waiter.position != reported:
+                    reported = waiter.position
+                    await on_queued(reported, len(self._queue))
+                await waiter.wakeup.wait()
+        except BaseException:
+            if waiter.admitted:
+                self._finish(state, user)
+            else:
+                self._queue = [entry for entry in self._queue if entry[2] is not waiter]
+                heapq.heapify(self._queue)
+            self._dispatch()
+            raise
+        self.admitted += 1
+        self.wait_seconds += time.monotonic() - started
+        try:
+            yield state
+        finally:
+            self._finish(state, user)
+            self._dispatch()
+
+    def limit_tool(self, tool: BaseTool, tenant: str) -> BaseTool:
+        """Return a copy of ``tool`` whose calls draw from the tenant's MCP call bucket"""
+        state = self.tenant(tenant)
+        original = tool.coroutine
+        if original is None or state.mcp_calls is None:
+            return tool
+
+        @functools.wraps(original)
+        async def limited_call(*args, **kwargs):
+            state.throttled_seconds += await state.mcp_calls.take(1)
+            return await original(*args, **kwargs)
+
+        return tool.model_copy(update={"coroutine": limited_call})
+
+    def llm_callbacks(self, tenant: TenantState) -> list:
+        """Callbacks for an agent run that meter its LLM tokens against the tenant's bucket"""
+        return [TenantTokenMeter(tenant)] if tenant.llm_tokens is not None else []
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "queued": len(self._queue),
+            "admitted": self.admitted,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "tenants": {name: {"active": state.active,
+                               "queued": sum(1 for _, _, w in self._queue if w.tenant is state),
+                               "throttled_seconds": round(state.throttled_seconds, 3)}
+                        for name, state in self.tenants.items()},
+        }
+
+
+class TenantTokenMeter(AsyncCallbackHandler):
+    """Waits for the tenant's LLM token bucket before each model call and charges the output after it"""
+
+    def __init__(self, tenant: TenantState):
+        self.tenant = tenant
+
+    async def on_chat_model_start(self, serialized, messages, **kwargs):
+        prompt = sum(estimate_tokens(str(message.content)) for batch in messages for message in batch)
+        self.tenant.throttled_seconds += await self.tenant.llm_tokens.take(prompt)
+
+    async def on_llm_end(self, response, **kwargs):
+        output = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                output += usage["output_tokens"] if usage else estimate_tokens(generation.text)
+        self.tenant.llm_tokens.charge(output)
@@ -0,0 +1,94 @@
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Small in-process cache with per-entry expiry and LRU eviction.
+
+    ``ttl`` is the default lifetime of an entry in seconds (``None`` keeps
+    entries until they are evicted). ``max_entries`` bounds the number of
+    entries and ``max_size`` optionally bounds the total ``size`` given to
+    ``set`` (e.g. bytes); the least recently used entries are dropped first.
+    """
+
+    def __init__(self, ttl: float = None, max_entries: int = 256, max_size: int = None, on_evict=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.on_evict = on_evict  # called as on_evict(key, value) for expired or evicted entries
+        self._entries = OrderedDict()  # key -> (expires_at, value, size)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires_at, value, _ = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._evict(key)
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: float = None, size: int = 1):
+        ttl = self.ttl if ttl is None else ttl
+        if self.max_size is not None and size > self.max_size:
+            return  # would evict everything else
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self._remove(key)
+        self._entries[key] = (expires_at, value, size)
+        self.size += size
+        while len(self._entries) > self.max_entries or (self.max_size is not None and self.size > self.max_size):
+            self._evict(next(iter(self._entries)))
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        """Remove and return a live entry"""
+        value = self.get(key, default)
+        self._remove(key)
+        return value
+
+    def expire(self):
+        """Drop all expired entries now instead of on their next lookup"""
+        now = time.monotonic()
+        for key in [k for k, (expires_at, _, _) in self._entries.items() if expires_at is not None and expires_at <= now]:
+            self._evict(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+        return entry
+
+    def _evict(self, key):
+        entry = self._remove(key)
+        if entry is not None and self.on_evict is not None:
+            self.on_evict(key, entry[1])
+
+    def invalidate(self, key):
+        self._remove(key)
+
+    def invalidate_where(self, predicate):
+        """Drop every entry whose key matches ``predicate``"""
+        for key in [k for k in self._entries if predicate(k)]:
+            self._remove(key)
+
+    def clear(self):
+        entries, self._entries = self._entries, OrderedDict()
+        self.size = 0
+        if self.on_evict is not None:
+            for key, (_, value, _) in entries.items():
+                self.on_evict(key, value)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "size": self.size, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+    def __len__(self):
+        return len(self._entries)
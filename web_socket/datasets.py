@@ -0,0 +1,195 @@
+import asyncio
+import base64
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from contextlib import closing
+import pandas as pd
+from langchain_core.tools import StructuredTool
+from .logger import logger
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from upload_files import ExcelHandler, detect_encoding
+
+TABULAR_EXTENSIONS = (".csv", ".xlsx", ".xlsm", ".xls")
+
+# PRAGMAs that only read the schema; any other PRAGMA given a value is refused
+READ_ONLY_PRAGMAS = ("table_info", "table_xinfo", "table_list", "index_list", "index_info", "index_xinfo",
+                     "foreign_key_list")
+
+
+def is_tabular(file_data: dict) -> bool:
+    return os.path.splitext(file_data.get("name", ""))[1].lower() in TABULAR_EXTENSIONS
+
+
+def _authorize(action, arg1, arg2, db_name, source):
+    """SQLite authorizer keeping model-written SQL inside the session database"""
+    if action in (sqlite3.SQLITE_ATTACH, sqlite3.SQLITE_DETACH):
+        return sqlite3.SQLITE_DENY
+    if action == sqlite3.SQLITE_PRAGMA and arg2 is not None and arg1.lower() not in READ_ONLY_PRAGMAS:
+        return sqlite3.SQLITE_DENY
+    return sqlite3.SQLITE_OK
+
+
+def _table_name(*parts: str) -> str:
+    name = re.sub(r"\W+", "_", "_".join(parts)).strip("_").lower() or "data"
+    return f"t_{name}" if name[0].isdigit() else name
+
+
+def _unique_table_name(name: str, taken: set) -> str:
+    """``name``, suffixed with ``_2``, ``_3``... while another upload already uses it"""
+    unique, suffix = name, 1
+    while unique in taken:
+        suffix += 1
+        unique = f"{name}_{suffix}"
+    taken.add(unique)
+    return unique
+
+
+def load_tabular_file(path: str, file_name: str, db_path: str, max_rows: int, taken: set = ()) -> list:
+    """Load a CSV/Excel file into the SQLite database at ``db_path``.
+
+    Runs inside an ``ExtractionPool`` worker. Table names already in ``taken``
+    are not reused. Returns ``[(table, rows)]``.
+    """
+    stem = os.path.splitext(file_name)[0]
+    taken = set(taken)
+    tables = []
+    # A running query holds a read lock for up to DATASET_QUERY_TIMEOUT, so wait longer than sqlite's 5s default
+    with closing(sqlite3.connect(db_path, timeout=60)) as connection:
+        if file_name.lower().endswith(".csv"):
+            table = _unique_table_name(_table_name(stem), taken)
+            rows = 0
+            for chunk in pd.read_csv(path, chunksize=50000, encoding=detect_encoding(path), encoding_errors="replace"):
+                chunk = chunk.head(max_rows - rows)
+                chunk.to_sql(table, connection, if_exists="replace" if rows == 0 else "append", index=False)
+                rows += len(chunk)
+                if rows >= max_rows:
+                    break
+            tables.append((table, rows))
+        else:
+            for sheet_name, df, _, error in ExcelHandler(path).iter_sheets(max_rows):
+                if error is not None or df.empty:
+                    continue
+                table = _unique_table_name(_table_name(stem, sheet_name), taken)
+                df.to_sql(table, connection, if_exists="replace", index=False)
+                tables.append((table, len(df)))
+    return tables
+
+
+def load_uploaded_file(file_data: dict, db_path: str, max_rows: int, taken: set = ()) -> list:
+    """``load_tabular_file`` for either a chunked upload or base64 content"""
+    if file_data.get("path"):
+        return load_tabular_file(file_data["path"], file_data["name"], db_path, max_rows, taken)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file_data["name"])[1]) as temp_file:
+        temp_file.write(base64.b64decode(file_data["content"]))
+        temp_path = temp_file.name
+    try:
+        return load_tabular_file(temp_path, file_data["name"], db_path, max_rows, taken)
+    finally:
+        os.unlink(temp_path)
+
+
+class DatasetStore:
+    """Session-scoped SQLite database holding the full rows of uploaded tables.
+
+    Uploaded CSV/Excel files are loaded once (up to ``DATASET_MAX_ROWS`` rows
+    per table) and the agent gets a ``query_uploaded_data`` tool to filter and
+    aggregate them locally, so only the profile and query results enter the
+    prompt. Queries are read-only, limited to ``DATASET_QUERY_MAX_ROWS``
+    result rows and ``DATASET_QUERY_TIMEOUT`` seconds, and may not ATTACH
+    other files or change settings with PRAGMA. They share one connection,
+    which ``close`` closes with the session. Loads run one at a time, as
+    SQLite allows a single writer, and never reuse a table name.
+    """
+
+    def __init__(self, directory: str = None):
+        handle, self.db_path = tempfile.mkstemp(prefix="incorta-datasets-", suffix=".sqlite", dir=directory)
+        os.close(handle)
+        self.max_rows = int(os.getenv("DATASET_MAX_ROWS", "5000000"))
+        self.max_result_rows = int(os.getenv("DATASET_QUERY_MAX_ROWS", "200"))
+        self.timeout = float(os.getenv("DATASET_QUERY_TIMEOUT", "10"))
+        self.tables = {}  # table -> (file name, rows)
+        self._tool = None
+        self._connection = None
+        self._lock = threading.Lock()  # queries run on worker threads and share the connection
+        self._load_lock = asyncio.Lock()
+
+    async def load(self, pool, file_data: dict) -> list:
+        """Load an uploaded file on the extraction pool and register its tables"""
+        async with self._load_lock:
+            tables = await pool.run(load_uploaded_file, file_data, self.db_path, self.max_rows, set(self.tables))
+            for table, rows in tables:
+                self.tables[table] = (file_data["name"], rows)
+        self._tool = None  # the tool description lists the tables
+        logger.info("Loaded %s into local tables %s", file_data["name"], [t for t, _ in tables])
+        return tables
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+            self._connection.set_authorizer(_authorize)
+        return self._connection
+
+    def describe(self) -> str:
+        lines = []
+        with self._lock:
+            connection = self._connect()
+            for table, (file_name, rows) in self.tables.items():
+                columns = connection.execute(f'PRAGMA table_info("{table}")').fetchall()
+                column_list = ", ".join(f'"{c[1]}" {c[2] or "TEXT"}' for c in columns)
+                lines.append(f"- {table} ({rows} rows, from {file_name}): {column_list}")
+        return "\n".join(lines)
+
+    def _query(self, sql: str) -> str:
+        with self._lock:
+            deadline = time.monotonic() + self.timeout
+            try:
+                connection = self._connect()
+                # Abort runaway queries
+                connection.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+                with closing(connection.execute(sql)) as cursor:
+                    columns = [d[0] for d in cursor.description or []]
+                    rows = cursor.fetchmany(self.max_result_rows + 1)
+            except sqlite3.Error as e:
+                return f"SQL error: {e}"
+        truncated = len(rows) > self.max_result_rows
+        result = pd.DataFrame(rows[:self.max_result_rows], columns=columns).to_csv(index=False)
+        if truncated:
+            result += f"[only the first {self.max_result_rows} rows are shown; aggregate or add LIMIT/WHERE]\n"
+        return result
+
+    async def query(self, sql: str) -> str:
+        return await asyncio.to_thread(self._query, sql)
+
+    def as_tool(self) -> StructuredTool:
+        """The agent tool for this store, rebuilt only when the tables change"""
+        if self._tool is not None:
+            return self._tool
+
+        async def query_uploaded_data(sql: str) -> str:
+            return await self.query(sql)
+
+        self._tool = StructuredTool.from_function(
+            coroutine=query_uploaded_data,
+            name="query_uploaded_data",
+            description=(
+                "Run a read-only SQLite SQL query against the full rows of the files the user uploaded "
+                "in this chat (not Incorta data). Use it for exact filters, joins and aggregations on "
+                f"uploaded data. Results are returned as CSV. Tables:\n{self.describe()}"
+            ),
+        )
+        return self._tool
+
+    def close(self):
+        self.tables.clear()
+        self._tool = None
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+        if os.path.exists(self.db_path):
+            os.unlink(self.db_path)
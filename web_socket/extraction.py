@@ -0,0 +1,250 @@
+import asyncio
+import base64
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from .cache import TTLCache
+from .logger import logger
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from upload_files import FileHandlerFactory
+
+
+class ExtractionCache:
+    """Content-addressed on-disk cache of extracted file text.
+
+    Entries are keyed by the SHA-256 of the file bytes plus the handler class,
+    its ``version`` and its ``cache_options()``, so a re-uploaded file is not
+    extracted again. The directory (``EXTRACTION_CACHE_DIR``) is shared by all
+    extraction workers and capped at ``EXTRACTION_CACHE_BYTES``, evicting the
+    least recently used entries first; 0 disables the cache.
+    """
+
+    def __init__(self, directory: str = None, max_bytes: int = None):
+        self.directory = directory or os.getenv(
+            "EXTRACTION_CACHE_DIR", os.path.join(tempfile.gettempdir(), "incorta-extraction-cache"))
+        self.max_bytes = max_bytes if max_bytes is not None else int(
+            os.getenv("EXTRACTION_CACHE_BYTES", str(512 * 1024 * 1024)))
+        if self.max_bytes:
+            os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(digest: str, handler, **extra_options) -> str:
+        options = json.dumps({**handler.cache_options(), **extra_options}, sort_keys=True)
+        options_hash = hashlib.sha256(options.encode()).hexdigest()[:8]
+        return f"{digest}-{type(handler).__name__}-v{handler.version}-{options_hash}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key: str):
+        if not self.max_bytes:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                entry = json.load(file)
+            os.utime(path)  # mark as recently used
+            return entry
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            logger.warning(f"Dropping unreadable extraction cache entry {key}")
+            self._unlink(path)
+            return None
+
+    def put(self, key: str, entry: dict):
+        if not self.max_bytes:
+            return
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(entry, file)
+        os.replace(temp_path, path)
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._unlink(os.path.join(self.directory, name))
+            total -= size
+
+    @staticmethod
+    def _unlink(path: str):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+_extraction_cache = None
+
+
+def get_extraction_cache() -> ExtractionCache:
+    """The extraction cache of the current (worker) process"""
+    global _extraction_cache
+    if _extraction_cache is None:
+        _extraction_cache = ExtractionCache()
+    return _extraction_cache
+
+
+def file_digest(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def extract_file(path: str, digest: str = None) -> dict:
+    """Extract the text of a file on disk, going through the extraction cache"""
+    # Use FileHandlerFactory to process the file
+    handler = FileHandlerFactory.create_handler(path)
+    digest = digest or file_digest(path)
+    # Stop reading large documents once EXTRACTION_MAX_CHARS is reached (0 = no limit)
+    max_chars = int(os.getenv("EXTRACTION_MAX_CHARS", "0")) or None
+    cache = get_extraction_cache()
+    key = cache.make_key(digest, handler, max_chars=max_chars)
+    entry = cache.get(key)
+    if entry is None:
+        extracted_text = handler.get_text(max_chars=max_chars)
+        entry = {"file_type": handler.file_type, "text": handler.add_text(extracted_text)}
+        cache.put(key, entry)
+    return {**entry, "sha256": digest}
+
+
+def extract_uploaded_file(file_data: dict) -> dict:
+    """Extract the text content of an uploaded file.
+
+    ``file_data`` either carries base64 ``content`` or the ``path`` (and
+    ``sha256``) of a chunked upload. Returns ``{"file_type", "text",
+    "sha256"}``. Runs inside an ``ExtractionPool`` worker, so it must stay a
+    picklable module-level function.
+    """
+    if file_data.get('path'):
+        # Chunked uploads are already on disk
+        return extract_file(file_data['path'], file_data.get('sha256'))
+
+    # Decode base64 
+    file_content = base64.b64decode(file_data['content'])
+    
+    # Create temporary file
+    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file_data['name'])[1]) as temp_file:
+        temp_file.write(file_content)
+        temp_path = temp_file.name
+    
+    try:
+        return extract_file(temp_path, hashlib.sha256(file_content).hexdigest())
+        
+    finally:
+        # clean up temporary file
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+
+def format_file_block(file_data: dict, entry: dict) -> str:
+    """Wrap extracted text in the FILE markers used in queries and history"""
+    file_name = file_data['name']
+    file_info = f"\n\n--- FILE: {file_name} ({file_data['size']} bytes) ---\n"
+    file_info += f"File Type: {entry['file_type']}\n"
+    file_info += f"Content:\n{entry['text']}\n"
+    file_info += f"--- END OF FILE: {file_name} ---\n\n"
+    return file_info
+
+
+def format_error_block(file_data: dict, error: Exception) -> str:
+    return f"\n\n--- FILE PROCESSING ERROR: {file_data.get('name', 'unknown')} ---\n" \
+           f"Error: {str(error)}\n" \
+           f"--- END OF FILE ERROR ---\n\n"
+
+
+class ExtractionQueueFull(RuntimeError):
+    """Raised when more files are waiting for extraction than the pool accepts"""
+
+
+class ExtractionPool:
+    """Bounded worker pool that runs blocking file extraction off the event loop.
+
+    PdfReader, python-docx and pandas are CPU-bound, so extraction runs in a
+    process pool (or a thread pool with ``FILE_EXTRACTION_MODE=thread``).
+    ``FILE_EXTRACTION_WORKERS`` caps how many files the host extracts at once
+    (split between the supervisor's worker processes) and
+    ``FILE_EXTRACTION_QUEUE_DEPTH`` caps how many more may wait for a worker;
+    beyond that ``run`` fails fast with ``ExtractionQueueFull``.
+    """
+
+    def __init__(self, max_workers: int = None, queue_depth: int = None, mode: str = None):
+        self.max_workers = max_workers or max(1, int(os.getenv("FILE_EXTRACTION_WORKERS", min(4, os.cpu_count() or 1)))
+                                              // int(os.getenv("WEB_WORKER_COUNT", "1")))
+        self.queue_depth = queue_depth if queue_depth is not None else int(os.getenv("FILE_EXTRACTION_QUEUE_DEPTH", "32"))
+        self.mode = (mode or os.getenv("FILE_EXTRACTION_MODE", "process")).lower()
+        self._executor = None
+        self._pending = 0
+        # Front tier of the extraction cache, keyed by (content_key, extension)
+        self.memory = TTLCache(max_entries=256, max_size=int(os.getenv("EXTRACTION_MEMORY_BYTES", str(64 * 1024 * 1024))))
+
+    @property
+    def executor(self):
+        # Created lazily so that importing the server does not fork workers
+        if self._executor is None:
+            if self.mode == "thread":
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="file-extract")
+            else:
+                # By now the event loop and HTTP client threads exist; forking them could leave
+                # a child stuck on a lock held mid-fork, so workers come from a clean server process
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context("forkserver"))
+        return self._executor
+
+    async def extract(self, file_data: dict) -> dict:
+        """Extract an uploaded file, answering repeat uploads from the in-memory tier"""
+        memory_key = (await self.content_key(file_data), os.path.splitext(file_data.get("name", ""))[1].lower())
+        entry = self.memory.get(memory_key)
+        if entry is not None:
+            return entry
+        entry = await self.run(extract_uploaded_file, file_data)
+        self.memory.set(memory_key, entry, size=len(entry["text"]))
+        return entry
+
+    @staticmethod
+    async def content_key(file_data: dict) -> str:
+        """Key a file for the memory tier without handing it to a worker.
+
+        Chunked uploads already carry the SHA-256 of their bytes; base64 uploads
+        are keyed by the hash of the encoded string, which avoids decoding it.
+        """
+        if file_data.get("sha256"):
+            return file_data["sha256"]
+        content = file_data.get("content", "").encode()
+        if len(content) < 1024 * 1024:
+            return "b64:" + hashlib.sha256(content).hexdigest()
+        # hashlib drops the GIL on large buffers, so big uploads hash off the event loop
+        digest = await asyncio.to_thread(hashlib.sha256, content)
+        return "b64:" + digest.hexdigest()
+
+    async def run(self, func, *args):
+        """Run ``func(*args)`` on a worker, respecting the queue depth"""
+        if self._pending >= self.max_workers + self.queue_depth:
+            raise ExtractionQueueFull("Too many files are being processed right now, please retry shortly")
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self._pending -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,89 @@
+import json
+import os
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson ships with langsmith on CPython
+    orjson = None
+
+# Converters for non-JSON types, resolved once per class by _converter_for
+_CONVERTERS = {}
+
+
+def _text(obj):
+    return obj.text
+
+
+def _fields(obj):
+    return obj.__dict__
+
+
+def _converter_for(obj):
+    """Pick how to encode instances of ``type(obj)``.
+
+    Same rules as the old recursive walk: objects with a ``text`` attribute
+    (LangChain messages, MCP ``TextContent``) become their text, other
+    objects their ``__dict__`` and everything else ``str()``.
+    """
+    cls = type(obj)
+    converter = _CONVERTERS.get(cls)
+    if converter is None:
+        if hasattr(obj, "text"):
+            converter = _text
+        elif hasattr(obj, "__dict__"):
+            converter = _fields
+        else:
+            converter = str
+        _CONVERTERS[cls] = converter
+    return converter
+
+
+def _default(obj):
+    # Only called for values the encoder cannot serialize natively
+    return _converter_for(obj)(obj)
+
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATACLASS
+
+    def dumps(value) -> bytes:
+        return orjson.dumps(value, default=_default, option=_OPTIONS)
+else:
+    _encoder = json.JSONEncoder(default=_default, separators=(",", ":"))
+
+    def dumps(value) -> bytes:
+        return _encoder.encode(value).encode()
+
+
+def encode_frame(message_type: str, data, timestamp: float) -> bytes:
+    """UTF-8 JSON for one ``{type, data, timestamp}`` websocket frame"""
+    if message_type == "tool_result" and isinstance(data, dict):
+        result = data.get("result")
+        if isinstance(result, list) and result and hasattr(result[0], "text"):
+            data = {**data, "result": [item.text for item in result]}
+    return dumps({"type": message_type, "data": data, "timestamp": timestamp})
+
+
+def server_extensions():
+    """permessage-deflate settings for the websocket server.
+
+    ``WS_COMPRESSION=none`` turns compression off (cheaper for servers on a
+    fast network), ``deflate`` (default) keeps it on with tunable
+    ``WS_DEFLATE_LEVEL`` (zlib level, default 6), ``WS_DEFLATE_WINDOW_BITS``
+    (default 12) and ``WS_DEFLATE_MEM_LEVEL`` (default 5).
+    """
+    mode = os.getenv("WS_COMPRESSION", "deflate").lower()
+    if mode == "none":
+        return []
+    if mode != "deflate":
+        raise ValueError(f"Unsupported WS_COMPRESSION: {mode}")
+    window_bits = int(os.getenv("WS_DEFLATE_WINDOW_BITS", "12"))
+    return [ServerPerMessageDeflateFactory(
+        server_max_window_bits=window_bits,
+        client_max_window_bits=window_bits,
+        compress_settings={
+            "level": int(os.getenv("WS_DEFLATE_LEVEL", "6")),
+            "memLevel": int(os.getenv("WS_DEFLATE_MEM_LEVEL", "5")),
+        },
+    )]
@@ -0,0 +1,184 @@
+import os
+import re
+from collections import OrderedDict
+
+# Default per-model budgets for history + pinned files, in (estimated) tokens
+DEFAULT_TOKEN_BUDGETS = {"claude": 60000, "gemini": 120000}
+
+# File blocks produced by extract_uploaded_file
+FILE_BLOCK_RE = re.compile(
+    r"\n*--- FILE: (?P<name>.+?) \((?P<size>\d+) bytes\) ---\n(?P<body>.*?)--- END OF FILE: (?P=name) ---\n*",
+    re.DOTALL,
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) that is good enough for budgeting"""
+    return len(text) // 4 + 4
+
+
+def extractive_summary(message: dict, max_chars: int = 200) -> str:
+    """One-line summary of a message used when it is compacted out of the history"""
+    content = " ".join(str(message.get("content", "")).split())
+    if len(content) > max_chars:
+        content = content[:max_chars].rstrip() + "..."
+    return f"{message.get('role', 'user')}: {content}"
+
+
+class ConversationHistory:
+    """Token-budgeted conversation history for one session.
+
+    Token counts are computed once per entry as messages are appended. When
+    the history plus pinned files exceed the model's budget
+    (``HISTORY_TOKEN_BUDGET_<MODEL>``), the oldest turns are folded into a
+    rolling summary, a whole turn at a time. Uploaded file contents are
+    pinned once and replaced in the turn by a short reference; pinned files
+    get at most half the budget, and one file larger than that is truncated.
+    ``context_text`` renders the pinned files and the summary for the system
+    message, and is only re-rendered when they change, so the prompt prefix
+    stays identical between turns.
+    """
+
+    def __init__(self, model: str = "claude", keep_recent: int = 6, summarizer=extractive_summary):
+        self.keep_recent = keep_recent
+        self.summarizer = summarizer
+        self.entries = []
+        self._tokens = []
+        self.total_tokens = 0
+        self.summary_lines = []
+        self.summary_tokens = 0
+        self.pinned_files = OrderedDict()  # file name -> (content, tokens)
+        self.pinned_tokens = 0
+        self._context_text = None  # rendered context_text, reset when files or summary change
+        self.set_model(model)
+
+    def set_model(self, model: str):
+        self.model = model
+        default = DEFAULT_TOKEN_BUDGETS.get(model, DEFAULT_TOKEN_BUDGETS["claude"])
+        self.token_budget = int(os.getenv(f"HISTORY_TOKEN_BUDGET_{model.upper()}", default))
+
+    def _pin_files(self, content: str) -> str:
+        def pin(match):
+            name = match.group("name")
+            body = match.group("body")
+            if name in self.pinned_files:
+                self.pinned_tokens -= self.pinned_files.pop(name)[1]
+            tokens = estimate_tokens(body)
+            self.pinned_files[name] = (body, tokens)
+            self.pinned_tokens += tokens
+            self._context_text = None
+            return f"\n[File '{name}' ({match.group('size')} bytes) is pinned in the context above]\n"
+        return FILE_BLOCK_RE.sub(pin, content)
+
+    def append(self, message: dict):
+        """Add a message, pinning any uploaded file contents it carries"""
+        message = dict(message)
+        if message.get("role") == "user" and "--- FILE: " in message.get("content", ""):
+            message["content"] = self._pin_files(message["content"])
+        tokens = estimate_tokens(message.get("content", ""))
+        self.entries.append(message)
+        self._tokens.append(tokens)
+        self.total_tokens += tokens
+
+    def compact(self):
+        """Fold the oldest turns into the rolling summary until the budget is met"""
+        # Pinned files may use at most half of the budget; drop the oldest first
+        file_budget = self.token_budget // 2
+        while self.pinned_tokens > file_budget and len(self.pinned_files) > 1:
+            name, (_, tokens) = self.pinned_files.popitem(last=False)
+            self.pinned_tokens -= tokens
+            self._context_text = None
+            self._add_summary_line(f"(file '{name}' was uploaded earlier and is no longer in context)")
+        if self.pinned_tokens > file_budget:
+            self._truncate_pinned_file(file_budget)
+
+        # Drop whole turns, so the kept history always starts with the user message
+        # that opened a turn and never with a reply or tool output whose question is gone
+        while self.used_tokens > self.token_budget and len(self.entries) > self.keep_recent:
+            end = next((i for i in range(1, len(self.entries)) if self.entries[i].get("role") == "user"), None)
+            if end is None:
+                break  # only the current turn is left
+            for message in self.entries[:end]:
+                self._add_summary_line(self.summarizer(message))
+            self.total_tokens -= sum(self._tokens[:end])
+            del self.entries[:end]
+            del self._tokens[:end]
+
+        # Keep the summary itself bounded to a tenth of the budget
+        while self.summary_tokens > self.token_budget // 10 and len(self.summary_lines) > 1:
+            self.summary_tokens -= estimate_tokens(self.summary_lines.pop(0))
+            self._context_text = None
+
+    def _truncate_pinned_file(self, max_tokens: int):
+        """Cut the one remaining pinned file down to ``max_tokens``, noting how much was kept"""
+        name, (content, tokens) = next(iter(self.pinned_files.items()))
+        keep = max(0, (max_tokens - 40) * 4)  # room for the note, at ~4 characters per token
+        note = (f"\n[... file truncated to fit the context: the first {keep} of {len(content)} "
+                f"characters are shown]\n")
+        content = content[:keep] + note
+        self.pinned_files[name] = (content, estimate_tokens(content))
+        self.pinned_tokens += self.pinned_files[name][1] - tokens
+        self._context_text = None
+
+    def _add_summary_line(self, line: str):
+        self.summary_lines.append(line)
+        self.summary_tokens += estimate_tokens(line)
+        self._context_text = None
+
+    @property
+    def used_tokens(self) -> int:
+        return self.total_tokens + self.summary_tokens + self.pinned_tokens
+
+    def context_text(self) -> str:
+        """Pinned file contents and the summary of compacted turns, for the system message"""
+        if self._context_text is not None:
+            return self._context_text
+        parts = []
+        if self.pinned_files:
+            files = "".join(f"\n--- FILE: {name} ---\n{content}--- END OF FILE: {name} ---\n"
+                            for name, (content, _) in self.pinned_files.items())
+            parts.append(f"Files uploaded by the user in this conversation:\n{files}")
+        if self.summary_lines:
+            parts.append("Summary of earlier conversation turns:\n" + "\n".join(f"- {line}" for line in self.summary_lines))
+        self._context_text = "\n\n".join(parts)
+        return self._context_text
+
+    def as_messages(self) -> list:
+        return [dict(message) for message in self.entries]
+
+    def to_dict(self) -> dict:
+        """JSON-serialisable state, for the session store"""
+        return {
+            "entries": self.as_messages(),
+            "summary_lines": list(self.summary_lines),
+            "pinned_files": {name: content for name, (content, _) in self.pinned_files.items()},
+        }
+
+    def restore(self, state: dict):
+        """Replace the history with a ``to_dict`` snapshot"""
+        self.clear()
+        for message in state.get("entries", []):
+            self.append(message)
+        for line in state.get("summary_lines", []):
+            self._add_summary_line(line)
+        for name, content in state.get("pinned_files", {}).items():
+            tokens = estimate_tokens(content)
+            self.pinned_files[name] = (content, tokens)
+            self.pinned_tokens += tokens
+        self._context_text = None
+
+    def clear(self):
+        self.entries = []
+        self._tokens = []
+        self.total_tokens = 0
+        self.summary_lines = []
+        self.summary_tokens = 0
+        self.pinned_files.clear()
+        self.pinned_tokens = 0
+        self._context_text = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
@@ -0,0 +1,490 @@
+import asyncio
+import hashlib
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Optional
+from pydantic import PrivateAttr
+from langchain_anthropic import ChatAnthropic
+from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_core.language_models import BaseChatModel
+from langchain_core.language_models.chat_models import agenerate_from_stream
+from langchain_core.messages import AIMessage, BaseMessage
+from .history import estimate_tokens
+from .logger import logger
+
+PROVIDER_ALIASES = {"claude": "anthropic", "anthropic": "anthropic", "gemini": "google", "google": "google"}
+API_KEY_ENV = {"anthropic": "ANTHROPIC_API_KEY", "google": "GEMINI_API_KEY"}
+# Model names the frontend uses for each provider
+MODEL_NAMES = {"anthropic": "claude", "google": "gemini"}
+# Status codes and exception names that are worth retrying on another provider
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+RETRYABLE_ERRORS = ("RateLimit", "Overloaded", "InternalServer", "ServiceUnavailable", "ResourceExhausted",
+                    "DeadlineExceeded", "Timeout", "Connection")
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether a provider error (429, 5xx, timeout, connection) should fail over to another provider"""
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS
+    name = type(error).__name__
+    return any(marker in name for marker in RETRYABLE_ERRORS)
+
+
+class ProviderLimiter:
+    """Caps the number of in-flight LLM requests for one provider and counts utilisation"""
+
+    def __init__(self, provider: str, max_concurrency: int):
+        self.provider = provider
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.requests = 0
+        self.wait_seconds = 0.0
+
+    @asynccontextmanager
+    async def slot(self):
+        started = time.monotonic()
+        self.waiting += 1
+        if self._semaphore.locked():
+            logger.warning(f"{self.provider} LLM pool saturated ({self.in_flight}/{self.max_concurrency} in flight, {self.waiting} waiting)")
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.wait_seconds += time.monotonic() - started
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "utilisation": self.in_flight / self.max_concurrency,
+            "requests": self.requests,
+            "wait_seconds": round(self.wait_seconds, 3),
+        }
+
+
+class ProviderHealth:
+    """Latency and error EWMAs for one provider, and recent times to first token for the hedge threshold.
+
+    The error rate decays with a half-life of ``LLM_HEALTH_HALF_LIFE``
+    seconds, so a provider that was failed away from is tried again once
+    it has been quiet for a while.
+    """
+
+    def __init__(self, provider: str, alpha: float = 0.2, window: int = 200):
+        self.provider = provider
+        self.alpha = alpha
+        self.half_life = float(os.getenv("LLM_HEALTH_HALF_LIFE", "30"))
+        self.ttft_ewma = None
+        self._error_rate = 0.0
+        self._error_updated = time.monotonic()
+        self.ttft_samples = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+
+    @property
+    def error_rate(self) -> float:
+        elapsed = time.monotonic() - self._error_updated
+        return self._error_rate * 0.5 ** (elapsed / self.half_life)
+
+    def _record(self, failed: bool):
+        self._error_rate = self.error_rate + self.alpha * (float(failed) - self.error_rate)
+        self._error_updated = time.monotonic()
+
+    def record_success(self, ttft: float = None):
+        self.requests += 1
+        self._record(False)
+        if ttft is None:
+            return  # a non-streaming call; its latency is not a time to first token
+        self.ttft_samples.append(ttft)
+        self.ttft_ewma = ttft if self.ttft_ewma is None else self.ttft_ewma + self.alpha * (ttft - self.ttft_ewma)
+
+    def record_error(self):
+        self.requests += 1
+        self.errors += 1
+        self._record(True)
+
+    def ttft_percentile(self, fraction: float) -> Optional[float]:
+        if len(self.ttft_samples) < 20:
+            return None
+        samples = sorted(self.ttft_samples)
+        return samples[min(len(samples) - 1, math.ceil(len(samples) * fraction) - 1)]
+
+    def stats(self) -> dict:
+        return {
+            "ttft_ewma": round(self.ttft_ewma, 3) if self.ttft_ewma is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "requests": self.requests,
+            "errors": self.errors,
+        }
+
+
+class _LimitedChatModel:
+    """Mixin that runs every generate/stream call inside the provider's limiter slot"""
+
+    async def _agenerate(self, *args, **kwargs):
+        if self._limiter is None:
+            return await super()._agenerate(*args, **kwargs)
+        async with self._limiter.slot():
+            return await super()._agenerate(*args, **kwargs)
+
+    async def _astream(self, *args, **kwargs):
+        if self._limiter is None:
+            async for chunk in super()._astream(*args, **kwargs):
+                yield chunk
+            return
+        async with self._limiter.slot():
+            async for chunk in super()._astream(*args, **kwargs):
+                yield chunk
+
+
+CACHE_BREAKPOINT = {"type": "ephemeral"}
+
+
+def usage_counts(usage: dict) -> dict:
+    """Input, output and prompt-cache token counts from a message's ``usage_metadata``"""
+    details = usage.get("input_token_details") or {}
+    return {
+        "input": usage.get("input_tokens", 0),
+        "output": usage.get("output_tokens", 0),
+        "cache_read": details.get("cache_read", 0) or 0,
+        "cache_creation": details.get("cache_creation", 0) or 0,
+    }
+
+
+class PooledChatAnthropic(_LimitedChatModel, ChatAnthropic):
+    """Claude with prompt caching: the tools and system prompt are one cached prefix, the conversation another.
+
+    A breakpoint goes on the last system block (or the last tool when there
+    is no system prompt), so the static instructions, pinned files and tool
+    schemas are read from cache on every turn and every agent step; the
+    request-level ``cache_control`` moves a second breakpoint to the end of
+    the conversation, so each step re-reads the turns before it.
+    """
+
+    prompt_cache: bool = True
+    _limiter: Optional[ProviderLimiter] = PrivateAttr(default=None)
+
+    def _get_request_payload(self, input_, *, stop=None, **kwargs) -> dict:
+        if self.prompt_cache:
+            kwargs.setdefault("cache_control", CACHE_BREAKPOINT)
+        payload = super()._get_request_payload(input_, stop=stop, **kwargs)
+        if self.prompt_cache:
+            system = payload.get("system")
+            if isinstance(system, str) and system:
+                payload["system"] = [{"type": "text", "text": system, "cache_control": CACHE_BREAKPOINT}]
+            elif isinstance(system, list) and system:
+                payload["system"] = system[:-1] + [{**system[-1], "cache_control": CACHE_BREAKPOINT}]
+            elif payload.get("tools"):
+                payload["tools"] = payload["tools"][:-1] + [{**payload["tools"][-1], "cache_control": CACHE_BREAKPOINT}]
+        return payload
+
+
+class PooledChatGoogleGenerativeAI(_LimitedChatModel, ChatGoogleGenerativeAI):
+    _limiter: Optional[ProviderLimiter] = PrivateAttr(default=None)
+
+
+def neutral_message(message: BaseMessage, route: str) -> BaseMessage:
+    """An assistant message answered by another route, as plain text plus ``tool_calls``.
+
+    Providers keep calls in their own content blocks (Claude's ``tool_use``)
+    or kwargs (Gemini's ``function_call``) that the other provider drops;
+    ``tool_calls`` is understood by both, so the tool results that follow
+    still have a matching call.
+    """
+    if not isinstance(message, AIMessage) or message.response_metadata.get("answered_by") in (None, route):
+        return message
+    content = message.content
+    if not isinstance(content, str):
+        content = "".join(block if isinstance(block, str) else block.get("text", "")
+                          for block in content if isinstance(block, str) or block.get("type") == "text")
+    return message.model_copy(update={"content": content, "additional_kwargs": {}})
+
+
+class RoutedChatModel(BaseChatModel):
+    """Chat model that answers from the first of several providers, with failover and hedging.
+
+    Each call streams from the first healthy route. If it fails with a
+    retryable error (429, 5xx, timeout) before producing output, the next
+    route is tried. If it has produced nothing after its
+    ``LLM_HEDGE_PERCENTILE`` time to first token (at least
+    ``LLM_HEDGE_MIN_SECONDS``; ``LLM_HEDGE_DEFAULT_SECONDS`` until enough
+    samples exist), the next route is started as well and whichever answers
+    first wins; the other request is cancelled. A route whose error rate is
+    above ``LLM_FAILOVER_ERROR_RATE`` goes to the back of the order. The
+    first chunk of every answer carries the route name as
+    ``response_metadata["answered_by"]``, and earlier answers are passed to
+    a different route through ``neutral_message``. Tokens spent by the
+    losing side of a hedge go to ``record_usage`` too, estimated from the
+    prompt when it was cancelled before reporting any. The sync API fails
+    over without hedging.
+    """
+
+    routes: list  # [(model name, BaseChatModel)] in order of preference
+    health: dict  # model name -> ProviderHealth
+    hedge: bool = True
+    hedge_percentile: float = 0.95
+    hedge_min_seconds: float = 1.0
+    hedge_default_seconds: float = 8.0
+    error_threshold: float = 0.5
+    tools: list = []
+    tool_kwargs: dict = {}
+    reroutes: Any = None  # the pool's counters: "failover" / "hedge" -> count
+    record_usage: Any = None  # the pool's record_usage(model, usage_metadata)
+
+    @property
+    def _llm_type(self) -> str:
+        return "routed"
+
+    def bind_tools(self, tools, **kwargs):
+        # Every provider formats tools its own way, so binding is deferred to the call
+        return self.model_copy(update={"tools": list(tools), "tool_kwargs": kwargs})
+
+    def _order(self) -> list:
+        healthy = [route for route in self.routes if self.health[route[0]].error_rate <= self.error_threshold]
+        return healthy + [route for route in self.routes if route not in healthy]
+
+    def _call_kwargs(self, model: BaseChatModel, kwargs: dict) -> dict:
+        if not self.tools:
+            return kwargs
+        binding = model.bind_tools(self.tools, **self.tool_kwargs)
+        return {**getattr(binding, "kwargs", {}), **kwargs}
+
+    def _hedge_after(self, name: str) -> Optional[float]:
+        if not self.hedge:
+            return None
+        threshold = self.health[name].ttft_percentile(self.hedge_percentile)
+        return max(self.hedge_min_seconds, threshold if threshold is not None else self.hedge_default_seconds)
+
+    async def _pump(self, name: str, model: BaseChatModel, messages, stop, kwargs: dict, queue: asyncio.Queue):
+        try:
+            messages = [neutral_message(message, name) for message in messages]
+            async for chunk in model._astream(messages, stop=stop, **self._call_kwargs(model, kwargs)):
+                await queue.put((name, chunk, None))
+            await queue.put((name, None, None))
+        except Exception as e:
+            await queue.put((name, None, e))
+
+    def _count(self, reason: str):
+        if self.reroutes is not None:
+            self.reroutes[reason] = self.reroutes.get(reason, 0) + 1
+
+    def _record_losing_usage(self, name: str, chunk) -> bool:
+        usage = getattr(chunk.message, "usage_metadata", None) if chunk is not None else None
+        if usage and self.record_usage is not None:
+            self.record_usage(name, usage)
+        return bool(usage)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        pending = self._order()
+        queue = asyncio.Queue()
+        attempts = {}  # name -> (task, start time)
+        losers = {}  # hedged attempts cancelled for the winner -> whether they reported usage
+        winner = None
+        last_error = None
+
+        def start_next():
+            name, model = pending.pop(0)
+            attempts[name] = (asyncio.create_task(self._pump(name, model, messages, stop, kwargs, queue)),
+                              time.monotonic())
+
+        start_next()
+        hedge_at = None
+        hedge_after = self._hedge_after(next(iter(attempts)))
+        if hedge_after is not None:
+            hedge_at = time.monotonic() + hedge_after
+        try:
+            while True:
+                timeout = None
+                if winner is None and pending and hedge_at is not None:
+                    timeout = max(0.0, hedge_at - time.monotonic())
+                try:
+                    name, chunk, error = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    logger.warning(f"No output from {', '.join(attempts)} after {hedge_after:.1f}s, "
+                                   f"hedging with {pending[0][0]}")
+                    self._count("hedge")
+                    start_next()
+                    hedge_at = None
+                    continue
+                if winner is not None and name != winner:
+                    # A cancelled attempt's last words; the tokens it used are still billed
+                    losers[name] = self._record_losing_usage(name, chunk) or losers.get(name, False)
+                    continue
+                if error is not None:
+                    self.health[name].record_error()
+                    attempts.pop(name)
+                    if winner is not None:
+                        raise error  # output was already streamed; nothing to fail over to
+                    last_error = error
+                    if is_retryable(error) and pending and not attempts:
+                        logger.warning(f"{name} failed ({type(error).__name__}: {error}), failing over to {pending[0][0]}")
+                        self._count("failover")
+                        start_next()
+                    if not attempts:
+                        raise last_error
+                    continue
+                if winner is None:
+                    winner = name
+                    self.health[name].record_success(time.monotonic() - attempts[name][1])
+                    for other, (task, _) in attempts.items():
+                        if other != name:
+                            task.cancel()
+                            losers[other] = False
+                    if chunk is not None:
+                        chunk.message.response_metadata = {**chunk.message.response_metadata, "answered_by": name}
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            for task, _ in attempts.values():
+                task.cancel()
+            self._settle_losers(losers, queue, messages)
+
+    def _settle_losers(self, losers: dict, queue: asyncio.Queue, messages):
+        """Count the usage of hedged attempts that lost, from what they queued or else from the prompt"""
+        while not queue.empty():
+            name, chunk, _ = queue.get_nowait()
+            if name in losers:
+                losers[name] = self._record_losing_usage(name, chunk) or losers[name]
+        if self.record_usage is None:
+            return
+        for name, reported in losers.items():
+            if not reported:
+                prompt = sum(estimate_tokens(str(message.content)) for message in messages)
+                self.record_usage(name, {"input_tokens": prompt, "output_tokens": 0})
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        return await agenerate_from_stream(self._astream(messages, stop=stop, **kwargs))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        routes = self._order()
+        for index, (name, model) in enumerate(routes):
+            try:
+                result = model._generate([neutral_message(message, name) for message in messages], stop=stop,
+                                         **self._call_kwargs(model, kwargs))
+            except Exception as e:
+                self.health[name].record_error()
+                if not is_retryable(e) or index == len(routes) - 1:
+                    raise
+                logger.warning(f"{name} failed ({type(e).__name__}: {e}), failing over to {routes[index + 1][0]}")
+                self._count("failover")
+                continue
+            self.health[name].record_success()
+            for generation in result.generations:
+                generation.message.response_metadata = {**generation.message.response_metadata, "answered_by": name}
+            return result
+
+
+class LLMPool:
+    """Reusable LLM instances keyed by (provider, model, temperature, API key fingerprint).
+
+    Sessions that ask for the same configuration share one instance, and with
+    it the provider SDK's HTTP client and its open TLS connections. Requests
+    for each provider are limited to ``LLM_MAX_CONCURRENCY_<PROVIDER>`` (or
+    ``LLM_MAX_CONCURRENCY``, default 16) in flight at once so that a burst of
+    users queues here instead of tripping the provider's rate limits.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._instances = {}
+        self._limiters = {}
+        self._health = {}
+        self._routers = {}
+        self.reroutes = {}  # "failover" / "hedge" -> count, across routed models
+        self.usage = {}  # (model, kind) -> tokens; kinds as in usage_counts
+
+    @staticmethod
+    def normalize_provider(provider: str) -> str:
+        try:
+            return PROVIDER_ALIASES[provider.lower()]
+        except KeyError:
+            raise ValueError(f"Unsupported provider: {provider}")
+
+    @staticmethod
+    def _fingerprint(api_key: Any) -> str:
+        return hashlib.sha256(str(api_key).encode()).hexdigest()[:12] if api_key else ""
+
+    def limiter(self, provider: str) -> ProviderLimiter:
+        provider = self.normalize_provider(provider)
+        if provider not in self._limiters:
+            max_concurrency = int(os.getenv(f"LLM_MAX_CONCURRENCY_{provider.upper()}",
+                                            os.getenv("LLM_MAX_CONCURRENCY", "16")))
+            self._limiters[provider] = ProviderLimiter(provider, max_concurrency)
+        return self._limiters[provider]
+
+    def health(self, name: str) -> ProviderHealth:
+        if name not in self._health:
+            self._health[name] = ProviderHealth(name)
+        return self._health[name]
+
+    def routed(self, provider: str) -> BaseChatModel:
+        """``provider``'s model with the other providers behind it for failover and hedging"""
+        provider = self.normalize_provider(provider)
+        if provider not in self._routers:
+            routes = [(MODEL_NAMES[provider], self.get(provider))]
+            for fallback in MODEL_NAMES:
+                if fallback == provider:
+                    continue
+                try:
+                    routes.append((MODEL_NAMES[fallback], self.get(fallback)))
+                except ValueError as e:
+                    logger.info(f"No failover from {provider} to {fallback}: {e}")
+            if len(routes) == 1:
+                return routes[0][1]
+            self._routers[provider] = RoutedChatModel(
+                routes=routes,
+                health={name: self.health(name) for name, _ in routes},
+                hedge=os.getenv("LLM_HEDGE", "true").lower() == "true",
+                hedge_percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95")),
+                hedge_min_seconds=float(os.getenv("LLM_HEDGE_MIN_SECONDS", "1")),
+                hedge_default_seconds=float(os.getenv("LLM_HEDGE_DEFAULT_SECONDS", "8")),
+                error_threshold=float(os.getenv("LLM_FAILOVER_ERROR_RATE", "0.5")),
+                reroutes=self.reroutes,
+                record_usage=self.record_usage,
+            )
+        return self._routers[provider]
+
+    def get(self, provider: str, **kwargs) -> BaseChatModel:
+        """Return the pooled instance for this configuration, creating it on first use"""
+        provider = self.normalize_provider(provider)
+        api_key = kwargs.get("api_key") or os.getenv(API_KEY_ENV[provider])
+        key = (provider, kwargs.get("model"), kwargs.get("temperature"), self._fingerprint(api_key))
+        llm = self._instances.get(key)
+        if llm is None:
+            llm = self.factory(provider, **kwargs)
+            if isinstance(llm, _LimitedChatModel):
+                llm._limiter = self.limiter(provider)
+            self._instances[key] = llm
+            logger.info(f"LLM pool: created {provider} instance ({len(self._instances)} pooled)")
+        return llm
+
+    def record_usage(self, model: str, usage: dict) -> dict:
+        """Add a response's ``usage_metadata`` to the token totals; returns its counts"""
+        counts = usage_counts(usage)
+        for kind, tokens in counts.items():
+            self.usage[(model, kind)] = self.usage.get((model, kind), 0) + tokens
+        return counts
+
+    def stats(self) -> dict:
+        return {
+            "instances": len(self._instances),
+            "providers": {provider: limiter.stats() for provider, limiter in self._limiters.items()},
+            "health": {name: health.stats() for name, health in self._health.items()},
+            "reroutes": dict(self.reroutes),
+            "usage": dict(self.usage),
+        }
@@ -1,4 +1,10 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import random
 from rich.logging import RichHandler
 import sys
 import time
@@ -6,16 +12,133 @@ import itertools
 import threading
 from contextlib import contextmanager
 
+# LOG_FORMAT=rich (default) renders through Rich for development; json writes
+# one JSON object per line for log shippers. LOG_QUEUE=true moves formatting
+# and I/O to a background thread so the event loop never waits on the console.
+LOG_FORMAT = os.getenv("LOG_FORMAT", "rich").lower()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE = os.getenv("LOG_QUEUE", "true" if LOG_FORMAT == "json" else "false").lower() == "true"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Long values (messages, chunks, payloads) are cut to this many characters
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "2000"))
+
+
+def _parse_sample_rates(value: str) -> dict:
+    """``"ws.message=0.1,agent.chunk=0.01"`` -> {event: fraction of events kept}"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        event, _, rate = item.partition("=")
+        rates[event.strip()] = float(rate)
+    return rates
+
+
+LOG_SAMPLE_RATES = _parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", ""))
+
+
+def truncate(value, limit: int = None) -> str:
+    limit = LOG_MAX_FIELD_CHARS if limit is None else limit
+    text = value if isinstance(value, str) else repr(value)
+    if limit and len(text) > limit:
+        return f"{text[:limit]}... [{len(text) - limit} more chars]"
+    return text
+
+
+class TruncatingFormatter(logging.Formatter):
+    """Plain message followed by the ``log_event`` fields as key=value, both truncated"""
+
+    def format(self, record):
+        message = truncate(record.getMessage())
+        fields = getattr(record, "fields", None)
+        if fields:
+            message += " " + " ".join(f"{k}={truncate(v)}" for k, v in fields.items())
+        record.message = message
+        if record.exc_info:
+            message += "\n" + self.formatException(record.exc_info)
+        return message
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: ts, level, logger, message, event and fields"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": truncate(record.getMessage()),
+        }
+        event = getattr(record, "event", None)
+        if event:
+            entry["event"] = event
+        for key, value in (getattr(record, "fields", None) or {}).items():
+            entry[key] = value if isinstance(value, (int, float, bool, type(None))) else truncate(value)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that never blocks the caller and formats on the listener thread.
+
+    Records are queued as-is, so message arguments are rendered lazily (and
+    only if the record is emitted). When the queue is full the record is
+    dropped and counted in ``dropped``.
+    """
+
+    dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _output_handler() -> logging.Handler:
+    if LOG_FORMAT == "json":
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler = RichHandler()
+        handler.setFormatter(TruncatingFormatter("%(message)s", datefmt="[%X]"))
+    return handler
+
+
+log_handler = _output_handler()
+if LOG_QUEUE:
+    _listener = logging.handlers.QueueListener(queue.Queue(LOG_QUEUE_SIZE), log_handler, respect_handler_level=True)
+    log_handler = DroppingQueueHandler(_listener.queue)
+    _listener.start()
+    atexit.register(_listener.stop)
+
 logging.basicConfig(
-    level=logging.INFO,
+    level=LOG_LEVEL,
     format="%(message)s",
     datefmt="[%X]",
-    handlers=[RichHandler()]
+    handlers=[log_handler]
 )
 
 logger = logging.getLogger("rich")
 
 
+def log_event(event: str, level: int = logging.DEBUG, **fields):
+    """Structured log record for hot paths.
+
+    Costs one level check when ``level`` is disabled. Events listed in
+    ``LOG_SAMPLE_RATES`` are kept with that probability. Fields are only
+    formatted (and truncated) when the record is emitted.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    rate = LOG_SAMPLE_RATES.get(event)
+    if rate is not None and random.random() >= rate:
+        return
+    logger.log(level, event, extra={"event": event, "fields": fields}, stacklevel=2)
+
+
 class LoadingAnimation:
     def __init__(self, description="Loading", animation_chars="⠋⠙⠹⠸⠼⠴⠦⠧⠇⠏"):
         self.description = description
@@ -0,0 +1,184 @@
+import asyncio
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from .logger import logger
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+# Seconds; covers websocket sends (ms) up to long agent turns (minutes)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """Prometheus histogram with a fixed label set; one bucket array per label combination"""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., overflow, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values):
+                cumulative += count
+                bucket_labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {values[-2]}")
+            lines.append(f"{self.name}_count{labels} {values[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Histograms plus collectors that report gauges/counters at scrape time.
+
+    A collector is a callable returning ``[(name, type, help, [(labels, value)])]``
+    so that live state (sessions, LLM pool, caches) is read only when scraped.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.collectors = []
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        if name not in self.histograms:
+            self.histograms[name] = Histogram(name, documentation, labelnames, buckets)
+        return self.histograms[name]
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for histogram in self.histograms.values():
+            lines.extend(histogram.render())
+        for collector in self.collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+                continue
+            for name, metric_type, documentation, values in samples:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in values:
+                    label_text = _format_labels(tuple(labels), tuple(labels.values())) if labels else ""
+                    lines.append(f"{name}{label_text} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+STAGE_SECONDS = metrics.histogram(
+    "incorta_stage_seconds",
+    "Duration of agent pipeline stages (authenticate, initialize_agent, get_tools, file_extraction, "
+    "step_agent, step_tools, query, ws_send)",
+    ("stage", "model"),
+)
+FIRST_TOKEN_SECONDS = metrics.histogram(
+    "incorta_llm_first_token_seconds", "Time from the start of a query to the first streamed model output", ("model",)
+)
+TOOL_CALL_SECONDS = metrics.histogram(
+    "incorta_tool_call_seconds", "Time from a tool call to its result in the agent stream", ("tool", "model")
+)
+
+_tracer = trace.get_tracer("incorta-mcp-client") if trace is not None and \
+    os.getenv("OTEL_TRACES_ENABLED", "false").lower() == "true" else None
+
+
+@contextmanager
+def span(stage: str, model: str = "", **attributes):
+    """Time a pipeline stage into ``incorta_stage_seconds`` and, if enabled, an OpenTelemetry span.
+
+    Yields the label dict, so a stage can set ``labels["model"]`` once it is
+    known (label values must stay a small, fixed set).
+    """
+    labels = {"model": model}
+    started = time.perf_counter()
+    if _tracer is None:
+        try:
+            yield labels
+        finally:
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage, model=labels["model"])
+        return
+    with _tracer.start_as_current_span(stage, attributes=attributes) as current:
+        try:
+            yield labels
+        finally:
+            current.set_attribute("model", labels["model"])
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage, model=labels["model"])
+
+
+async def _serve_metrics(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Drain the request headers
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            body = metrics.render().encode()
+            status = "200 OK"
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body = b"Not found\n"
+            status = "404 Not Found"
+            content_type = "text/plain"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str = None, port: int = None):
+    """Serve ``GET /metrics`` in the Prometheus text format.
+
+    Listens on ``METRICS_HOST`` (default 127.0.0.1) and ``METRICS_PORT``
+    (default 9202); port 0 disables the endpoint. Returns the asyncio server
+    or None.
+    """
+    host = host or os.getenv("METRICS_HOST", "127.0.0.1")
+    port = int(os.getenv("METRICS_PORT", "9202")) if port is None else port
+    if port <= 0:
+        return None
+    server = await asyncio.start_server(_serve_metrics, host, port)
+    logger.info(f"Metrics endpoint on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,177 @@
+import asyncio
+import os
+import time
+from collections import deque
+from websockets.exceptions import ConnectionClosed
+from .frames import encode_frame
+from .logger import logger
+from .metrics import STAGE_SECONDS
+
+# Frames that only report progress; they are dropped first when a client falls behind
+PROGRESS_TYPES = ("thinking", "upload_progress")
+
+OVERFLOW_POLICIES = ("drop", "block", "disconnect")
+
+
+def is_droppable(frame: dict) -> bool:
+    if frame["type"] in PROGRESS_TYPES:
+        return True
+    return frame["type"] == "file_processed" and frame["data"].get("status") == "processing"
+
+
+class OutboundQueue:
+    """Bounded queue of outgoing frames drained by one writer task per connection.
+
+    ``put`` only waits when ``SEND_QUEUE_SIZE`` frames are already queued,
+    so a slow browser does not stall the agent stream. At that point the
+    ``SEND_QUEUE_OVERFLOW`` policy applies:
+
+    - ``drop`` (default): discard progress frames (``PROGRESS_TYPES`` and
+      "processing" file updates), newest first; if there are none, wait for
+      room like ``block``.
+    - ``block``: wait until the writer has made room.
+    - ``disconnect``: close the connection of a client that cannot keep up.
+
+    Consecutive ``assistant_delta`` frames for the same message are merged
+    while queued. With ``SEND_BATCH_FRAMES`` > 1, frames that are ready
+    together are sent as one JSON array frame of up to that many frames and
+    ``SEND_BATCH_MAX_BYTES`` bytes. Frames are encoded by ``encode_frame``
+    in the writer task.
+    """
+
+    def __init__(self, websocket, encode=encode_frame, max_frames: int = None, policy: str = None):
+        self.websocket = websocket
+        self.encode = encode
+        self.max_frames = max_frames or int(os.getenv("SEND_QUEUE_SIZE", "256"))
+        self.policy = policy or os.getenv("SEND_QUEUE_OVERFLOW", "drop")
+        if self.policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unsupported SEND_QUEUE_OVERFLOW policy: {self.policy}")
+        self.batch_frames = int(os.getenv("SEND_BATCH_FRAMES", "1"))
+        self.batch_max_bytes = int(os.getenv("SEND_BATCH_MAX_BYTES", str(64 * 1024)))
+        self._frames = deque()
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self._closed = False
+        self._writer = None
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def start(self):
+        if self._writer is None:
+            self._writer = asyncio.ensure_future(self._run())
+
+    def _coalesce(self, frame: dict) -> bool:
+        if frame["type"] != "assistant_delta" or not self._frames:
+            return False
+        last = self._frames[-1]
+        if last["type"] != "assistant_delta" or last["data"].get("message_id") != frame["data"].get("message_id"):
+            return False
+        last["data"] = {**last["data"], "content": last["data"]["content"] + frame["data"]["content"]}
+        self.coalesced += 1
+        return True
+
+    def _drop_progress(self) -> bool:
+        for frame in reversed(self._frames):
+            if is_droppable(frame):
+                self._frames.remove(frame)
+                self.dropped += 1
+                return True
+        return False
+
+    async def put(self, frame: dict):
+        """Queue a ``{type, data, timestamp}`` frame for the writer task"""
+        if self._closed:
+            return
+        if self._coalesce(frame):
+            return
+        while len(self._frames) >= self.max_frames:
+            if self.policy == "drop":
+                if is_droppable(frame):
+                    self.dropped += 1
+                    return
+                if self._drop_progress():
+                    break
+            elif self.policy == "disconnect":
+                logger.warning(f"Closing slow connection: {len(self._frames)} frames waiting to be sent")
+                self._closed = True
+                self._frames.clear()
+                await self.websocket.close(code=1008, reason="client too slow")
+                return
+            self._not_full.clear()
+            await self._not_full.wait()
+            if self._closed:
+                return
+        self._frames.append(frame)
+        self._not_empty.set()
+
+    def _encode(self, frame: dict):
+        try:
+            return self.encode(frame["type"], frame["data"], frame["timestamp"])
+        except Exception as e:
+            logger.error(f"Failed to serialize {frame['type']} message: {e}")
+            return None
+
+    def _next_message(self):
+        first = self._encode(self._frames.popleft())
+        if self.batch_frames <= 1 or first is None:
+            return first
+        batch = [first]
+        size = len(first) + 2  # the array brackets
+        while self._frames and len(batch) < self.batch_frames:
+            encoded = self._encode(self._frames[0])
+            if encoded is not None and size + 1 + len(encoded) > self.batch_max_bytes:
+                break
+            self._frames.popleft()
+            if encoded is not None:
+                batch.append(encoded)
+                size += 1 + len(encoded)
+        return first if len(batch) == 1 else b"[" + b",".join(batch) + b"]"
+
+    async def _run(self):
+        try:
+            while True:
+                if not self._frames:
+                    self._not_empty.clear()
+                    await self._not_empty.wait()
+                    continue
+                message = self._next_message()
+                self._not_full.set()
+                if message is None:
+                    continue
+                # Encoded frames are UTF-8 JSON; send them as text frames without decoding
+                started = time.perf_counter()
+                await self.websocket.send(message, text=True)
+                STAGE_SECONDS.observe(time.perf_counter() - started, stage="ws_send", model="")
+                self.sent += 1
+        except ConnectionClosed:
+            logger.info("Connection closed with frames still queued" if self._frames else "Connection closed")
+        except Exception as e:
+            logger.error(f"Failed to send WebSocket message: {e}")
+        finally:
+            self._closed = True
+            self._frames.clear()
+            self._not_full.set()
+
+    async def drain(self, timeout: float = 5.0):
+        """Wait (up to ``timeout``) for the queued frames to be written"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._frames and not self._closed and loop.time() < deadline:
+            await asyncio.sleep(0.01)
+
+    async def close(self):
+        self._closed = True
+        self._frames.clear()
+        self._not_full.set()
+        if self._writer is not None:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+            self._writer = None
+
+    def stats(self) -> dict:
+        return {"queued": len(self._frames), "sent": self.sent, "dropped": self.dropped, "coalesced": self.coalesced}
@@ -0,0 +1,167 @@
+import json
+import os
+import uuid
+from .cache import TTLCache
+from .extraction import ExtractionQueueFull
+
+
+def result_text(content) -> str:
+    """Text of a ToolMessage content: a string or a list of content blocks"""
+    if isinstance(content, str):
+        return content
+    parts = []
+    for block in content if isinstance(content, list) else [content]:
+        if isinstance(block, str):
+            parts.append(block)
+        elif isinstance(block, dict) and block.get("type", "text") == "text":
+            parts.append(block.get("text") or "")
+    return "".join(parts)
+
+
+def _text_pages(text: str, page_bytes: int) -> list:
+    """(start, end) offsets of chunks of at most ``page_bytes`` characters, split at line ends"""
+    offsets = []
+    start = 0
+    while start < len(text):
+        end = min(start + page_bytes, len(text))
+        if end < len(text):
+            newline = text.rfind("\n", start, end)
+            if newline > start:
+                end = newline + 1
+        offsets.append((start, end))
+        start = end
+    return offsets
+
+
+def split_result(text: str, size: int, page_rows: int, page_bytes: int) -> dict:
+    """Parse a tool result and cut it into pages.
+
+    JSON rows come back as the JSON text of each page, which costs little to
+    pass between processes and is only parsed again for the pages a client
+    asks for. Runs on an ``ExtractionPool`` worker for large results.
+    """
+    try:
+        document = json.loads(text)
+    except ValueError:
+        document = None
+    rows = rows_field = None
+    if isinstance(document, list):
+        rows, document = document, None
+    elif isinstance(document, dict):
+        # Page the largest list in the object, e.g. the "rows" of a query result
+        lists = [(len(v), k) for k, v in document.items() if isinstance(v, list)]
+        if lists:
+            rows_field = max(lists)[1]
+            rows = document[rows_field]
+            document = {k: v for k, v in document.items() if k != rows_field}
+    if rows is None:
+        # Text pages are cut by characters; scale so that they average ``page_bytes`` of UTF-8
+        return {"offsets": _text_pages(text, max(1, page_bytes * len(text) // size))}
+    pages = [json.dumps(rows[start:start + page_rows]) for start in range(0, len(rows), page_rows)]
+    return {"document": document, "rows_field": rows_field, "total_rows": len(rows), "pages": pages or ["[]"]}
+
+
+class PagedResult:
+    """A large tool result held server-side; pages are rows of a JSON result or text chunks"""
+
+    def __init__(self, handle: str, tool_name: str, tool_id: str, text: str, size: int, parts: dict,
+                 page_rows: int):
+        self.handle = handle
+        self.tool_name = tool_name
+        self.tool_id = tool_id
+        self.size = size  # UTF-8 bytes
+        self.document = parts.get("document")
+        self.rows_field = parts.get("rows_field")
+        self.total_rows = parts.get("total_rows")
+        self.pages = parts.get("pages")
+        self.page_rows = page_rows
+        if self.pages is not None:
+            self.total_pages = len(self.pages)
+        else:
+            self.text = text
+            self.offsets = parts["offsets"]
+            self.total_pages = len(self.offsets)
+
+    def page(self, number: int):
+        if not 0 <= number < self.total_pages:
+            raise ValueError(f"Tool result {self.handle} has {self.total_pages} pages, not {number + 1}")
+        if self.pages is not None:
+            return json.loads(self.pages[number])
+        start, end = self.offsets[number]
+        return self.text[start:end]
+
+    def preview(self):
+        """First page in the shape of the original result"""
+        first = self.page(0)
+        if self.rows_field:
+            return {**self.document, self.rows_field: first}
+        return first
+
+    def paging(self) -> dict:
+        info = {"handle": self.handle, "total_pages": self.total_pages, "total_bytes": self.size}
+        if self.pages is not None:
+            info.update(total_rows=self.total_rows, page_rows=self.page_rows, rows_field=self.rows_field)
+        return info
+
+
+class ResultPager:
+    """Keeps tool results larger than ``TOOL_RESULT_INLINE_BYTES`` out of single frames.
+
+    Such results are sent as a first page plus a ``paging`` handle; the client
+    fetches more with ``tool_result_page`` {handle, page[, count]}. JSON
+    results are paged by ``TOOL_RESULT_PAGE_ROWS`` rows, other text by
+    about ``TOOL_RESULT_PAGE_BYTES`` bytes. Results over
+    ``TOOL_RESULT_OFFLOAD_BYTES`` are parsed on the extraction pool, so a
+    multi-MB result does not stall the event loop. Handles expire after
+    ``TOOL_RESULT_HANDLE_TTL`` seconds; at most ``TOOL_RESULT_STORE_BYTES``
+    of results are held per session.
+    """
+
+    def __init__(self):
+        self.inline_bytes = int(os.getenv("TOOL_RESULT_INLINE_BYTES", str(64 * 1024)))
+        self.page_rows = int(os.getenv("TOOL_RESULT_PAGE_ROWS", "500"))
+        self.page_bytes = int(os.getenv("TOOL_RESULT_PAGE_BYTES", str(64 * 1024)))
+        self.offload_bytes = int(os.getenv("TOOL_RESULT_OFFLOAD_BYTES", str(256 * 1024)))
+        self.results = TTLCache(
+            ttl=float(os.getenv("TOOL_RESULT_HANDLE_TTL", "1800")),
+            max_entries=64,
+            max_size=int(os.getenv("TOOL_RESULT_STORE_BYTES", str(32 * 1024 * 1024))),
+        )
+
+    async def paginate(self, tool_name: str, tool_id: str, content, pool=None):
+        """Return a PagedResult for a large result, or None if it fits in one frame"""
+        if self.inline_bytes <= 0:
+            return None
+        text = result_text(content)
+        # The limit is in bytes; UTF-8 takes at most 4 per character, so short text needs no encoding
+        if len(text) * 4 <= self.inline_bytes:
+            return None
+        size = len(text.encode())
+        if size <= self.inline_bytes:
+            return None
+        parts = None
+        if pool is not None and size > self.offload_bytes:
+            # Not a thread: json.loads holds the GIL for the whole parse
+            try:
+                parts = await pool.run(split_result, text, size, self.page_rows, self.page_bytes)
+            except ExtractionQueueFull:
+                pass
+        if parts is None:
+            parts = split_result(text, size, self.page_rows, self.page_bytes)
+        result = PagedResult(uuid.uuid4().hex, tool_name, tool_id, text, size, parts, self.page_rows)
+        if result.total_pages <= 1:
+            return None
+        if result.size > self.results.max_size:
+            result.handle = None  # too large to keep; the client only gets the first page
+        else:
+            self.results.set(result.handle, result, size=result.size)
+        return result
+
+    def get(self, handle: str) -> PagedResult:
+        result = self.results.get(handle)
+        if result is None:
+            raise ValueError(f"Tool result {handle} is no longer available")
+        return result
+
+    def clear(self):
+        self.results.clear()
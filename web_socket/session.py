@@ -0,0 +1,991 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+import websockets
+from .datasets import DatasetStore, is_tabular
+from .extraction import ExtractionQueueFull, format_error_block, format_file_block
+from .history import ConversationHistory
+from .outbound import OutboundQueue
+from .results import ResultPager
+from .session_store import new_session_token
+from .uploads import UploadError
+from .logger import log_event, logger
+from .metrics import FIRST_TOKEN_SECONDS, STAGE_SECONDS, TOOL_CALL_SECONDS, span
+
+# System instructions for follow-up turns; constant so the prompt prefix stays byte-identical between turns
+CONTINUATION_CONTEXT = {
+    # Gemini-specific context to emphasize conversation awareness
+    "gemini": """You are continuing a conversation with a user. IMPORTANT: Review the conversation history carefully before responding. 
+                
+Use information from previous messages when possible. Only call tools if you need NEW or UPDATED information that wasn't already provided in this conversation.
+                
+If the user asks about something that was already discussed or shown in previous messages, refer to that information instead of making new tool calls.
+                
+Pay special attention to:
+- Schema information that was already retrieved
+- Data that was already queried or displayed
+- Questions that were already answered
+- Context from previous user messages and your responses""",
+    # Claude-specific context (more specific about tool usage)
+    "claude": """You are continuing a conversation. Use information from previous responses when possible. 
+
+IMPORTANT: Only call tools if you need NEW or UPDATED information that wasn't already provided in this conversation.
+
+Before calling any tool, check if:
+- Schema information was already retrieved (look for messages about "schemas retrieved" or "schema information")
+- Table data was already queried
+- The same or similar information was already obtained
+
+If you see that schemas, tables, or other data were already retrieved in this conversation, refer to that previous information instead of calling the same tools again.
+
+Only use tools when you need genuinely new information that wasn't provided in the recent conversation history.""",
+}
+
+
+class ChatSession:
+    """State for a single websocket connection: socket, agent, credentials and history.
+
+    Shared, connection-independent resources (LLM instances, MCP clients) are
+    obtained from the owning ``IncortaMCPClient`` so that many sessions can run
+    in one process without stepping on each other.
+    """
+
+    def __init__(self, client, websocket, session_id: str = None):
+        self.client = client
+        self.websocket = websocket
+        # Frames are written by a separate task so a slow client cannot stall the agent
+        self.outbox = OutboundQueue(websocket) if websocket is not None else None
+        self.session_id = session_id or uuid.uuid4().hex
+        self.token = None  # resume token, issued on authentication
+        self.saved_at = 0.0  # time of the last snapshot written to the session store
+        self.mcp_client = None
+        self.agent = None
+        self.llm = None
+        self.current_model = "claude"  # Default model
+        self.current_credentials = None
+        self.conversation_history = ConversationHistory(self.current_model)
+        self.datasets = None  # DatasetStore, created on the first tabular upload
+        self.results = ResultPager()  # large tool results, served to the client page by page
+        # Send incremental assistant_delta frames while the model generates
+        self.stream_tokens = os.getenv("STREAM_TOKENS", "true").lower() == "true"
+        # Tool calls from one agent step run concurrently, at most this many at once
+        self.tool_concurrency = int(os.getenv("TOOL_MAX_CONCURRENCY", "4"))
+        # The running query, as a task so the message loop keeps reading (cancel, paging, uploads)
+        self.query_task = None
+        self.query_id = None
+        self.run_callbacks = []  # callbacks of the admitted run (per-tenant LLM token metering)
+
+    async def initialize_agent(self, model_name: str = "claude"):
+        """Initialize the langchain agent with specified model"""
+        with span("initialize_agent") as labels:
+            try:
+                logger.info(f"Initializing agent with model: {model_name}")
+            
+                # Create LLM based on model choice
+                if model_name.lower() in ["claude", "anthropic"]:
+                    logger.info("Creating Anthropic Claude LLM")
+                    try:
+                        self.llm = self.client.get_llm("anthropic")
+                        self.current_model = "claude"
+                    except Exception as e:
+                        logger.error(f"Failed to create Claude LLM: {e}")
+                        raise ValueError(f"Failed to create Claude LLM: {e}")
+                elif model_name.lower() in ["gemini", "google"]:
+                    logger.info("Creating Google Gemini LLM")
+                    try:
+                        self.llm = self.client.get_llm("google")
+                        self.current_model = "gemini"
+                    except Exception as e:
+                        logger.error(f"Failed to create Gemini LLM: {e}")
+                        raise ValueError(f"Failed to create Gemini LLM: {e}")
+                else:
+                    raise ValueError(f"Unsupported model: {model_name}")
+                
+                logger.info(f"LLM created successfully: {type(self.llm)}")
+                
+                # Attach the (shared) MCP client for these credentials if not already done
+                if not self.mcp_client and self.current_credentials:
+                    logger.info("Initializing MCP client")
+                    self.mcp_client = self.client.get_mcp_client(self.current_credentials)
+
+                if self.mcp_client:
+                    # Get tools from MCP server (cached per user across sessions)
+                    tools = await self.client.get_tools(self.current_credentials)
+                    if self.datasets and self.datasets.tables:
+                        # Local tool over this session's uploaded tables
+                        tools = tools + [self.datasets.as_tool()]
+                    log_event("agent.tools", tools=[tool.name for tool in tools])
+                
+                    # Create agent with LLM and tools (cached per model and tool set)
+                    self.agent = self.client.get_agent(self.current_model, self.llm, tools)
+                
+                self.conversation_history.set_model(self.current_model)
+                logger.info(f"Agent initialized with model: {self.current_model}")
+                labels["model"] = self.current_model
+            
+            except Exception as e:
+                logger.error(f"Error initializing agent: {e}")
+                raise
+
+    async def send_message(self, message_type: str, data: dict):
+        """Queue a message for the WebSocket client if connected"""
+        if self.websocket and self.outbox:
+            await self.outbox.put({
+                "type": message_type,
+                "data": data,
+                "timestamp": asyncio.get_event_loop().time()
+            })
+
+    @staticmethod
+    def _delta_text(content) -> str:
+        """Extract the text of a streamed message chunk (string or list of content parts)"""
+        if isinstance(content, str):
+            return content
+        text = ""
+        if isinstance(content, list):
+            for part in content:
+                if isinstance(part, str):
+                    text += part
+                elif isinstance(part, dict) and part.get("type", "text") == "text":
+                    text += part.get("text") or ""
+        return text
+
+    async def process_query(self, query: str) -> str:
+        """Process a query using langchain agent with WebSocket streaming"""
+        if not self.agent:
+            await self.send_message("error", {"message": "Agent not initialized. Please authenticate first."})
+            return "Agent not initialized"
+            
+        # Add user message to conversation history
+        user_message = {"role": "user", "content": query}
+        self.conversation_history.append(user_message)
+        # Keep the history within the model's token budget
+        self.conversation_history.compact()
+        
+        # Add system instruction to avoid unnecessary tool calls. The system message is
+        # ordered from most to least stable (instructions, pinned files, summary) so
+        # providers can serve it from their prompt cache
+        system_context = CONTINUATION_CONTEXT.get(self.current_model, CONTINUATION_CONTEXT["claude"]) if len(self.conversation_history) > 2 else ""
+        
+        # Pinned file contents and the summary of compacted turns go into the system message
+        history_context = self.conversation_history.context_text()
+        if history_context:
+            system_context = f"{system_context}\n\n{history_context}" if system_context else history_context
+
+        # Prepare messages with system context if needed
+        messages = []
+        if system_context:
+            messages.append({"role": "system", "content": system_context})
+        messages.extend(self.conversation_history.as_messages())
+
+        # Debug: Log what we're sending to the model
+        log_event("agent.input", messages=len(messages), model=self.current_model)
+        for i, msg in enumerate(messages):
+            log_event("agent.input_message", index=i, role=msg["role"], content=msg["content"])
+
+        await self.send_message("user_message", {
+            "content": query,
+            "role": "user"
+        })
+
+        query_started = time.perf_counter()
+        with span("query", self.current_model):
+            try:
+                await self.send_message("thinking", {
+                    "message": f"Processing request with {self.current_model}..."
+                })
+
+                response_content = ""
+                streamed_content = ""  # text of the current agent step, folded from assistant_delta frames
+                streamed_message_id = None
+                # Latency instrumentation: time of the last agent step, first output seen
+                step_started = time.perf_counter()
+                first_output = False
+                # Tool calls of the current step by id -> (tool name, start time); results
+                # arrive in completion order, not call order
+                tool_started = {}
+                # Model that produced the answer; differs from current_model after a failover or hedge
+                answered_by = self.current_model
+                # Token usage of the run's model calls, including prompt-cache reads and writes
+                usage = {"input": 0, "output": 0, "cache_read": 0, "cache_creation": 0}
+
+                log_event("agent.stream_start", model=self.current_model, history_length=len(self.conversation_history))
+
+                # Stream the agent response; in token mode LangGraph interleaves
+                # ("messages", (chunk, metadata)) tokens with ("updates", chunk) steps.
+                # Each tool call of a step is its own graph task, so max_concurrency
+                # caps how many run against the MCP server at once
+                stream_mode = ["updates", "messages"] if self.stream_tokens else "updates"
+                stream_config = {"max_concurrency": self.tool_concurrency} if self.tool_concurrency > 0 else {}
+                if self.run_callbacks:
+                    stream_config["callbacks"] = self.run_callbacks
+                async for item in self.agent.astream({"messages": messages}, stream_mode=stream_mode, config=stream_config):
+                    if self.stream_tokens:
+                        mode, chunk = item
+                        if mode == "messages":
+                            message_chunk, metadata = chunk
+                            if metadata.get("langgraph_node") != "agent":
+                                continue
+                            delta = self._delta_text(message_chunk.content)
+                            if not delta:
+                                continue
+                            if not first_output:
+                                first_output = True
+                                FIRST_TOKEN_SECONDS.observe(time.perf_counter() - query_started, model=self.current_model)
+                            if message_chunk.id != streamed_message_id:
+                                streamed_message_id = message_chunk.id
+                                streamed_content = ""
+                            streamed_content += delta
+                            await self.send_message("assistant_delta", {
+                                "content": delta,
+                                "message_id": streamed_message_id,
+                                "role": "assistant",
+                                "model": self.current_model
+                            })
+                            continue
+                    else:
+                        chunk = item
+
+                    log_event("agent.chunk", keys=list(chunk), chunk=chunk)
+                    now = time.perf_counter()
+                    for node in ("agent", "tools"):
+                        if node in chunk:
+                            STAGE_SECONDS.observe(now - step_started, stage=f"step_{node}", model=self.current_model)
+                    step_started = now
+                    if not first_output and "agent" in chunk:
+                        first_output = True
+                        FIRST_TOKEN_SECONDS.observe(now - query_started, model=self.current_model)
+                
+                    if "agent" in chunk:
+                        agent_message = chunk["agent"]["messages"][0]
+                        answered_by = getattr(agent_message, "response_metadata", {}).get("answered_by", answered_by)
+                        if getattr(agent_message, "usage_metadata", None):
+                            counts = self.client.llm_pool.record_usage(answered_by, agent_message.usage_metadata)
+                            for kind, tokens in counts.items():
+                                usage[kind] += tokens
+                        log_event("agent.message", message_type=type(agent_message).__name__, agent_message=agent_message)
+                    
+                        # Special handling for Gemini models
+                        if self.current_model == "gemini" and hasattr(agent_message, 'tool_calls'):
+                            log_event("agent.gemini_tool_calls", count=len(agent_message.tool_calls))
+                    
+                    
+                        # Check if this message has tool calls directly
+                        has_tool_calls = hasattr(agent_message, 'tool_calls') and agent_message.tool_calls
+                        sent_contextual_message = False
+                    
+                        if has_tool_calls:
+                            log_event("agent.tool_calls", tool_calls=agent_message.tool_calls)
+                        
+                            # For Gemini, if content is empty but we have tool calls, send a contextual message
+                            if (self.current_model == "gemini" and 
+                                (not agent_message.content or agent_message.content == "")):
+                                tool_names = [tool_call.get("name", "unknown") if isinstance(tool_call, dict) 
+                                            else getattr(tool_call, 'name', 'unknown') 
+                                            for tool_call in agent_message.tool_calls]
+                                contextual_message = f"I'll help you with that. Let me use the {', '.join(tool_names)} tool{'s' if len(tool_names) > 1 else ''} to get the information you need."
+                            
+                                await self.send_message("assistant_message", {
+                                    "content": contextual_message,
+                                    "role": "assistant", 
+                                    "type": "text",
+                                    "model": self.current_model
+                                })
+                                sent_contextual_message = True
+                                # dont set response_content here - wait for actual content
+                                # response_content = contextual_message
+                        
+                            for tool_call in agent_message.tool_calls:
+                                # Handle both dictionary and object formats
+                                if isinstance(tool_call, dict):
+                                    tool_name = tool_call.get("name", tool_call.get("function", {}).get("name", "unknown"))
+                                    tool_id = tool_call.get("id", f"tool_{tool_name}_{int(asyncio.get_event_loop().time())}")
+                                    tool_args = tool_call.get("args", tool_call.get("function", {}).get("arguments", {}))
+                                else:
+                                    # Handle object format
+                                    tool_name = getattr(tool_call, 'name', getattr(tool_call, 'function', {}).get('name', 'unknown'))
+                                    tool_id = getattr(tool_call, 'id', f"tool_{tool_name}_{int(asyncio.get_event_loop().time())}")
+                                    tool_args = getattr(tool_call, 'args', getattr(tool_call, 'function', {}).get('arguments', {}))
+
+                                log_event("agent.tool_call", tool_name=tool_name, tool_id=tool_id)
+                                tool_started[tool_id] = (tool_name, time.perf_counter())
+
+                                await self.send_message("tool_call", {
+                                    "tool_name": tool_name,
+                                    "tool_args": tool_args,
+                                    "tool_id": tool_id
+                                })
+                    
+                        # Also check for invalid_tool_calls
+                        if hasattr(agent_message, 'invalid_tool_calls') and agent_message.invalid_tool_calls:
+                            logger.warning(f"GEMINI WARNING: Found invalid tool calls: {agent_message.invalid_tool_calls}")
+                            for invalid_call in agent_message.invalid_tool_calls:
+                                logger.warning(f"Invalid tool call details: {invalid_call}")
+                    
+                        # process content regardless of whether we sent a contextual message
+                        # We need to capture the actual response content for conversation history
+                        if isinstance(agent_message.content, str):
+                            # send full content each time
+                            content = agent_message.content
+                            # Only send if content is not empty and not just whitespace
+                            if content and content.strip():
+                                response_content = content
+                            
+                                log_event("agent.assistant_message", content=content)
+                            
+                                # only send to UI if we haven't already sent a contextual message
+                                if not sent_contextual_message:
+                                    await self.send_message("assistant_message", {
+                                        "content": content,
+                                        "message_id": getattr(agent_message, "id", None),
+                                        "role": "assistant",
+                                        "type": "text",
+                                        "model": self.current_model
+                                    })
+                            else:
+                                log_event("agent.empty_content", model=self.current_model)
+                        
+                        elif isinstance(agent_message.content, list):
+                            log_event("agent.content_parts", count=len(agent_message.content))
+                            text_parts = []
+                        
+                            for i, part in enumerate(agent_message.content):
+                                log_event("agent.content_part", index=i, part=part)
+                            
+                                if isinstance(part, dict):
+                                    if "text" in part and part["text"] and part["text"].strip():
+                                        #  non-empty text
+                                        text_parts.append(part["text"].strip())
+                                    
+                                    elif "name" in part and part["name"]:
+                                        # Skip tool_use parts - they're handled by tool_calls attribute
+                                        pass
+                                    
+                                elif hasattr(part, '__dict__'):
+                                    # Handle object format
+                                    if hasattr(part, 'text') and part.text and part.text.strip():
+                                        text_parts.append(part.text.strip())
+                        
+                            # Send combined text if any non-empty text parts found
+                            if text_parts:
+                                content = "\n".join(text_parts)
+                                response_content = content
+                            
+                                log_event("agent.assistant_message", content=content)
+                            
+                                # only send to UI if we haven't already sent a contextual message
+                                if not sent_contextual_message:
+                                    await self.send_message("assistant_message", {
+                                        "content": content,
+                                        "message_id": getattr(agent_message, "id", None),
+                                        "role": "assistant",
+                                        "type": "text",
+                                        "model": self.current_model
+                                    })
+                            else:
+                                log_event("agent.empty_content", model=self.current_model)
+                
+                    elif "tools" in chunk:
+                        log_event("agent.tools_chunk", chunk=chunk["tools"])
+                        for tool_message in chunk["tools"]["messages"]:
+                            await self.send_tool_result(tool_message, tool_started)
+
+                # Fall back to the streamed tokens if the final step carried no text
+                if not response_content and streamed_content.strip():
+                    response_content = streamed_content
+
+                await self.send_message("completed", {
+                    "final_response": response_content,
+                    "model": answered_by,
+                    "requested_model": self.current_model,
+                    "usage": usage
+                })
+                log_event("agent.usage", model=answered_by, **usage)
+            
+                # Add assistant response to conversation history
+                if response_content:
+                    assistant_message = {"role": "assistant", "content": response_content}
+                    self.conversation_history.append(assistant_message)
+                    log_event("history.assistant_added", total_messages=len(self.conversation_history))
+                    log_event("history.assistant_response", content=response_content)
+                else:
+                    logger.warning(f"No response content to add to conversation history for {self.current_model}")
+            
+                return response_content
+
+            except asyncio.CancelledError:
+                # Keep user/assistant turns alternating for the next query
+                self.conversation_history.append({"role": "assistant", "content": "[Response cancelled by the user]"})
+                logger.info("Query cancelled after %.2fs", time.perf_counter() - query_started)
+                raise
+
+            except Exception as e:
+                logger.error(f"Error in process_query: {e}")
+                await self.send_message("error", {
+                    "message": f"Error processing query: {str(e)}",
+                    "model": self.current_model
+                })
+                return f"Error: {str(e)}"
+
+    async def send_tool_result(self, tool_message, tool_started: dict):
+        """Send one tool result, matched to its call by ``tool_call_id``, and summarise it in the history"""
+        tool_result = tool_message.content
+        tool_id = getattr(tool_message, "tool_call_id", None) or ""
+        started_tool = tool_started.pop(tool_id, None)
+        tool_name = started_tool[0] if started_tool else getattr(tool_message, "name", None)
+        if started_tool:
+            TOOL_CALL_SECONDS.observe(time.perf_counter() - started_tool[1], tool=tool_name, model=self.current_model)
+
+        log_event("agent.tool_result", tool_name=tool_name, tool_id=tool_id)
+        paged = await self.results.paginate(tool_name or "unknown", tool_id, tool_result,
+                                            pool=self.client.extraction_pool)
+
+        # Add tool result to conversation history for context
+        if tool_name and tool_result:
+            # create a structured tool result message for conversation history
+            tool_result_summary = f"Tool '{tool_name}' executed successfully."
+
+            # add a concise summary for common tools to avoid huge conversation history
+            if "schema" in tool_name.lower():
+                if isinstance(tool_result, list) and len(tool_result) > 0:
+                    tool_result_summary += f" Retrieved {len(tool_result)} schemas."
+                    # add specific schema names for better context
+                    if len(tool_result) <= 10:  # only if not too many
+                        try:
+                            schema_names = [item.get('schemaName', 'Unknown') for item in tool_result if isinstance(item, dict)]
+                            if schema_names:
+                                tool_result_summary += f" Schemas: {', '.join(schema_names[:5])}"
+                                if len(schema_names) > 5:
+                                    tool_result_summary += f" and {len(schema_names) - 5} more."
+                        except:
+                            pass
+                elif isinstance(tool_result, str) and "schema" in tool_result.lower():
+                    tool_result_summary += " Schema information retrieved."
+                else:
+                    tool_result_summary += " Schema data available."
+            elif "table" in tool_name.lower():
+                tool_result_summary += " Table information retrieved."
+            elif "query" in tool_name.lower():
+                tool_result_summary += " Query executed successfully."
+            else:
+                # for other tools, add a brief description
+                tool_result_summary += " Data retrieved."
+            if paged and paged.total_rows is not None:
+                tool_result_summary += f" {paged.total_rows} rows returned."
+
+            # add to conversation history (assistant message with tool context)
+            tool_context_message = {"role": "assistant", "content": tool_result_summary}
+            self.conversation_history.append(tool_context_message)
+            log_event("history.tool_summary", summary=tool_result_summary)
+
+        if paged:
+            # Only the first page goes out now; the client asks for more with tool_result_page
+            await self.send_message("tool_result", {
+                "tool_name": tool_name or "unknown",
+                "tool_id": tool_id,
+                "result": paged.preview(),
+                "paging": paged.paging()
+            })
+        else:
+            await self.send_message("tool_result", {
+                "tool_name": tool_name or "unknown",
+                "tool_id": tool_id,
+                "result": tool_result
+            })
+
+    async def clear_conversation(self):
+        """Clear the conversation history"""
+        self.conversation_history.clear()
+        self.results.clear()
+        if self.datasets:
+            self.close_datasets()
+            if self.agent:
+                await self.initialize_agent(self.current_model)
+        logger.info("Conversation history cleared")
+        await self.send_message("conversation_cleared", {"status": "success"})
+
+    def close_datasets(self):
+        if self.datasets:
+            self.datasets.close()
+            self.datasets = None
+
+    async def load_dataset(self, file_data: dict) -> str:
+        """Load a tabular upload into the session's dataset store.
+
+        Returns a note for the prompt pointing the model at the new tables, or
+        telling it the load failed.
+        """
+        if self.datasets is None:
+            self.datasets = DatasetStore(self.client.uploads.directory)
+        try:
+            tables = await self.datasets.load(self.client.extraction_pool, file_data)
+        except ExtractionQueueFull:
+            raise
+        except Exception as e:
+            logger.warning(f"Could not load {file_data.get('name')} into the dataset store: {e}")
+            await self.send_message("file_error", {
+                "file_name": file_data.get("name"),
+                "error": f"rows could not be loaded for querying: {e}"
+            })
+            return (f"[The rows of '{file_data.get('name')}' could not be loaded into a local table ({e}); "
+                    f"only the summary above is available, not through the query_uploaded_data tool]\n")
+        if not tables:
+            return ""
+        table_list = ", ".join(f"{table} ({rows} rows)" for table, rows in tables)
+        return (f"[All rows of '{file_data.get('name')}' are loaded into local table(s) {table_list}; "
+                f"use the query_uploaded_data tool for exact filters and aggregations]\n")
+
+    async def process_uploaded_file(self, file_data: dict) -> str:
+        """Process uploaded file and extract text content on the shared extraction pool"""
+        extraction = self.client.extraction_pool.extract(file_data)
+        try:
+            with span("file_extraction", self.current_model):
+                if is_tabular(file_data):
+                    entry, dataset_note = await asyncio.gather(extraction, self.load_dataset(file_data))
+                else:
+                    entry, dataset_note = await extraction, ""
+        except ExtractionQueueFull:
+            raise
+        except Exception as e:
+            logger.error(f"Error processing file {file_data.get('name', 'unknown')}: {e}")
+            return format_error_block(file_data, e)
+        return format_file_block(file_data, entry) + dataset_note
+
+    async def process_files(self, files: list):
+        """Extract all files of one message in parallel, reporting progress in upload order.
+
+        Returns the extracted contents and a short description for each file.
+        """
+        for file in files:
+            # Send file processing status
+            await self.send_message("file_processed", {
+                "file_name": file.get('name'),
+                "file_size": file.get('size'),
+                "file_type": file.get('type'),
+                "status": "processing"
+            })
+
+        tables_before = len(self.datasets.tables) if self.datasets else 0
+        tasks = [asyncio.ensure_future(self.process_uploaded_file(file)) for file in files]
+        file_contents = []
+        file_info = []
+        for file, task in zip(files, tasks):
+            try:
+                # Process file and extract text
+                file_text = await task
+                file_contents.append(file_text)
+                file_info.append(f"{file.get('name')} ({file.get('size')} bytes)")
+
+                # Send successful processing status
+                await self.send_message("file_processed", {
+                    "file_name": file.get('name'),
+                    "file_size": file.get('size'),
+                    "file_type": file.get('type'),
+                    "status": "completed"
+                })
+
+            except Exception as e:
+                logger.error(f"Error processing file {file.get('name')}: {e}")
+                await self.send_message("file_error", {
+                    "file_name": file.get('name'),
+                    "error": str(e)
+                })
+                file_info.append(f"{file.get('name')} (processing failed)")
+
+        # New tables change the local tool, so rebuild the agent with it
+        if self.datasets and len(self.datasets.tables) != tables_before and self.agent:
+            await self.initialize_agent(self.current_model)
+
+        return file_contents, file_info
+
+
+    async def send_result_pages(self, data: dict):
+        """Send ``count`` pages of a paged tool result starting at ``page``"""
+        handle = data.get("handle")
+        try:
+            result = self.results.get(handle)
+            first = int(data.get("page", 1))
+            count = max(1, int(data.get("count", 1)))
+            for number in range(first, min(first + count, result.total_pages)):
+                await self.send_message("tool_result_page", {
+                    "handle": handle,
+                    "tool_id": result.tool_id,
+                    "page": number,
+                    "total_pages": result.total_pages,
+                    "rows_field": result.rows_field,
+                    "result": result.page(number)
+                })
+        except ValueError as e:
+            await self.send_message("error", {"message": str(e), "handle": handle})
+
+    def _upload_owner(self) -> tuple:
+        credentials = self.current_credentials or {}
+        return (credentials.get("envUrl"), credentials.get("tenant"), credentials.get("incortaUsername"))
+
+    def resolve_uploads(self, upload_ids: list) -> list:
+        """Turn upload ids from a query into file descriptors for process_files"""
+        return [self.client.uploads.get(upload_id, self._upload_owner()).as_file_data() for upload_id in upload_ids]
+
+    async def _check_upload_auth(self, upload_id: str = None) -> bool:
+        """Uploads are owned by the authenticated user; refuse them before authentication"""
+        if self.current_credentials:
+            return True
+        await self.send_message("upload_error", {"upload_id": upload_id, "error": "Please authenticate first"})
+        return False
+
+    async def handle_upload_start(self, data: dict):
+        """Start (or resume) a chunked upload"""
+        if not await self._check_upload_auth(data.get("upload_id")):
+            return
+        try:
+            upload = self.client.uploads.start(
+                self._upload_owner(),
+                name=data.get("name", "upload"),
+                size=data.get("size", 0),
+                mime_type=data.get("mime_type"),
+                upload_id=data.get("upload_id"),
+            )
+        except (UploadError, ValueError) as e:
+            await self.send_message("upload_error", {"upload_id": data.get("upload_id"), "error": str(e)})
+            return
+        await self.send_message("upload_ready", {
+            "upload_id": upload.upload_id,
+            "offset": upload.received,
+            "chunk_size": self.client.uploads.chunk_size
+        })
+
+    async def handle_upload_chunk(self, frame: bytes):
+        """Append a binary chunk to its upload and acknowledge the new offset"""
+        if not await self._check_upload_auth():
+            return
+        try:
+            upload = self.client.uploads.write_chunk(frame, self._upload_owner())
+        except UploadError as e:
+            await self.send_message("upload_error", {"error": str(e)})
+            return
+        await self.send_message("upload_progress", {"upload_id": upload.upload_id, "offset": upload.received})
+
+    async def handle_upload_finish(self, data: dict):
+        """Complete a chunked upload once all of its bytes have arrived"""
+        if not await self._check_upload_auth(data.get("upload_id")):
+            return
+        try:
+            upload = self.client.uploads.finish(data.get("upload_id"), self._upload_owner())
+        except UploadError as e:
+            await self.send_message("upload_error", {"upload_id": data.get("upload_id"), "error": str(e)})
+            return
+        await self.send_message("upload_complete", {
+            "upload_id": upload.upload_id,
+            "file_name": upload.name,
+            "file_size": upload.size
+        })
+
+    def snapshot(self) -> dict:
+        """What a resume needs when this session object is gone: credentials, model and history"""
+        self.saved_at = time.time()
+        return {
+            "credentials": self.current_credentials,
+            "model": self.current_model,
+            "history": self.conversation_history.to_dict(),
+            "saved_at": self.saved_at,
+        }
+
+    async def save_state(self):
+        if self.token:
+            await self.client.session_store.save(self)
+
+    def release(self):
+        """Free the per-session resources of a session that will not be resumed"""
+        self.close_datasets()
+        self.results.clear()
+
+    def adopt(self, other: "ChatSession"):
+        """Take over the state of a parked session for this connection"""
+        self.release()
+        for name in ("token", "saved_at", "mcp_client", "agent", "llm", "current_model", "current_credentials",
+                     "conversation_history", "datasets", "results"):
+            setattr(self, name, getattr(other, name))
+
+    async def resume_session(self, token: str):
+        """Continue the session a token was issued for, without re-authenticating"""
+        source = "memory"
+        parked = self.client.session_store.take(token) if token else None
+        snapshot = await self.client.session_store.load(token) if token else None
+        if parked is not None and snapshot and snapshot.get("saved_at", 0) > parked.saved_at:
+            # Another worker continued this session since it was parked here
+            parked.release()
+            parked = None
+        if parked is not None:
+            self.adopt(parked)
+        else:
+            if not snapshot:
+                await self.send_message("resume_failed", {"message": "Session expired, please authenticate again"})
+                return
+            source = "store"
+            try:
+                with span("resume", snapshot["model"]):
+                    self.current_credentials = snapshot["credentials"]
+                    self.mcp_client = None
+                    self.conversation_history.restore(snapshot["history"])
+                    await self.initialize_agent(snapshot["model"])
+            except Exception as e:
+                self.current_credentials = None
+                self.conversation_history.clear()
+                await self.send_message("resume_failed", {"message": str(e)})
+                logger.error(f"Resume failed: {e}")
+                return
+            self.token = token
+
+        await self.send_message("session_resumed", {
+            "session_token": self.token,
+            "route": self.client.route,
+            "model": self.current_model,
+            "history_length": len(self.conversation_history),
+            "source": source
+        })
+        logger.info(f"Session {self.session_id} resumed from {source} "
+                    f"({len(self.conversation_history)} messages, model {self.current_model})")
+
+    async def handle_query(self, data: dict):
+        """Answer a ``query`` message, with the content of any attached files"""
+        query = data.get("query", "")
+        files = data.get("files", []) + self.resolve_uploads(data.get("upload_ids", []))
+
+        # Handle file processing if files are provided
+        if files:
+            file_contents, file_info = await self.process_files(files)
+
+            # Send files uploaded confirmation
+            await self.send_message("files_uploaded", {
+                "message": f"Successfully processed {len(files)} file(s): {', '.join(file_info)}"
+            })
+
+            # Combine all file contents
+            all_file_content = "".join(file_contents)
+
+            # Modify query to include file context
+            if query:
+                query = f"{query}\n\nUploaded files content:\n{all_file_content}"
+            else:
+                query = f"I have uploaded {len(files)} file(s). Please analyze their content:\n{all_file_content}"
+
+        await self.process_query(query)
+
+    async def handle_upload_files(self, data: dict):
+        """Extract the files of an ``upload_files`` message and have the agent summarise them"""
+        files = data.get("files", []) + self.resolve_uploads(data.get("upload_ids", []))
+        if files:
+            file_contents, file_info = await self.process_files(files)
+
+            # send files uploaded confirmation with summary
+            all_file_content = "".join(file_contents)
+            await self.send_message("files_uploaded", {
+                "message": f"Successfully processed {len(files)} file(s): {', '.join(file_info)}",
+                "content_preview": all_file_content[:500] + "..." if len(all_file_content) > 500 else all_file_content
+            })
+
+            # Automatically analyze the uploaded files
+            analysis_query = f"Please analyze the following {len(files)} uploaded file(s), where user uploaded them to you to see the data or what he want to consider in his chat and provide a summary of their content:\n\n{all_file_content}"
+            await self.process_query(analysis_query)
+
+    async def start_query(self, query_id: str, handler, data: dict):
+        """Run ``handler(data)`` as this session's query task; a running query is cancelled first"""
+        await self.cancel_query()
+        self.query_id = query_id
+        await self.send_message("query_started", {"query_id": query_id})
+        self.query_task = asyncio.create_task(self._run_query(handler, data))
+
+    async def _run_query(self, handler, data: dict):
+        try:
+            if self.current_credentials:
+                async with self.client.admission.admit(self.current_credentials.get("tenant") or "",
+                                                       self.current_credentials.get("incortaUsername") or self.session_id,
+                                                       on_queued=self.send_queued) as tenant:
+                    self.run_callbacks = self.client.admission.llm_callbacks(tenant)
+                    await handler(data)
+            else:
+                await handler(data)  # not authenticated: the handler only reports the error
+        except Exception as e:
+            await self.send_message("error", {"message": str(e)})
+        finally:
+            self.run_callbacks = []
+            # Also when cancelled, so a resume keeps the turns and model changes made so far
+            await asyncio.shield(self.save_state())
+
+    async def send_queued(self, position: int, queue_length: int):
+        await self.send_message("queued", {"query_id": self.query_id, "position": position,
+                                           "queue_length": queue_length})
+
+    async def cancel_query(self, query_id: str = None, notify: bool = True) -> bool:
+        """Cancel the running query (if ``query_id`` is given, only that one).
+
+        Cancelling the task closes the model stream and the pending MCP calls
+        of the agent run. Returns False if there was nothing to cancel.
+        """
+        task = self.query_task
+        if task is None or task.done() or (query_id and query_id != self.query_id):
+            return False
+        task.cancel()
+        # Wait for the run to unwind without propagating its CancelledError
+        await asyncio.wait([task])
+        if notify:
+            await self.send_message("cancelled", {"query_id": self.query_id})
+        logger.info("Cancelled query %s (session %s)", self.query_id, self.session_id)
+        return True
+
+    async def run(self):
+        """Read and dispatch messages from this session's websocket until it closes"""
+        if self.outbox:
+            self.outbox.start()
+        try:
+            await self.send_message("connected", {"status": "ready", "session_id": self.session_id})
+            
+            logger.info(f"WebSocket client connected (session {self.session_id})")
+            async for message in self.websocket:
+                try:
+                    if isinstance(message, bytes):
+                        # Binary frames carry chunks of a chunked upload
+                        await self.handle_upload_chunk(message)
+                        continue
+                    
+                    data = json.loads(message)
+                    # Only the type at INFO; payloads (base64 files, queries) are debug-level and truncated
+                    log_event("ws.received", message_type=data.get("type"), chars=len(message))
+                    log_event("ws.message", payload=data)
+
+                    if data.get("type") == "authenticate":
+                        credentials = data.get("credentials")
+                        logger.info(f"Received authentication request for {(credentials or {}).get('incortaUsername')}")
+                        await self.cancel_query()
+                        await self.authenticate_user(credentials)
+                        
+                    elif data.get("type") == "resume":
+                        await self.cancel_query()
+                        await self.resume_session(data.get("session_token"))
+
+                    elif data.get("type") == "set_model":
+                        if not self.current_credentials:
+                            await self.send_message("error", {"message": "Please authenticate first"})
+                            continue
+                            
+                        model_name = data.get("model", "claude")
+                        logger.info(f"Received set_model request: {model_name}")
+                        await self.cancel_query()
+                        try:
+                            await self.initialize_agent(model_name)
+                            await self.send_message("model_switched", {
+                                "model": self.current_model,
+                                "message": f"Successfully switched to {self.current_model}"
+                            })
+                            await self.save_state()
+                            logger.info(f"Model switched to: {self.current_model}")
+                        except Exception as e:
+                            error_msg = f"Failed to switch to {model_name}: {str(e)}"
+                            await self.send_message("model_switch_failed", {
+                                "error": error_msg,
+                                "message": error_msg
+                            })
+                            logger.error(f"Model switch failed: {e}")
+                            import traceback
+                            logger.error(f"Traceback: {traceback.format_exc()}")
+                        
+                    elif data.get("type") in ("query", "upload_files"):
+                        if not self.current_credentials:
+                            await self.send_message("error", {"message": "Please authenticate first"})
+                            continue
+                        handler = self.handle_query if data.get("type") == "query" else self.handle_upload_files
+                        await self.start_query(data.get("query_id") or uuid.uuid4().hex, handler, data)
+
+                    elif data.get("type") == "cancel":
+                        if not await self.cancel_query(data.get("query_id")):
+                            logger.info(f"Nothing to cancel for query {data.get('query_id')}")
+
+                    elif data.get("type") == "upload_start":
+                        await self.handle_upload_start(data)
+                        
+                    elif data.get("type") == "upload_finish":
+                        await self.handle_upload_finish(data)
+                        
+                    elif data.get("type") == "tool_result_page":
+                        await self.send_result_pages(data)
+                        
+                    elif data.get("type") == "clear_conversation":
+                        await self.cancel_query()
+                        await self.clear_conversation()
+                        await self.save_state()
+                        
+                    elif data.get("type") == "refresh_tools":
+                        if not self.current_credentials:
+                            await self.send_message("error", {"message": "Please authenticate first"})
+                            continue
+                            
+                        # Re-discover MCP tools, e.g. after schemas or tools changed on the server
+                        await self.cancel_query()
+                        self.client.invalidate_tools(self.current_credentials)
+                        await self.initialize_agent(self.current_model)
+                        await self.send_message("tools_refreshed", {"model": self.current_model})
+                        
+                except json.JSONDecodeError:
+                    await self.send_message("error", {"message": "Invalid JSON format"})
+                except Exception as e:
+                    await self.send_message("error", {"message": str(e)})
+                    
+        except websockets.exceptions.ConnectionClosed:
+            logger.info(f"WebSocket client disconnected (session {self.session_id})")
+        finally:
+            # Nobody is left to read the answer; stop the model and the MCP calls
+            await self.cancel_query(notify=False)
+
+    async def authenticate_user(self, credentials):
+        """Authenticate user with provided credentials"""
+        try:
+            self.conversation_history.clear()
+            self.close_datasets()
+            self.current_credentials = credentials
+            self.mcp_client = None  # New credentials need their own MCP client
+            
+            # Initialize agent with default model (claude)
+            with span("authenticate", "claude"):
+                await self.initialize_agent("claude")
+
+            # A new login starts a new resumable session
+            if self.token:
+                await self.client.session_store.forget(self.token)
+            self.token = new_session_token()
+            await self.save_state()
+
+            await self.send_message("authenticated", {
+                "status": "success",
+                "model": self.current_model,
+                "session_token": self.token,
+                "route": self.client.route
+            })
+            logger.info(f"User authenticated: {credentials.get('incortaUsername')} with model: {self.current_model}")
+            
+        except Exception as e:
+            await self.send_message("authentication_failed", {"message": str(e)})
+            logger.error(f"Authentication failed: {e}")
+
+
+class SessionRegistry:
+    """Registry of the live chat sessions in this process, keyed by session id"""
+
+    def __init__(self):
+        self._sessions = {}
+
+    def add(self, session: ChatSession):
+        self._sessions[session.session_id] = session
+
+    def get(self, session_id: str):
+        return self._sessions.get(session_id)
+
+    def remove(self, session_id: str):
+        return self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __iter__(self):
+        return iter(list(self._sessions.values()))
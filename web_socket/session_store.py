@@ -0,0 +1,178 @@
+import asyncio
+import hashlib
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from .cache import TTLCache
+from .logger import logger
+
+
+def data_path(name: str) -> str:
+    """Path of a file the server keeps under ``DATA_DIR`` (default ``~/.incorta-chat``).
+
+    The directory holds access tokens and tool results, so it is created
+    accessible to the server's user only.
+    """
+    directory = os.getenv("DATA_DIR") or os.path.join(os.path.expanduser("~"), ".incorta-chat")
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    return os.path.join(directory, name)
+
+
+def new_session_token() -> str:
+    return secrets.token_urlsafe(32)
+
+
+def _token_key(token: str) -> str:
+    # Only a hash of the token is stored, so the store itself cannot be used to resume sessions
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class MemorySessionBackend:
+    """Session snapshots in an in-process LRU; lost when the process exits"""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.snapshots = TTLCache(ttl=ttl, max_entries=max_entries)
+
+    async def load(self, token: str):
+        return self.snapshots.get(_token_key(token))
+
+    async def save(self, token: str, snapshot: dict):
+        self.snapshots.set(_token_key(token), snapshot)
+
+    async def delete(self, token: str):
+        self.snapshots.invalidate(_token_key(token))
+
+    def close(self):
+        self.snapshots.clear()
+
+
+class SQLiteSessionBackend:
+    """Session snapshots in a SQLite file, so sessions survive restarts and can be resumed by any worker.
+
+    Snapshots include the user's Incorta credentials; the file is created
+    readable by its owner only.
+    """
+
+    def __init__(self, path: str, ttl: float):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        if not os.path.exists(path):
+            os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (token TEXT PRIMARY KEY, snapshot TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)")
+
+    def _load(self, key: str):
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT snapshot FROM sessions WHERE token = ? AND updated > ?", (key, time.time() - self.ttl)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _save(self, key: str, snapshot: str):
+        now = time.time()
+        with self._lock:
+            self.connection.execute(
+                "INSERT INTO sessions (token, snapshot, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT (token) DO UPDATE SET snapshot = excluded.snapshot, updated = excluded.updated",
+                (key, snapshot, now),
+            )
+            self.connection.execute("DELETE FROM sessions WHERE updated <= ?", (now - self.ttl,))
+
+    def _delete(self, key: str):
+        with self._lock:
+            self.connection.execute("DELETE FROM sessions WHERE token = ?", (key,))
+
+    async def load(self, token: str):
+        return await asyncio.to_thread(self._load, _token_key(token))
+
+    async def save(self, token: str, snapshot: dict):
+        await asyncio.to_thread(self._save, _token_key(token), json.dumps(snapshot))
+
+    async def delete(self, token: str):
+        await asyncio.to_thread(self._delete, _token_key(token))
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+
+class SessionStore:
+    """Resumable sessions, looked up by the token sent with ``authenticated``.
+
+    A disconnected session stays parked in memory for ``SESSION_IDLE_TTL``
+    seconds (at most ``SESSION_PARKED_MAX`` sessions, least recently used
+    evicted first), so a reconnect with its token takes it over as it was:
+    agent, uploaded datasets and paged tool results included. Snapshots of
+    credentials, model and history are written to the backend after every
+    turn; a session that is no longer parked (evicted, process restarted,
+    other worker) is rebuilt from its snapshot. ``SESSION_STORE`` picks the
+    backend: ``memory`` (default) or ``sqlite`` at ``SESSION_STORE_PATH``
+    (``sessions.db`` in ``DATA_DIR`` by default).
+    Snapshots expire after ``SESSION_TTL`` seconds without activity.
+    """
+
+    def __init__(self, backend=None):
+        ttl = float(os.getenv("SESSION_TTL", str(24 * 3600)))
+        if backend is None:
+            if os.getenv("SESSION_STORE", "memory").lower() == "sqlite":
+                backend = SQLiteSessionBackend(os.getenv("SESSION_STORE_PATH") or data_path("sessions.db"), ttl)
+            else:
+                backend = MemorySessionBackend(ttl, int(os.getenv("SESSION_STORE_MAX", "10000")))
+        self.backend = backend
+        self.parked = TTLCache(
+            ttl=float(os.getenv("SESSION_IDLE_TTL", "600")),
+            max_entries=int(os.getenv("SESSION_PARKED_MAX", "256")),
+            on_evict=self._release,
+        )
+
+    @staticmethod
+    def _release(token, session):
+        session.release()
+        logger.info(f"Evicted idle session {session.session_id}")
+
+    def park(self, session):
+        """Keep a disconnected session for a later resume"""
+        self.parked.expire()
+        self.parked.set(_token_key(session.token), session)
+
+    def take(self, token: str):
+        """Remove and return the parked session for ``token``, if any"""
+        self.parked.expire()
+        return self.parked.pop(_token_key(token))
+
+    async def save(self, session):
+        try:
+            await self.backend.save(session.token, session.snapshot())
+        except Exception as e:
+            logger.warning(f"Could not save session {session.session_id}: {e}")
+
+    async def load(self, token: str):
+        try:
+            return await self.backend.load(token)
+        except Exception as e:
+            logger.warning(f"Could not load session snapshot: {e}")
+            return None
+
+    async def forget(self, token: str):
+        session = self.take(token)
+        if session is not None:
+            session.release()
+        await self.backend.delete(token)
+
+    def stats(self) -> dict:
+        return {"parked": len(self.parked)}
+
+    def close(self):
+        self.parked.clear()
+        self.backend.close()
@@ -0,0 +1,221 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+from urllib.parse import parse_qs, urlsplit
+from .logger import logger
+from .session_store import data_path
+
+# Longest request line the acceptor peeks at for the ``route`` parameter
+MAX_REQUEST_LINE = 8192
+
+
+def worker_count() -> int:
+    """Worker processes to run: ``WEB_WORKERS`` as a number, or ``auto`` for one per CPU"""
+    value = os.getenv("WEB_WORKERS", "1").strip().lower()
+    if value == "auto":
+        return os.cpu_count() or 1
+    return max(1, int(value))
+
+
+def _worker_main(index: int, count: int, channel: socket.socket, client_class):
+    os.environ["WEB_WORKER_INDEX"] = str(index)
+    # Host-wide limits such as FILE_EXTRACTION_WORKERS are split between the workers
+    os.environ["WEB_WORKER_COUNT"] = str(count)
+    metrics_port = int(os.getenv("METRICS_PORT", "9202"))
+    if metrics_port > 0:
+        os.environ["METRICS_PORT"] = str(metrics_port + index)
+    # Ctrl-C reaches the whole process group; the supervisor decides how workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_serve_worker(channel, client_class))
+
+
+async def _serve_worker(channel: socket.socket, client_class):
+    stopping = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopping.set)
+    client = client_class()
+    channel.send(b"ready")
+    try:
+        await client.serve_connections(channel, stopping)
+        await client.drain(float(os.getenv("WORKER_DRAIN_TIMEOUT", "30")))
+    finally:
+        await client.cleanup()
+        channel.close()
+
+
+class Worker:
+    def __init__(self, index: int, process, channel: socket.socket):
+        self.index = index
+        self.process = process
+        self.channel = channel  # supervisor end of the socket pair connections are passed over
+
+
+class Supervisor:
+    """Serve one port from ``workers`` processes.
+
+    The supervisor owns the listening socket and hands each accepted
+    connection to a worker over a Unix socket pair; the worker does the
+    websocket handshake and runs the sessions (``serve_connections``).
+    Connections whose URL has ``?route=N`` (the ``route`` sent with
+    ``authenticated``) go to the same worker again, so a reconnect finds its
+    session parked in memory; others are spread round-robin. Workers share
+    session snapshots and tool results through SQLite files in ``DATA_DIR``,
+    so a session can still be resumed on another worker after a restart.
+
+    SIGHUP restarts the workers one at a time: the replacement takes over the
+    slot as soon as it is ready and the old worker drains (running queries
+    may finish for ``WORKER_DRAIN_TIMEOUT`` seconds). SIGTERM or SIGINT
+    drains all workers and exits. Crashed workers are replaced.
+    """
+
+    def __init__(self, client_class, host: str = "0.0.0.0", port: int = 9201, workers: int = 2):
+        self.client_class = client_class
+        self.host = host
+        self.port = port
+        self.workers = [None] * workers
+        self.drain_timeout = float(os.getenv("WORKER_DRAIN_TIMEOUT", "30"))
+        self.next_worker = 0
+        self.restarting = False
+        self.stopping = None
+        self.context = multiprocessing.get_context("spawn")
+        # Workers share sessions and tool results through files unless configured otherwise
+        os.environ.setdefault("SESSION_STORE", "sqlite")
+        os.environ.setdefault("TOOL_RESULT_SHARED_PATH", data_path("tool_results.db"))
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        listener = socket.create_server((self.host, self.port), backlog=1024)
+        listener.setblocking(False)
+        logger.info(f"Starting WebSocket server on {self.host}:{self.port} with {len(self.workers)} workers")
+        for index in range(len(self.workers)):
+            self.workers[index] = await self._spawn(index)
+        loop.add_signal_handler(signal.SIGTERM, self.stopping.set)
+        loop.add_signal_handler(signal.SIGINT, self.stopping.set)
+        loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(self.restart()))
+        tasks = [asyncio.ensure_future(self._accept(listener)), asyncio.ensure_future(self._watch())]
+        try:
+            await self.stopping.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            listener.close()
+            logger.info("Stopping workers")
+            await asyncio.gather(*(self._stop(worker) for worker in self.workers if worker is not None))
+
+    async def _spawn(self, index: int) -> Worker:
+        """Start a worker process and wait until it can take connections"""
+        parent, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        process = self.context.Process(target=_worker_main, args=(index, len(self.workers), child, self.client_class),
+                                       name=f"websocket-worker-{index}")
+        process.start()
+        child.close()
+        parent.setblocking(False)
+        try:
+            await asyncio.wait_for(asyncio.get_running_loop().sock_recv(parent, 16), timeout=60)
+        except asyncio.TimeoutError:
+            logger.warning(f"Worker {index} (pid {process.pid}) is slow to start")
+        logger.info(f"Worker {index} started (pid {process.pid})")
+        return Worker(index, process, parent)
+
+    async def _stop(self, worker: Worker):
+        """SIGTERM a worker and wait for it to drain"""
+        worker.process.terminate()
+        await asyncio.to_thread(worker.process.join, self.drain_timeout + 10)
+        if worker.process.is_alive():
+            logger.warning(f"Worker {worker.index} (pid {worker.process.pid}) did not drain in time, killing it")
+            worker.process.kill()
+            await asyncio.to_thread(worker.process.join)
+        worker.channel.close()
+
+    async def restart(self):
+        """Replace the workers one at a time without refusing connections"""
+        if self.restarting:
+            return
+        self.restarting = True
+        logger.info("Restarting workers")
+        try:
+            for index, old in enumerate(self.workers):
+                if self.stopping.is_set():
+                    break
+                self.workers[index] = await self._spawn(index)
+                asyncio.ensure_future(self._stop(old))
+        finally:
+            self.restarting = False
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(1)
+            if self.restarting:
+                continue
+            for index, worker in enumerate(self.workers):
+                if not worker.process.is_alive():
+                    logger.error(f"Worker {index} (pid {worker.process.pid}) exited with "
+                                 f"{worker.process.exitcode}, starting a new one")
+                    worker.channel.close()
+                    self.workers[index] = await self._spawn(index)
+
+    async def _accept(self, listener: socket.socket):
+        loop = asyncio.get_running_loop()
+        while True:
+            connection, _ = await loop.sock_accept(listener)
+            asyncio.ensure_future(self._dispatch(connection))
+
+    async def _dispatch(self, connection: socket.socket):
+        """Pass an accepted connection to the worker its route names, or the next one"""
+        try:
+            request_line = await self._peek_request_line(connection)
+            if request_line is None:
+                return
+            slot = self._route(request_line)
+            if slot is None:
+                slot = self.next_worker
+                self.next_worker = (self.next_worker + 1) % len(self.workers)
+            for offset in range(len(self.workers)):
+                worker = self.workers[(slot + offset) % len(self.workers)]
+                try:
+                    socket.send_fds(worker.channel, [b"c"], [connection.fileno()])
+                    return
+                except OSError as e:
+                    logger.warning(f"Could not pass a connection to worker {worker.index}: {e}")
+            logger.error("No worker could take the connection")
+        except Exception as e:
+            logger.error(f"Error dispatching connection: {e}")
+        finally:
+            connection.close()  # the worker holds its own copy
+
+    async def _peek_request_line(self, connection: socket.socket, timeout: float = 5):
+        """First line of the HTTP request, read without consuming it; None if the client went away"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            try:
+                head = connection.recv(MAX_REQUEST_LINE, socket.MSG_PEEK)
+            except BlockingIOError:
+                head = None
+            if head == b"":
+                return None
+            if head and (b"\r\n" in head or len(head) >= MAX_REQUEST_LINE):
+                return head.split(b"\r\n", 1)[0]
+            if loop.time() >= deadline:
+                return b""  # let the worker time the handshake out
+            if head is None:
+                readable = loop.create_future()
+                loop.add_reader(connection.fileno(), lambda: readable.done() or readable.set_result(None))
+                try:
+                    await asyncio.wait_for(readable, deadline - loop.time())
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    loop.remove_reader(connection.fileno())
+            else:
+                # Part of the line is buffered; it stays readable until the rest arrives
+                await asyncio.sleep(0.01)
+
+    def _route(self, request_line: bytes):
+        parts = request_line.decode("latin-1").split()
+        if len(parts) < 2:
+            return None
+        route = parse_qs(urlsplit(parts[1]).query).get("route", [""])[0]
+        return int(route) % len(self.workers) if route.isdigit() else None
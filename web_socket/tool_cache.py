@@ -0,0 +1,212 @@
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from langchain_core.tools import BaseTool
+from .cache import TTLCache
+from .logger import log_event, logger
+
+# Default result lifetimes (seconds) by tool-name substring, first match wins.
+# Metadata changes rarely; query results are only reused for a short window.
+DEFAULT_TOOL_TTLS = (("schema", 600), ("table", 600), ("query", 60))
+
+# Injected arguments that are not part of the tool call itself
+UNCACHEABLE_ARGS = ("runtime", "config", "callbacks")
+
+
+class SharedToolResults:
+    """Tool results shared by the worker processes of one host, in a SQLite file.
+
+    Second tier behind the in-process cache, enabled by
+    ``TOOL_RESULT_SHARED_PATH`` (the supervisor sets it for its workers).
+    Values are stored as JSON, so reading the file never runs code; it is
+    created readable by its owner only. Results that are not JSON (other
+    than the ``(content, artifact)`` tuples of MCP tools) stay process-local.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        if not os.path.exists(path):
+            os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS tool_results "
+            "(key TEXT PRIMARY KEY, scope TEXT NOT NULL, value TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS tool_results_scope ON tool_results (scope)")
+
+    @staticmethod
+    def _digest(value: tuple) -> str:
+        return hashlib.sha256(repr(value).encode()).hexdigest()
+
+    def _get(self, key: tuple):
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT value FROM tool_results WHERE key = ? AND expires > ?", (self._digest(key), time.time())
+            ).fetchone()
+        return self._decode(row[0]) if row else None
+
+    @staticmethod
+    def _encode(value) -> str:
+        # MCP tools return (content, artifact); JSON has no tuples, so they are tagged
+        if isinstance(value, tuple):
+            return json.dumps({"tuple": list(value)})
+        return json.dumps({"value": value})
+
+    @staticmethod
+    def _decode(text: str):
+        stored = json.loads(text)
+        return tuple(stored["tuple"]) if "tuple" in stored else stored["value"]
+
+    def _set(self, key: tuple, scope: tuple, value, ttl: float):
+        blob = self._encode(value)
+        now = time.time()
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO tool_results (key, scope, value, expires) VALUES (?, ?, ?, ?)",
+                (self._digest(key), self._digest(scope), blob, now + ttl),
+            )
+            self.connection.execute("DELETE FROM tool_results WHERE expires <= ?", (now,))
+
+    def _invalidate_scope(self, scope: tuple):
+        with self._lock:
+            self.connection.execute("DELETE FROM tool_results WHERE scope = ?", (self._digest(scope),))
+
+    async def get(self, key: tuple):
+        try:
+            return await asyncio.to_thread(self._get, key)
+        except Exception as e:
+            logger.warning(f"Shared tool result cache read failed: {e}")
+            return None
+
+    async def set(self, key: tuple, scope: tuple, value, ttl: float):
+        try:
+            await asyncio.to_thread(self._set, key, scope, value, ttl)
+        except Exception as e:
+            log_event("tool_cache.shared_skip", error=str(e))
+
+    def invalidate_scope(self, scope: tuple):
+        try:
+            self._invalidate_scope(scope)
+        except Exception as e:
+            logger.warning(f"Shared tool result cache invalidation failed: {e}")
+
+
+class ToolResultCache:
+    """Cache in front of MCP tools keyed by (scope, tool name, canonical arguments).
+
+    ``scope`` is the Incorta environment, tenant and user the tools were
+    discovered for; row-level security applies per user, so results are
+    never shared between users, in either tier. Lifetimes come from ``TOOL_RESULT_TTL_<TOOL_NAME>`` or
+    ``DEFAULT_TOOL_TTLS`` (``TOOL_RESULT_CACHE_TTL`` otherwise); a TTL of 0
+    disables caching for that tool. The cache is bounded by
+    ``TOOL_RESULT_CACHE_ENTRIES`` and ``TOOL_RESULT_CACHE_BYTES`` with LRU
+    eviction. Identical calls that are already in flight share one request,
+    which is cancelled once every caller waiting on it has been cancelled.
+    With ``TOOL_RESULT_SHARED_PATH`` set, results are also shared with the
+    other worker processes through ``SharedToolResults``.
+    """
+
+    def __init__(self):
+        self.default_ttl = float(os.getenv("TOOL_RESULT_CACHE_TTL", "120"))
+        self.cache = TTLCache(
+            ttl=self.default_ttl,
+            max_entries=int(os.getenv("TOOL_RESULT_CACHE_ENTRIES", "2048")),
+            max_size=int(os.getenv("TOOL_RESULT_CACHE_BYTES", str(64 * 1024 * 1024))),
+        )
+        self.tool_stats = {}  # tool name -> {"hits": int, "shared_hits": int, "misses": int}
+        shared_path = os.getenv("TOOL_RESULT_SHARED_PATH")
+        self.shared = SharedToolResults(shared_path) if shared_path else None
+        self._in_flight = {}
+        self._waiters = {}  # in-flight future -> number of callers waiting on it
+
+    def ttl_for(self, tool_name: str) -> float:
+        override = os.getenv(f"TOOL_RESULT_TTL_{tool_name.upper()}")
+        if override is not None:
+            return float(override)
+        for pattern, ttl in DEFAULT_TOOL_TTLS:
+            if pattern in tool_name.lower():
+                return ttl
+        return self.default_ttl
+
+    @staticmethod
+    def make_key(scope: tuple, tool_name: str, arguments: dict) -> tuple:
+        arguments = {k: v for k, v in arguments.items() if k not in UNCACHEABLE_ARGS}
+        return scope + (tool_name, json.dumps(arguments, sort_keys=True, separators=(",", ":"), default=str))
+
+    def _count(self, tool_name: str, outcome: str):
+        counters = self.tool_stats.setdefault(tool_name, {"hits": 0, "shared_hits": 0, "misses": 0})
+        counters[outcome] += 1
+
+    def wrap(self, tool: BaseTool, scope: tuple) -> BaseTool:
+        """Return a copy of ``tool`` whose calls go through the cache"""
+        original = tool.coroutine
+        ttl = self.ttl_for(tool.name)
+        if original is None or ttl <= 0:
+            return tool
+
+        @functools.wraps(original)
+        async def cached_call(*args, **kwargs):
+            key = self.make_key(scope, tool.name, kwargs)
+            result = self.cache.get(key)
+            if result is not None:
+                self._count(tool.name, "hits")
+                log_event("tool_cache.hit", tool=tool.name)
+                return result
+            future = self._in_flight.get(key)
+            if future is not None:
+                self._count(tool.name, "hits")
+            else:
+                future = asyncio.ensure_future(self._call(tool.name, key, scope, ttl, original, args, kwargs))
+                self._in_flight[key] = future
+                future.add_done_callback(functools.partial(self._finished, key, ttl))
+            return await self._join(future)
+
+        return tool.model_copy(update={"coroutine": cached_call})
+
+    async def _call(self, tool_name: str, key: tuple, scope: tuple, ttl: float, original, args, kwargs):
+        if self.shared is not None:
+            result = await self.shared.get(key)
+            if result is not None:
+                self._count(tool_name, "shared_hits")
+                return result
+        self._count(tool_name, "misses")
+        result = await original(*args, **kwargs)
+        if self.shared is not None:
+            await self.shared.set(key, scope, result, ttl)
+        return result
+
+    def _finished(self, key: tuple, ttl: float, future: asyncio.Future):
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+        if not future.cancelled() and future.exception() is None:
+            result = future.result()
+            self.cache.set(key, result, ttl=ttl, size=len(str(result)))
+
+    async def _join(self, future: asyncio.Future):
+        """Wait for a shared call; cancel it when the last waiting caller is cancelled"""
+        self._waiters[future] = self._waiters.get(future, 0) + 1
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if self._waiters[future] == 1:
+                future.cancel()
+            raise
+        finally:
+            self._waiters[future] -= 1
+            if not self._waiters[future]:
+                del self._waiters[future]
+
+    def invalidate_scope(self, scope: tuple):
+        self.cache.invalidate_where(lambda key: key[:len(scope)] == scope)
+        if self.shared is not None:
+            self.shared.invalidate_scope(scope)
+
+    def stats(self) -> dict:
+        return {**self.cache.stats(), "tools": {name: dict(c) for name, c in self.tool_stats.items()}}
@@ -0,0 +1,136 @@
+import hashlib
+import os
+import shutil
+import struct
+import tempfile
+import time
+import uuid
+from .logger import logger
+
+# Binary upload frame: 32-byte ASCII upload id, 8-byte big-endian offset, payload
+CHUNK_HEADER = struct.Struct(">32sQ")
+
+
+class UploadError(ValueError):
+    """Raised for invalid upload requests or chunks"""
+
+
+class Upload:
+    def __init__(self, upload_id: str, owner: tuple, name: str, size: int, mime_type: str, path: str):
+        self.upload_id = upload_id
+        self.owner = owner
+        self.name = name
+        self.size = size
+        self.mime_type = mime_type
+        self.path = path
+        self.received = 0
+        self.sha256 = hashlib.sha256()  # updated as chunks arrive, for the extraction cache
+        self.completed = False
+        self.updated_at = time.monotonic()
+
+    def as_file_data(self) -> dict:
+        """Descriptor accepted by extract_uploaded_file in place of base64 content"""
+        return {"name": self.name, "size": self.size, "type": self.mime_type,
+                "path": self.path, "sha256": self.sha256.hexdigest(), "upload_id": self.upload_id}
+
+
+class UploadStore:
+    """Chunked, resumable uploads streamed straight to disk.
+
+    Flow over the websocket:
+
+    1. ``upload_start`` {name, size, mime_type[, upload_id]} -> ``upload_ready``
+       {upload_id, offset, chunk_size}. Passing an existing ``upload_id``
+       resumes it from ``offset``, also from a new connection.
+    2. Binary frames ``CHUNK_HEADER`` + payload, each acknowledged with
+       ``upload_progress`` {upload_id, offset}. A chunk must start at the
+       current offset.
+    3. ``upload_finish`` {upload_id} -> ``upload_complete``. Queries then
+       refer to the file with ``upload_ids``.
+
+    Uploads are limited to ``MAX_UPLOAD_BYTES`` and removed after
+    ``UPLOAD_TTL`` seconds without activity.
+    """
+
+    def __init__(self, directory: str = None, max_bytes: int = None, ttl: float = None):
+        self.directory = directory or tempfile.mkdtemp(prefix="incorta-uploads-")
+        self.max_bytes = max_bytes or int(os.getenv("MAX_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+        self.ttl = ttl or float(os.getenv("UPLOAD_TTL", "3600"))
+        self.chunk_size = int(os.getenv("UPLOAD_CHUNK_SIZE", str(256 * 1024)))
+        self._uploads = {}
+
+    def _get(self, upload_id: str, owner: tuple) -> Upload:
+        upload = self._uploads.get(upload_id)
+        if upload is None or upload.owner != owner:
+            raise UploadError(f"Unknown upload: {upload_id}")
+        return upload
+
+    def start(self, owner: tuple, name: str, size: int, mime_type: str = None, upload_id: str = None) -> Upload:
+        self.sweep()
+        if upload_id:
+            upload = self._get(upload_id, owner)
+            if upload.completed:
+                raise UploadError(f"Upload {upload_id} is already complete")
+            return upload
+        size = int(size)
+        if size < 0 or size > self.max_bytes:
+            raise UploadError(f"File '{name}' is {size} bytes; the upload limit is {self.max_bytes} bytes")
+        upload_id = uuid.uuid4().hex
+        path = os.path.join(self.directory, upload_id + os.path.splitext(name)[1])
+        open(path, "wb").close()
+        upload = Upload(upload_id, owner, name, size, mime_type, path)
+        self._uploads[upload_id] = upload
+        logger.info(f"Upload {upload_id} started: {name} ({size} bytes)")
+        return upload
+
+    def write_chunk(self, frame: bytes, owner: tuple) -> Upload:
+        if len(frame) < CHUNK_HEADER.size:
+            raise UploadError("Upload chunk is missing its header")
+        raw_id, offset = CHUNK_HEADER.unpack_from(frame)
+        upload = self._get(raw_id.decode("ascii", "replace"), owner)
+        payload = memoryview(frame)[CHUNK_HEADER.size:]
+        if upload.completed:
+            raise UploadError(f"Upload {upload.upload_id} is already complete")
+        if offset != upload.received:
+            raise UploadError(f"Upload {upload.upload_id} expected offset {upload.received}, got {offset}")
+        if upload.received + len(payload) > upload.size:
+            raise UploadError(f"Upload {upload.upload_id} exceeds its declared size of {upload.size} bytes")
+        with open(upload.path, "r+b") as file:
+            file.seek(offset)
+            file.write(payload)
+        upload.sha256.update(payload)
+        upload.received += len(payload)
+        upload.updated_at = time.monotonic()
+        return upload
+
+    def finish(self, upload_id: str, owner: tuple) -> Upload:
+        upload = self._get(upload_id, owner)
+        if upload.received != upload.size:
+            raise UploadError(f"Upload {upload_id} is incomplete ({upload.received}/{upload.size} bytes)")
+        upload.completed = True
+        upload.updated_at = time.monotonic()
+        return upload
+
+    def get(self, upload_id: str, owner: tuple) -> Upload:
+        """Return a completed upload for use in a query"""
+        upload = self._get(upload_id, owner)
+        if not upload.completed:
+            raise UploadError(f"Upload {upload_id} is not finished")
+        upload.updated_at = time.monotonic()
+        return upload
+
+    def discard(self, upload_id: str):
+        upload = self._uploads.pop(upload_id, None)
+        if upload is not None and os.path.exists(upload.path):
+            os.unlink(upload.path)
+
+    def sweep(self):
+        """Remove uploads that have been idle for longer than the TTL"""
+        now = time.monotonic()
+        for upload_id in [u.upload_id for u in self._uploads.values() if now - u.updated_at > self.ttl]:
+            logger.info(f"Upload {upload_id} expired")
+            self.discard(upload_id)
+
+    def close(self):
+        self._uploads.clear()
+        shutil.rmtree(self.directory, ignore_errors=True)